@@ -0,0 +1,106 @@
+"""
+Measures the peak memory and time to first byte of GET /instances/ through captain_web's WSGI app, comparing
+the Flask-RESTful resource which returned the whole list, encoded with one json.dumps, with the streamed
+response. The connection is stubbed with an in-memory list, so only the web layer is measured.
+Each path runs in its own process, as peak RSS only ever grows.
+
+    $ python benchmarks/json_stream_benchmark.py [instances]
+"""
+import json
+import logging
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, root)
+os.environ.setdefault("SLUG_RUNNER_COMMAND", "")
+os.environ.setdefault("SLUG_RUNNER_IMAGE", "")
+os.environ.setdefault("DOCKER_NODES", "http://node-1:2375")
+os.environ.setdefault("LOG_CONFIG_FILE_PATH", os.path.join(root, "logging.conf"))
+
+from flask.ext import restful
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+import captain_web
+
+
+class StubConnection(object):
+
+    def __init__(self, instances):
+        self.instances = instances
+
+    def get_instances(self):
+        return self.instances
+
+    def get_inventory_version(self):
+        return None
+
+    def get_inventory_age(self):
+        return None
+
+
+class RestfulInstances(restful.Resource):
+    # RestInstances.get as it was before list responses were streamed
+    def get(self):
+        return captain_web.get_captain_conn().get_instances()
+
+
+captain_web.api.add_resource(RestfulInstances, '/benchmark/restful_instances')
+paths = {"restful": "/benchmark/restful_instances", "streamed": "/instances/"}
+
+
+def build_instances(count):
+    random.seed(0)
+    instances = []
+    for i in range(count):
+        container_id = "{:064x}".format(random.getrandbits(256))
+        instances.append({"id": container_id,
+                          "app": "app-{}".format(i % 200),
+                          "node": "app-{}".format(i % 50),
+                          "ip": "10.0.{}.{}".format(i / 250 % 250, i % 250),
+                          "port": 9000 + i % 1000,
+                          "running": True,
+                          "slots": 2,
+                          "slug_uri": "https://host/app-{}_{}.tgz".format(i % 200, i),
+                          "environment": dict(("SETTING_{}".format(s), "x" * 40) for s in range(20))})
+    return instances
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def measure(path, count):
+    instances = build_instances(count)
+    captain_web.get_captain_conn = lambda: StubConnection(instances)
+    logging.disable(logging.CRITICAL)
+    environ = EnvironBuilder(path=paths[path]).get_environ()
+    baseline_mb = peak_rss_mb()
+    started_at = time.time()
+    app_iter, status, headers = run_wsgi_app(captain_web.app, environ)
+    first_byte_secs = None
+    response_bytes = 0
+    for chunk in app_iter:
+        if chunk and first_byte_secs is None:
+            first_byte_secs = time.time() - started_at
+        response_bytes += len(chunk)
+    print json.dumps({"first_byte_secs": first_byte_secs,
+                      "total_secs": time.time() - started_at,
+                      "bytes": response_bytes,
+                      "extra_rss_mb": peak_rss_mb() - baseline_mb})
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "--path":
+        measure(sys.argv[2], int(sys.argv[3]))
+        sys.exit(0)
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print "Serving GET /instances/ with {} instances".format(count)
+    for name, path in [("Flask-RESTful, whole list", "restful"), ("streamed, 64KB chunks", "streamed")]:
+        result = json.loads(subprocess.check_output([sys.executable, __file__, "--path", path, str(count)]))
+        print "{:<32} first byte {:>7.3f}s total {:>7.3f}s {:>8.1f} MB sent {:>8.1f} MB peak RSS above baseline".format(
+            name, result["first_byte_secs"], result["total_secs"], result["bytes"] / 1024.0 / 1024, result["extra_rss_mb"])
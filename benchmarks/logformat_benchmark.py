@@ -0,0 +1,58 @@
+"""
+Measures the throughput of encoding log lines for the logs endpoint, comparing the JSON message per line
+Captain has always sent with batched JSON messages and the plain text passthrough.
+
+    $ python benchmarks/logformat_benchmark.py [megabytes]
+"""
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from captain.logstream import batch_messages
+
+
+def build_lines(size_bytes):
+    random.seed(0)
+    lines = []
+    total = 0
+    while total < size_bytes:
+        lines.append("x" * random.randint(40, 400) + "\n")
+        total += len(lines[-1])
+    return lines
+
+
+def per_line(lines):
+    return ("{}\n".format(json.dumps(l)) for l in ({"msg": m} for m in lines))
+
+
+def batched(lines):
+    return ("{}\n".format(json.dumps({"msgs": b})) for b in batch_messages(iter(lines)))
+
+
+def plain_text(lines):
+    return ("".join(b) for b in batch_messages(iter(lines)))
+
+
+def measure(name, lines, encode):
+    started_at = time.time()
+    writes = 0
+    response_bytes = 0
+    for chunk in encode(lines):
+        writes += 1
+        response_bytes += len(chunk)
+    elapsed = time.time() - started_at
+    print "{:<30} {:>8.1f} MB/s {:>11.0f} lines/s {:>9} writes {:>7.3f}s".format(
+        name, response_bytes / elapsed / 1024 / 1024, len(lines) / elapsed, writes, elapsed)
+
+
+if __name__ == "__main__":
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    lines = build_lines(megabytes * 1024 * 1024)
+    print "Encoding {}MB of log lines ({} lines)".format(megabytes, len(lines))
+    measure("JSON message per line", lines, per_line)
+    measure("batched JSON, 64KB batches", lines, batched)
+    measure("plain text, 64KB batches", lines, plain_text)
@@ -0,0 +1,80 @@
+"""
+Measures the throughput of demultiplexing a docker log stream, comparing the iter_content(10) helper
+Captain used to patch into docker-py with captain.logstream.
+
+    $ python benchmarks/logstream_benchmark.py [megabytes]
+"""
+import os
+import random
+import struct
+import sys
+import time
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from captain.logstream import LogDemultiplexer, read_frames
+
+
+def build_stream(size_bytes):
+    random.seed(0)
+    frames = []
+    total = 0
+    while total < size_bytes:
+        payload = "x" * random.randint(40, 400) + "\n"
+        frames.append(struct.pack('>BxxxL', random.choice([1, 2]), len(payload)) + payload)
+        total += len(frames[-1])
+    return "".join(frames)
+
+
+def iter_content(data, chunk_size):
+    stream = StringIO(data)
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def previous_helper(chunks):
+    # The helper previously patched over docker-py's _multiplexed_socket_stream_helper, fed by iter_content(10)
+    data_buffer = ""
+    length = None
+    while True:
+        try:
+            data_buffer += chunks.next()
+        except StopIteration:
+            return
+        if not length and len(data_buffer) > 8:
+            header = data_buffer[:8]
+            _, length = struct.unpack('>BxxxL', header)
+
+        if length and len(data_buffer[8:]) >= length:
+            yield data_buffer[8:8 + length]
+            data_buffer = data_buffer[8 + length:]
+            length = None
+            continue
+
+
+def measure(name, data, demultiplex):
+    started_at = time.time()
+    frames = 0
+    payload_bytes = 0
+    for payload in demultiplex(data):
+        frames += 1
+        payload_bytes += len(payload)
+    elapsed = time.time() - started_at
+    print "{:<40} {:>8.1f} MB/s {:>9} frames {:>7.3f}s".format(name, len(data) / elapsed / 1024 / 1024, frames, elapsed)
+    return payload_bytes
+
+
+if __name__ == "__main__":
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    data = build_stream(megabytes * 1024 * 1024)
+    print "Demultiplexing {}MB of docker log frames".format(megabytes)
+    results = [
+        measure("previous helper, iter_content(10)", data, lambda d: previous_helper(iter_content(d, 10))),
+        measure("read_frames, exact reads", data, lambda d: (p for s, p in read_frames(StringIO(d).read))),
+        measure("LogDemultiplexer, 64KB chunks", data, lambda d: (p for s, p in LogDemultiplexer().frames(iter_content(d, 65536))))
+    ]
+    assert len(set(results)) == 1, "demultiplexers disagree"
@@ -0,0 +1,124 @@
+import logging
+import os
+import threading
+from collections import deque
+
+
+class InstanceChangeLog(object):
+    """
+    A bounded log of the changes between successive lists of every instance. Every change is a new generation
+    and is kept until max_changes newer changes push it out.
+    Tokens name a generation of this log, "<epoch>-<generation>", and are meaningless to any other log.
+    Instances of this class are thread safe.
+    """
+
+    def __init__(self, max_changes=10000):
+        self.logger = logging.getLogger(__name__)
+        self.epoch = os.urandom(6).encode("hex")
+        self.condition = threading.Condition()
+        self.instances = {}
+        self.generation = 0
+        self.changes = deque(maxlen=max_changes)
+        # Changes of this generation and earlier have been pushed out of the log
+        self.truncated_generation = 0
+        self.watchers = 0
+
+    def record(self, node_instances):
+        """
+        Records the current instances of every node, a dict of node name to instances, returning the current token.
+        A node missing from the dict couldn't be listed, which says nothing about its instances, so the last known
+        ones are kept.
+        """
+        with self.condition:
+            current = dict((instance_id, instance) for instance_id, instance in self.instances.items()
+                           if instance["node"] not in node_instances)
+            for instances in node_instances.values():
+                for instance in instances:
+                    current[instance["id"]] = instance
+            return self.__apply(current)
+
+    def remove_node(self, node):
+        """
+        Records every instance of a node which has left the cluster as removed.
+        """
+        with self.condition:
+            self.__apply(dict((instance_id, instance) for instance_id, instance in self.instances.items()
+                              if instance["node"] != node))
+
+    def snapshot(self):
+        """
+        Returns the current token and the list of every instance at that generation.
+        """
+        with self.condition:
+            return self.__token(), self.instances.values()
+
+    def changes_since(self, token):
+        """
+        Returns the changes made after the generation named by token, each with the token of its own generation,
+        or None if those changes are no longer in the log or the token isn't one of this log's.
+        """
+        generation = self.__parse_token(token)
+        with self.condition:
+            if generation is None or generation < self.truncated_generation or generation > self.generation:
+                return None
+            return [dict(change, token=self.__token(change_generation))
+                    for change_generation, change in self.changes if change_generation > generation]
+
+    def wait(self, token, timeout_secs):
+        """
+        Waits at most timeout_secs for a generation newer than the one named by token.
+        """
+        generation = self.__parse_token(token)
+        with self.condition:
+            if generation == self.generation:
+                self.condition.wait(timeout_secs)
+
+    def add_watcher(self):
+        with self.condition:
+            self.watchers += 1
+
+    def remove_watcher(self):
+        with self.condition:
+            self.watchers -= 1
+
+    def get_stats(self):
+        with self.condition:
+            return {"token": self.__token(),
+                    "instances": len(self.instances),
+                    "changes": len(self.changes),
+                    "truncated_generation": self.truncated_generation,
+                    "watchers": self.watchers}
+
+    def __apply(self, current):
+        """
+        Replaces the instances with current, logging the differences as changes. The caller holds the condition.
+        """
+        changes = []
+        for instance_id, instance in current.items():
+            previous = self.instances.get(instance_id)
+            if previous is None:
+                changes.append({"type": "added", "instance": instance})
+            elif previous != instance:
+                changes.append({"type": "modified", "instance": instance})
+        for instance_id, instance in self.instances.items():
+            if instance_id not in current:
+                changes.append({"type": "removed", "instance": instance})
+        if changes:
+            self.instances = current
+            for change in changes:
+                if len(self.changes) == self.changes.maxlen:
+                    self.truncated_generation = self.changes[0][0]
+                self.generation += 1
+                self.changes.append((self.generation, change))
+            self.logger.debug(dict(message="Recorded {} instance changes, now at generation {}".format(len(changes), self.generation)))
+            self.condition.notify_all()
+        return self.__token()
+
+    def __token(self, generation=None):
+        return "{}-{}".format(self.epoch, self.generation if generation is None else generation)
+
+    def __parse_token(self, token):
+        epoch, _, generation = (token or "").rpartition("-")
+        if epoch != self.epoch or not generation.isdigit():
+            return None
+        return int(generation)
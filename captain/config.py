@@ -11,16 +11,56 @@ class Config(object):
         self.aws_call_interval_secs = int(os.getenv("AWS_CALL_INTERVAL_SECS", "60"))
         self.aws_docker_host_tag_name = os.getenv("AWS_DOCKER_HOST_TAG_NAME", "role")
         self.aws_docker_host_tag_value = os.getenv("AWS_DOCKER_HOST_TAG_VALUE")
+        # How often the node resolver is asked for the current set of nodes, 0 disables it
+        self.node_refresh_interval_secs = int(os.getenv("NODE_REFRESH_INTERVAL_SECS", "60"))
+        # Connect to every node when the app starts rather than on first use
+        self.node_warm_up_enabled = os.getenv("NODE_WARM_UP_ENABLED", "false").lower() == "true"
+        # Nodes taking longer than this to be pinged and listed are reported as slow
+        self.node_slow_response_secs = int(os.getenv("NODE_SLOW_RESPONSE_SECS", "2"))
         if len(self.docker_nodes) > 0 and self.aws_docker_host_tag_value is not None:
             raise Exception("DOCKER_NODES and AWS_DOCKER_HOST_TAG_VALUE are mutually exclusive")
 
         self.docker_gc_grace_period = int(os.getenv("DOCKER_GC_GRACE_PERIOD", "86400"))
+        # Exited containers are garbage collected in the background, 0 disables it
+        self.docker_gc_interval_secs = int(os.getenv("DOCKER_GC_INTERVAL_SECS", "300"))
+        self.docker_gc_batch_size = int(os.getenv("DOCKER_GC_BATCH_SIZE", "50"))
+        self.docker_gc_max_removals_per_sec = int(os.getenv("DOCKER_GC_MAX_REMOVALS_PER_SEC", "5"))
+        self.docker_gc_node_concurrency = int(os.getenv("DOCKER_GC_NODE_CONCURRENCY", "2"))
+        # Nodes reaped at once, on the reaper's own threads so gc never queues requests behind it
+        self.docker_gc_node_parallelism = int(os.getenv("DOCKER_GC_NODE_PARALLELISM", "4"))
         self.docker_timeout = int(os.getenv("DOCKER_TIMEOUT", "15"))
+        # Kept alive connections per node, when blocking callers wait for a free connection instead of opening another
+        self.docker_pool_maxsize = int(os.getenv("DOCKER_POOL_MAXSIZE", "16"))
+        self.docker_pool_block = os.getenv("DOCKER_POOL_BLOCK", "false").lower() == "true"
+        # Inspected containers are cached per node, entries expire after the TTL when it is greater than 0
+        self.inspect_cache_max_entries_per_node = int(os.getenv("INSPECT_CACHE_MAX_ENTRIES_PER_NODE", "1024"))
+        self.inspect_cache_ttl_secs = int(os.getenv("INSPECT_CACHE_TTL_SECS", "0"))
+        # Calls to every node share one pool of workers_per_node threads per node, capped at max_workers
+        self.fanout_workers_per_node = int(os.getenv("FANOUT_WORKERS_PER_NODE", "2"))
+        self.fanout_max_workers = int(os.getenv("FANOUT_MAX_WORKERS", "64"))
+
+        # Opt-in background inventory, 0 disables it and every read goes to the docker nodes
+        self.inventory_refresh_interval_secs = int(os.getenv("INVENTORY_REFRESH_INTERVAL_SECS", "0"))
+        # Apply each node's docker events to the inventory between refreshes
+        self.inventory_events_enabled = os.getenv("INVENTORY_EVENTS_ENABLED", "false").lower() == "true"
+        # How often the instance list is checked for changes to send to watchers, 0 disables it
+        self.instance_watch_interval_secs = int(os.getenv("INSTANCE_WATCH_INTERVAL_SECS", "5"))
+        # Where known instances are periodically saved to and restored from on boot, unset disables it
+        self.snapshot_path = os.getenv("SNAPSHOT_PATH")
+        self.snapshot_interval_secs = int(os.getenv("SNAPSHOT_INTERVAL_SECS", "60"))
 
         # Assumed 16GB RAM, 128MB per container with 2-3GB reserved for OS
         self.slots_per_node = int(os.getenv("SLOTS_PER_NODE", "110"))
         self.slot_memory_mb = int(os.getenv("SLOT_MEMORY_MB", "128"))
         self.default_slots_per_instance = int(os.getenv("DEFAULT_SLOTS_PER_INSTANCE", "2"))
+        # How nodes are chosen when an instance is started without one: binpack, spread or app-spread
+        self.placement_strategy = os.getenv("PLACEMENT_STRATEGY", "spread")
+        # How many containers a batch start creates concurrently on each node
+        self.batch_node_parallelism = int(os.getenv("BATCH_NODE_PARALLELISM", "4"))
+        # Threads shared by every batch start and stop, so that they never take the threads reads fan out on
+        self.batch_max_workers = int(os.getenv("BATCH_MAX_WORKERS", "16"))
+        # The most instances a single batch start may ask for
+        self.batch_max_instances = int(os.getenv("BATCH_MAX_INSTANCES", "100"))
 
         self.slug_runner_command = os.getenv("SLUG_RUNNER_COMMAND")
         if self.slug_runner_command is None:
@@ -1,21 +1,51 @@
+import json
+import socket
+import threading
+import time
 import uuid
 
 import docker
 
 from urlparse import urlparse
 from captain import exceptions
-# futures and datetime together do weird things
-#  https://mail.python.org/pipermail/python-list/2012-December/650103.html
-import datetime, _strptime
+from captain.changelog import InstanceChangeLog
+from captain.executor import FanOutExecutor
+from captain.index import InstanceIndex
+from captain.inspect_cache import InspectCache
+from captain.inventory import Inventory
+from captain.ledger import SlotLedger
+from captain.loghub import LogBroadcastHub
+from captain.logmerge import LogMerger
+from captain.logstream import LogDemultiplexer, batch_messages, iter_lines, read_frames, split_frames
+from captain.node_client import LazyDockerClient
+from captain.placement import get_placement_strategy
+from captain.reaper import ContainerReaper
+from captain.snapshot import Snapshotter
+from captain.worker import PeriodicWorker
+from requests.adapters import HTTPAdapter
 from requests.exceptions import ConnectionError, Timeout
-import struct
 import logging
 import logging.config
-from concurrent import futures
-from backports.functools_lru_cache import lru_cache as lru_cache
 from collections import Counter
 
-lru_cache_size = 1024
+# How often placement retries listing nodes which are missing from the slot ledger, once any node is known
+placement_seed_interval_secs = 30
+# Without an inventory a node's slot count is recounted before a start once it is older than this, catching
+# containers which died and starts made by other Captains
+ledger_max_age_secs = 30
+# tail and since are only honoured on the logs endpoint from this version of the docker remote API
+logs_api_version = "1.19"
+# How much of a log is read from docker at a time when it isn't being followed
+logs_chunk_size = 64 * 1024
+# Batched log responses group lines into batches of up to this many bytes, or however many arrived within the delay
+logs_batch_max_bytes = 64 * 1024
+logs_batch_max_delay_secs = 0.1
+# How many messages each instance of an app may have waiting in the merged log stream before it is paused
+app_logs_stream_buffer_size = 100
+# Watchers of the instance list are sent a heartbeat after this long without a change
+watch_heartbeat_secs = 30
+# Instance ids shorter than this are too likely to match the wrong container to be resolved by prefix
+min_instance_id_prefix_length = 4
 
 logger = logging.getLogger('connection')
 
@@ -24,117 +54,507 @@ class Connection(object):
     def __init__(self, config, docker_node_resolver, verify=False):
         self.config = config
         self.docker_node_resolver = docker_node_resolver
+        self.verify = verify
         self.node_connections = {}
+        self.node_uris = {}
+        # Held while a node is removed and while a listing records what it found, so that a listing which
+        # finishes after its node left can't put it back
+        self.node_lock = threading.Lock()
+        self.inventory = None
+        self.reaper = None
+        self.index = InstanceIndex()
+        self.log_hub = LogBroadcastHub()
+        self.changelog = InstanceChangeLog()
+        self.inspect_cache = InspectCache(config.inspect_cache_max_entries_per_node, config.inspect_cache_ttl_secs)
+        self.ledger = SlotLedger(config.slots_per_node)
+        self.placement_strategy = get_placement_strategy(config.placement_strategy)
+        self.placement_seeded_at = 0
+        self.placement_seed_lock = threading.Lock()
+        started_at = time.time()
         docker_nodes = self.docker_node_resolver.get_docker_nodes()
+        logger.info(dict(message="Resolved {} docker nodes in {:.3f}s".format(len(docker_nodes), time.time() - started_at)))
 
-        logger.debug(dict(message="Setting up docker clients for {} configured nodes".format(len(docker_nodes))))
-
+        # Clients connect on first use, see warm_up to connect them all up front
+        started_at = time.time()
         for node in docker_nodes:
-            try:
-                address = urlparse(node)
-                docker_conn = self.__get_connection(address)
-                docker_conn.verify = verify
-                docker_conn.auth = (address.username, address.password)
-                self.node_connections[address.hostname] = docker_conn
-            except Exception as e:
-                logger.exception('Could not obtain connection to docker node: {}. Exception: {}'.format(node, e))
-        logger.debug(dict(message='Nodes configured: {}'.format(self.node_connections)))
+            self.__add_node(node)
+        logger.info(dict(message="Set up clients for {} nodes in {:.3f}s".format(len(self.node_connections), time.time() - started_at)))
+        logger.debug(dict(message='Nodes configured: {}'.format(sorted(self.node_connections.keys()))))
+        self.executor = FanOutExecutor(len(self.node_connections), config.fanout_workers_per_node,
+                                       max_workers=config.fanout_max_workers)
+        # Batch starts and stops block on docker for seconds at a time, so they get a bounded pool of their own
+        # rather than queueing every read behind them on the shared one
+        self.batch_executor = FanOutExecutor(0, min_workers=config.batch_max_workers, max_workers=config.batch_max_workers)
+
+        if config.inventory_refresh_interval_secs > 0:
+            self.inventory = Inventory(self, config.inventory_refresh_interval_secs, config.inventory_events_enabled)
+
+        self.snapshotter = None
+        if config.snapshot_path:
+            self.snapshotter = Snapshotter(self, config.snapshot_path, config.snapshot_interval_secs)
+            self.snapshotter.restore()
+            self.snapshotter.start()
+
+        if self.inventory is not None:
+            # Started after restoring any snapshot, so that the first refresh revalidates it in the background
+            self.inventory.start()
+
+        if config.docker_gc_interval_secs > 0:
+            self.reaper = ContainerReaper(self, config.docker_gc_interval_secs, config.docker_gc_grace_period,
+                                          config.docker_gc_batch_size, config.docker_gc_max_removals_per_sec,
+                                          config.docker_gc_node_concurrency, config.docker_gc_node_parallelism)
+            self.reaper.start()
+
+        self.node_refresher = None
+        if config.node_refresh_interval_secs > 0:
+            self.node_refresher = PeriodicWorker("node-refresher", self.refresh_nodes, config.node_refresh_interval_secs)
+            self.node_refresher.start()
+
+        self.instance_watcher = None
+        if config.instance_watch_interval_secs > 0:
+            self.instance_watcher = PeriodicWorker("instance-watcher", self.__check_instances, config.instance_watch_interval_secs)
+            self.instance_watcher.start()
 
     def close(self):
+        if self.instance_watcher is not None:
+            self.instance_watcher.stop()
+        if self.node_refresher is not None:
+            self.node_refresher.stop()
+        if self.inventory is not None:
+            self.inventory.stop()
+        if self.reaper is not None:
+            self.reaper.stop()
+        if self.snapshotter is not None:
+            self.snapshotter.stop()
+        self.executor.shutdown(wait=False)
+        self.batch_executor.shutdown(wait=False)
         for node in self.node_connections:
             logger.debug(dict(message="Closing connection to {}".format(node)))
             if node is not None:
                 self.node_connections[node].close()
 
-    @lru_cache(maxsize=lru_cache_size)
-    def _get_lru_instance_details(self, node, container_id, container_status, public_port):
-        logger.debug(dict(message="Cache miss on node {} container {}".format(node, container_id)))
-        node_conn = self.node_connections[node]
-        node_container = node_conn.inspect_container(container_id)
+    def refresh_nodes(self):
+        """
+        Re-queries the node resolver and reconciles the configured nodes with its answer. Clients for new
+        nodes are added, unchanged nodes keep their clients, and removed nodes are closed and have all of
+        their cached state dropped. An empty answer is ignored rather than dropping the whole cluster.
+        Returns the names of the added and the removed nodes.
+        """
+        docker_nodes = self.docker_node_resolver.get_docker_nodes()
+        if not docker_nodes:
+            logger.warn(dict(message="Node resolver returned no nodes, keeping the {} configured".format(len(self.node_connections))))
+            return [], []
+        node_uris = {}
+        for docker_node in docker_nodes:
+            try:
+                node_uris[urlparse(docker_node).hostname] = docker_node
+            except ValueError as e:
+                logger.error(dict(message="Ignoring docker node {}: {}".format(docker_node, e)))
+        removed_nodes = [node for node, uri in self.node_uris.items() if node_uris.get(node) != uri]
+        for node in removed_nodes:
+            self.__remove_node(node)
+        added_nodes = [node for node in node_uris.keys() if node not in self.node_connections and self.__add_node(node_uris[node])]
+        if added_nodes or removed_nodes:
+            logger.info(dict(message="Nodes changed, added {} and removed {}".format(sorted(added_nodes), sorted(removed_nodes))))
+            self.executor.resize(len(self.node_connections))
+        return added_nodes, removed_nodes
+
+    def warm_up(self):
+        """
+        Connects to and pings every node concurrently, so that the first requests don't pay for it.
+        Returns the names of the nodes which could not be reached.
+        """
+        started_at = time.time()
+        failed_nodes = []
+        for node, future in self.executor.fan_out(lambda node: self.node_connections[node].ping(), self.node_connections.keys()):
+            if future.exception() is not None:
+                logger.error(dict(message="Could not warm up {}: {}".format(node, future.exception())))
+                failed_nodes.append(node)
+        logger.info(dict(message="Warmed up {} of {} nodes in {:.3f}s".format(len(self.node_connections) - len(failed_nodes),
+                                                                             len(self.node_connections), time.time() - started_at)))
+        return failed_nodes
+
+    def __add_node(self, docker_node):
+        try:
+            address = urlparse(docker_node)
+        except Exception as e:
+            logger.exception('Could not obtain connection to docker node: {}. Exception: {}'.format(docker_node, e))
+            return False
+        docker_conn = LazyDockerClient(address.hostname, lambda: self.__connect(address))
+        # Swap in a new dict, fan outs already iterating the old one are unaffected
+        node_connections = dict(self.node_connections)
+        node_connections[address.hostname] = docker_conn
+        self.node_connections = node_connections
+        self.node_uris[address.hostname] = docker_node
+        if self.inventory is not None:
+            self.inventory.add_node(address.hostname)
+        return True
+
+    def __remove_node(self, node):
+        with self.node_lock:
+            node_connections = dict(self.node_connections)
+            docker_conn = node_connections.pop(node, None)
+            self.node_connections = node_connections
+            self.node_uris.pop(node, None)
+            self.index.remove_node(node)
+            self.ledger.remove_node(node)
+            self.inspect_cache.remove_node(node)
+            self.changelog.remove_node(node)
+            if self.inventory is not None:
+                self.inventory.remove_node(node)
+        if self.reaper is not None:
+            self.reaper.remove_node(node)
+        if docker_conn is not None:
+            docker_conn.close()
+
+    def get_instance_details(self, node, container_id, public_port):
+        """
+        Returns the inspected details of a running container, from the inspect cache unless the cached
+        details are for a different public port, which means the container has been restarted since.
+        """
+        with self.node_lock:
+            # The cache is only touched while the node is still in the cluster, or its entries would come back
+            node_conn = self.node_connections.get(node)
+            if node_conn is None:
+                raise exceptions.NoSuchNodeException()
+            node_container = self.inspect_cache.get(node, container_id)
+        if node_container is None or int(node_container["NetworkSettings"]["Ports"]["8080/tcp"][0]["HostPort"]) != public_port:
+            logger.debug(dict(message="Cache miss on node {} container {}".format(node, container_id)))
+            node_container = node_conn.inspect_container(container_id)
+            with self.node_lock:
+                if self.node_connections.get(node) is node_conn:
+                    self.inspect_cache.put(node, node_container)
         return node_container
 
     def get_node_instances(self, node):
         node_conn = self.node_connections[node]
-        node_instances = []
+        return self.__inspect_node_containers(node, node_conn, self.__list_node_containers(node, node_conn))
+
+    def __list_node_containers(self, node, node_conn):
         node_containers = node_conn.containers(
-            quiet=False, all=True, trunc=False, latest=False,
+            quiet=False, all=False, trunc=False, latest=False,
             since=None, before=None, limit=-1)
-        logger.debug(dict(message="{} has {} containers".format(node, len(node_containers))))
-        exited_container_count = 0
-        deleted_container_count = 0
+        logger.debug(dict(message="{} has {} running containers".format(node, len(node_containers))))
+        return node_containers
+
+    def __inspect_node_containers(self, node, node_conn, node_containers):
+        """
+        Returns the instances among a node's listed containers, inspecting those which aren't cached, and records
+        them. Raises NoSuchNodeException if the node left the cluster while it was being listed.
+        """
+        node_instances = []
         for container in node_containers:
-            # Grab the first part of State to give uniqueness of container and state for the lru_cache
-            full_container_status = container["Status"]
-            container_status = full_container_status.split()[0] if full_container_status else full_container_status
-
+            # Exited containers are garbage collected by the ContainerReaper
             if not container["Status"].startswith("Up "):
-                exited_container_count += 1
-                logger.debug(dict(message="Found exited container on {}".format(node)))
-                node_container = self._get_lru_instance_details(node, container["Id"], container_status, 0)
-
-                formatted_create_time = node_container["Created"]
-                created_time = datetime.datetime.strptime(formatted_create_time.rstrip("Z").split('.')[0], '%Y-%m-%dT%H:%M:%S')
-                formatted_exit_time = node_container["State"]['FinishedAt']
-                exit_time = datetime.datetime.strptime(formatted_exit_time.rstrip("Z").split('.')[0], '%Y-%m-%dT%H:%M:%S')
-                if (datetime.datetime.now() - created_time).total_seconds() < self.config.docker_gc_grace_period or \
-                   (datetime.datetime.now() - exit_time).total_seconds() < self.config.docker_gc_grace_period:
-                    logger.debug(dict(message="Exited container {} on {} not older than gc period, ignoring".format(container["Id"], node)))
-                else:
-                    try:
-                        node_conn.remove_container(container["Id"])
-                        deleted_container_count += 1
-                        logger.warn(dict(message="Exited container {} on {} with exit time at {} older than gc period, removed".format(container["Id"], node, formatted_exit_time)))
-                    except docker.errors.APIError as e:
-                        if '404 Client Error' in e.message:
-                            logger.info(dict(message='Container already removed: {}'.format(container["Id"])))
-                        else:
-                            raise
-            elif "Ports" in container and len(container["Ports"]) == 1 and container["Ports"][0]["PrivatePort"] == 8080:
+                continue
+            if "Ports" in container and len(container["Ports"]) == 1 and container["Ports"][0]["PrivatePort"] == 8080:
                 public_port = container["Ports"][0]["PublicPort"]
                 try:
-                    node_container = self._get_lru_instance_details(node, container["Id"], container_status, public_port)
+                    node_container = self.get_instance_details(node, container["Id"], public_port)
                     node_instances.append(self.__get_instance(node, node_container))
                 except docker.errors.APIError as e:
                     if '404 Client Error' in e.message:
                         logger.info(dict(message='Container was deleted before being inspected: {}'.format(container["Id"])))
                     else:
                         raise
-        logger.debug('Found {} exited containers, {} were deleted'.format(exited_container_count, deleted_container_count))
+        with self.node_lock:
+            if self.node_connections.get(node) is not node_conn:
+                logger.info(dict(message="{} left the cluster while it was being listed, dropping the listing".format(node)))
+                raise exceptions.NoSuchNodeException()
+            self.inspect_cache.retain(node, [container["Id"] for container in node_containers])
+            self.index.update_node(node, node_instances)
+            self.ledger.reconcile(node, node_instances)
         return node_instances
 
+    def get_node_instance(self, node, container_id):
+        """
+        Inspects a single container on a node, returning it as an instance or None if it isn't one.
+        """
+        node_conn = self.node_connections[node]
+        try:
+            node_container = node_conn.inspect_container(container_id)
+        except docker.errors.APIError as e:
+            if '404 Client Error' in e.message:
+                logger.info(dict(message='Container {} on {} no longer exists'.format(container_id, node)))
+                return None
+            raise
+        if not node_container["NetworkSettings"]["Ports"] or not node_container["NetworkSettings"]["Ports"].get("8080/tcp"):
+            return None
+        with self.node_lock:
+            if self.node_connections.get(node) is node_conn:
+                self.inspect_cache.put(node, node_container)
+        return self.__get_instance(node, node_container)
+
+    def get_node_events(self, node):
+        """
+        Subscribes to a node's docker events, returning a generator of event dicts and a function which closes
+        the subscription, waking up any thread blocked reading it. The subscription is made before this method returns.
+        """
+        node_connection = self.node_connections[node]
+        # As docker.Client.events, but keeping hold of the response so that it can be closed
+        response = node_connection.get(node_connection._url("/events"), stream=True)
+        events_socket = node_connection._get_raw_response_socket(response)
+
+        def close():
+            try:
+                events_socket.shutdown(socket.SHUT_RDWR)
+            except socket.error as e:
+                logger.debug(dict(message="Shutting down the events stream of {} failed: {}".format(node, e)))
+            response.close()
+
+        return (json.loads(event) for event in node_connection._stream_helper(response)), close
+
+    def find_instance(self, instance_id):
+        """
+        Returns the last known state of the instance with the given id or short id, or None if no node is running it.
+        The index is consulted first and only a miss looks the container up on the nodes.
+        """
+        instance = self.index.lookup(instance_id)
+        if instance is not None:
+            return instance
+        return self.__locate_instance(instance_id)
+
+    def get_instance(self, instance_id):
+        """
+        Returns the current state of the instance with the given id or short id, or None if no node is running it.
+        Without a populated inventory an indexed instance is revalidated against its owning node only.
+        """
+        instance = self.index.lookup(instance_id)
+        if instance is not None and (self.inventory is None or not self.inventory.is_populated()):
+            instance = self.get_node_instance(instance["node"], instance["id"])
+            if instance is None:
+                self.record_removed_instance(instance_id)
+            else:
+                self.index.add(instance)
+        if instance is None:
+            instance = self.__locate_instance(instance_id)
+        return instance
+
+    def record_started_instance(self, instance):
+        self.index.add(instance)
+        self.ledger.add_instance(instance)
+        if self.inventory is not None:
+            self.inventory.add_instance(instance)
+
+    def record_removed_instance(self, instance_id):
+        instance = self.index.remove(instance_id)
+        if instance is not None:
+            self.ledger.remove_instance(instance)
+            self.inspect_cache.invalidate(instance["id"], instance["node"])
+        else:
+            self.inspect_cache.invalidate(instance_id)
+        if self.inventory is not None:
+            self.inventory.remove_instance(instance["id"] if instance is not None else instance_id)
+
+    def __locate_instance(self, instance_id):
+        logger.debug(dict(message="Instance {} is not indexed, looking it up on every node".format(instance_id)))
+        lookups = self.executor.fan_out(lambda node: self.get_node_instance(node, instance_id), self.node_connections.keys())
+        for node, future in lookups:
+            if future.exception() is not None:
+                logger.error(dict(message="Looking up {} on {} generated an exception: {}".format(instance_id, node, future.exception())))
+            elif future.result() is not None:
+                instance = future.result()
+                self.index.add(instance)
+                # Don't wait for the other nodes once the instance has been found
+                lookups.close()
+                return instance
+        return None
+
     def get_instances(self, node_filter=None):
+        """
+        Lists the instances on every node, or just the nodes in node_filter. Every listing of all the nodes is
+        recorded in the changelog.
+        """
+        if self.inventory is not None and self.inventory.is_populated():
+            logger.debug(dict(message="Serving instances from inventory generation {}".format(self.inventory.generation)))
+            instances_by_node = self.inventory.get_instances_by_node(node_filter)
+        else:
+            instances_by_node = self.fetch_instances_by_node(node_filter)
         instances = []
+        for node_instances in instances_by_node.values():
+            instances = instances + node_instances
+        if not node_filter:
+            # Nodes which couldn't be listed are missing, the changelog keeps their last known instances
+            with self.node_lock:
+                self.changelog.record(dict((node, node_instances) for node, node_instances in instances_by_node.items()
+                                           if node in self.node_connections))
+        return instances
+
+    def find_instances(self, app=None, nodes=None, fields=None, limit=None, after=None):
+        """
+        Returns a page of the instances of app on nodes, both optional, ordered by id and starting after the
+        id after, along with the id to start the next page after or None if this is the last page.
+        Only the nodes asked for are listed. fields limits each instance to the named fields.
+        """
+        instances = self.get_instances(node_filter=nodes)
+        if app is not None:
+            instances = [instance for instance in instances if instance["app"] == app]
+        if after is not None:
+            instances = [instance for instance in instances if instance["id"] > after]
+        instances.sort(key=lambda instance: instance["id"])
+        next_after = None
+        if limit is not None and len(instances) > limit:
+            instances = instances[:limit]
+            next_after = instances[-1]["id"]
+        if fields:
+            instances = [dict((field, instance[field]) for field in fields if field in instance) for instance in instances]
+        return instances, next_after
+
+    def watch_instances(self, token=None, heartbeat_secs=watch_heartbeat_secs):
+        """
+        Returns a generator of the changes to the instance list. It starts with a snapshot of every instance,
+        or if token names a generation still in the changelog, with just the changes made since. Every event
+        carries the token to resume from, a heartbeat is sent after heartbeat_secs without a change.
+        """
+        self.changelog.add_watcher()
+        try:
+            changes = self.changelog.changes_since(token) if token else None
+            if changes is None:
+                token = None
+            while True:
+                if token is None:
+                    self.get_instances()
+                    token, instances = self.changelog.snapshot()
+                    yield {"type": "snapshot", "token": token, "instances": instances}
+                else:
+                    for change in changes:
+                        token = change["token"]
+                        yield change
+                self.changelog.wait(token, heartbeat_secs)
+                changes = self.changelog.changes_since(token)
+                if changes is None:
+                    # Fell so far behind that the changes were pushed out of the changelog, start over
+                    logger.info(dict(message="Instance watcher at {} fell behind the changelog, resending a snapshot".format(token)))
+                    token = None
+                elif not changes:
+                    yield {"type": "heartbeat", "token": token}
+        finally:
+            self.changelog.remove_watcher()
+
+    def get_instance_changes(self, since=None):
+        """
+        Lists the instances and returns the changes made after the generation named by since, with the token
+        to ask from next time. When since is missing, or names changes no longer in the changelog, every
+        instance is returned instead, flagged as a resync.
+        """
+        self.get_instances()
+        changes = self.changelog.changes_since(since) if since else None
+        if changes is None:
+            token, instances = self.changelog.snapshot()
+            return {"token": token, "resync": True, "instances": instances}
+        return {"token": changes[-1]["token"] if changes else since, "resync": False, "changes": changes}
+
+    def get_changelog_stats(self):
+        return self.changelog.get_stats()
+
+    def __check_instances(self):
+        # Without an inventory checking means listing every node, which is only worth it while someone is watching
+        if self.changelog.watchers > 0 or (self.inventory is not None and self.inventory.is_populated()):
+            self.get_instances()
+
+    def get_inventory_age(self):
+        if self.inventory is None:
+            return None
+        return self.inventory.get_age_secs()
+
+    def get_inventory_version(self):
+        """
+        Returns the version of the inventory serving reads, or None when reads go to the nodes.
+        """
+        if self.inventory is None or not self.inventory.is_populated():
+            return None
+        return self.inventory.get_version()
+
+    def is_inventory_stale(self):
+        return self.inventory is not None and self.inventory.stale
+
+    def get_gc_stats(self):
+        if self.reaper is None:
+            return {"enabled": False}
+        return {"enabled": True, "nodes": self.reaper.get_stats()}
+
+    def get_cache_stats(self):
+        return self.inspect_cache.get_stats()
+
+    def clear_cache(self):
+        self.inspect_cache.clear()
+
+    def get_connection_stats(self):
+        return dict((node, docker_conn.get_pool_stats()) for node, docker_conn in self.node_connections.items())
+
+    def get_log_stream_stats(self):
+        return self.log_hub.get_stats()
+
+    def get_executor_stats(self):
+        return dict(self.executor.get_stats(), batch=self.batch_executor.get_stats())
+
+    def get_inventory_stats(self):
+        if self.inventory is None:
+            return {"enabled": False}
+        stats = self.inventory.get_stats()
+        stats["enabled"] = True
+        return stats
+
+    def fetch_instances_by_node(self, node_filter=None):
+        """
+        Lists the instances on every node, or just the nodes in node_filter, bypassing the inventory.
+        Returns a dict of node name to instances, nodes which could not be listed are omitted.
+        """
+        if isinstance(node_filter, basestring):
+            node_filter = [node_filter]
+        instances = {}
         filtered_nodes = {}
         for node, node_conn in self.node_connections.items():
-            if node_filter and node != node_filter:
+            if node_filter and node not in node_filter:
                 logger.debug(dict(message="Filtering node {}".format(node)))
                 continue
             filtered_nodes[node] = node_conn
-        with futures.ThreadPoolExecutor(max_workers=8) as executor:
-            future_to_instances = dict((executor.submit(self.get_node_instances, node), node) for node, node_conn in filtered_nodes.items())
-            for future in futures.as_completed(future_to_instances):
-                node = future_to_instances[future]
-                try:
-                    instances = instances + future.result()
-                    logger.debug(dict(message="Get instances for {} found {}".format(node, len(future.result()))))
-                except Exception as e:
-                    logger.error(dict(message="Getting instances from {} generated an exception: {}".format(node, e)))
+        for node, future in self.executor.fan_out(self.get_node_instances, filtered_nodes.keys()):
+            try:
+                instances[node] = future.result()
+                logger.debug(dict(message="Get instances for {} found {}".format(node, len(future.result()))))
+            except Exception as e:
+                logger.error(dict(message="Getting instances from {} generated an exception: {}".format(node, e)))
         return instances
 
     def get_node(self, name):
         if name not in self.node_connections:
             logger.error(dict(message="Node {} not configured".format(name)))
             raise exceptions.NoSuchNodeException()
+        return self.__scan_node(name, self.inventory is not None and self.inventory.is_populated())
+
+    def get_nodes(self):
+        """
+        Pings and lists every node once, in a single fan out, and works out each node's slot usage
+        and health from that one pass.
+        """
+        from_inventory = self.inventory is not None and self.inventory.is_populated()
+        nodes = []
+        for node, future in self.executor.fan_out(lambda name: self.__scan_node(name, from_inventory), self.node_connections.keys()):
+            if future.exception() is not None:
+                logger.error(dict(message="Getting details for {} generated an exception: {}".format(node, type(future.exception()))))
+            else:
+                nodes = nodes + [future.result()]
+                logger.debug(dict(message="Got details for {}".format(node)))
+        return nodes
+
+    def __scan_node(self, name, from_inventory):
+        """
+        Pings a node and counts the slots used on it, listing it unless the inventory can answer.
+        A node which took longer than config.node_slow_response_secs to be pinged and listed is reported as slow.
+        Inspecting its containers isn't counted, an empty inspect cache says nothing about the node.
+        """
+        started_at = time.time()
         try:
-            self.node_connections[name].ping()
-            countainer_count = reduce(lambda x, y: x + y["slots"], self.get_instances(node_filter=name), 0)
-            logger.debug(dict(message="{} has {} containers".format(name, countainer_count)))
-            return {"id": name,
-                    "slots": {
-                        "total": self.config.slots_per_node,
-                        "used": countainer_count,
-                        "free": self.config.slots_per_node - countainer_count},
-                    "state": "healthy"}
+            node_conn = self.node_connections[name]
+            node_conn.ping()
+            if from_inventory:
+                response_secs = time.time() - started_at
+                node_instances = self.inventory.get_instances(name)
+            else:
+                node_containers = self.__list_node_containers(name, node_conn)
+                response_secs = time.time() - started_at
+                node_instances = self.__inspect_node_containers(name, node_conn, node_containers)
         except (ConnectionError, Timeout) as e:
             logger.error(dict(message="Error communication with {}: {}".format(name, e)))
             return {"id": name,
@@ -143,19 +563,14 @@ class Connection(object):
                         "used": 0,
                         "free": 0},
                     "state": repr(e)}
-
-    def get_nodes(self):
-        nodes = []
-        with futures.ThreadPoolExecutor(max_workers=8) as executor:
-            future_to_nodes = dict((executor.submit(self.get_node, node), node) for node in self.node_connections.keys())
-            for future in futures.as_completed(future_to_nodes):
-                node = future_to_nodes[future]
-                if future.exception() is not None:
-                    logger.error(dict(message="Getting details for {} generated an exception: {}".format(node, type(future.exception()))))
-                else:
-                    nodes = nodes + [future.result()]
-                    logger.debug(dict(message="Got details for {}".format(node)))
-        return nodes
+        countainer_count = reduce(lambda x, y: x + y["slots"], node_instances, 0)
+        logger.debug(dict(message="{} has {} containers, answered in {:.3f}s".format(name, countainer_count, response_secs)))
+        return {"id": name,
+                "slots": {
+                    "total": self.config.slots_per_node,
+                    "used": countainer_count,
+                    "free": self.config.slots_per_node - countainer_count},
+                "state": "slow" if response_secs > self.config.node_slow_response_secs else "healthy"}
 
     def get_instance_summary(self):
         summary = {"total_instances": 0}
@@ -170,19 +585,143 @@ class Connection(object):
         logger.debug(dict(message="Returning summary {}".format(summary)))
         return summary
 
-    def start_instance(self, app, slug_uri, node, allocated_port=None, environment={}, slots=None, hostname=None, slug_runner_version=None):
+    def start_instance(self, app, slug_uri, node=None, allocated_port=None, environment={}, slots=None, hostname=None, slug_runner_version=None):
         environment["PORT"] = "8080"
         environment["SLUG_URL"] = slug_uri
 
         if not slots:
             logger.info(dict(message="Setting default slots for {}".format(app)))
             slots = self.config.default_slots_per_instance
-        current_slot_count = sum([
-            instance["slots"] for instance in self.get_instances()
-            if instance['node'] == node])
-        if current_slot_count + slots > self.config.slots_per_node:
-            raise exceptions.NodeOutOfCapacityException()
+        node, reservation = self.__reserve_node(app, node, slots)
+        try:
+            return self.__start_container(app, node, environment, slots, hostname, slug_runner_version)
+        finally:
+            self.ledger.release(reservation)
+
+    def start_instances(self, instance_requests):
+        """
+        Starts many instances, each request taking the same arguments as start_instance.
+        Every instance is placed and has its slots reserved up front, then the containers are started
+        concurrently on the batch executor with at most config.batch_node_parallelism starts in flight per node.
+        Returns a result per request, in request order, so that partial failures can be reported.
+        """
+        results = [None] * len(instance_requests)
+        planned = []
+        planned_app_node_counts = {}
+        for i, instance_request in enumerate(instance_requests):
+            try:
+                app = instance_request["app"]
+                environment = dict(instance_request.get("environment") or {})
+                environment["PORT"] = "8080"
+                environment["SLUG_URL"] = instance_request["slug_uri"]
+                slots = instance_request.get("slots") or self.config.default_slots_per_instance
+                app_node_counts = planned_app_node_counts.setdefault(app, Counter())
+                node, reservation = self.__reserve_node(app, instance_request.get("node"), slots, app_node_counts)
+                app_node_counts[node] += 1
+                planned.append((i, reservation, dict(app=app, node=node, environment=environment, slots=slots,
+                                                     hostname=instance_request.get("hostname"),
+                                                     slug_runner_version=instance_request.get("slug_runner_version"))))
+            except Exception as e:
+                logger.error(dict(message="Could not place instance {} of batch: {}".format(i, repr(e))))
+                results[i] = self.__failed_start_result(i, e)
+        if not planned:
+            return results
 
+        def start_planned(planned_start):
+            i, reservation, start_args = planned_start
+            try:
+                return self.__start_container(**start_args)
+            finally:
+                self.ledger.release(reservation)
+
+        starts = self.batch_executor.fan_out_by_key(start_planned, planned, lambda planned_start: planned_start[2]["node"],
+                                                    self.config.batch_node_parallelism)
+        for (i, reservation, start_args), future in starts:
+            if future.exception() is not None:
+                logger.error(dict(message="Starting instance {} of batch generated an exception: {}".format(i, repr(future.exception()))))
+                results[i] = self.__failed_start_result(i, future.exception())
+            else:
+                results[i] = {"index": i, "status": "started", "instance": future.result()}
+        return results
+
+    def __failed_start_result(self, i, e):
+        return {"index": i, "status": "failed", "error": type(e).__name__, "message": str(e)}
+
+    def choose_nodes(self, app, slots, planned_app_node_counts=None):
+        """
+        Returns the nodes with enough free slots for an instance of the app, best first according to the
+        placement strategy. Only cached usage is consulted, nodes missing from the slot ledger are listed first,
+        see __seed_placement.
+        planned_app_node_counts holds instances of the app being placed alongside this one which are not running yet.
+        """
+        if any(not self.ledger.is_known(node) for node in self.node_connections.keys()):
+            self.__seed_placement()
+        app_node_counts = Counter(self.index.get_app_node_counts(app))
+        if planned_app_node_counts:
+            app_node_counts.update(planned_app_node_counts)
+        candidates = [{"id": node, "used": self.ledger.get_used(node), "app_instances": app_node_counts[node]}
+                      for node in self.node_connections.keys() if self.ledger.is_known(node)]
+        candidates = [c for c in candidates if c["used"] + slots <= self.config.slots_per_node]
+        return [candidate["id"] for candidate in self.placement_strategy.rank_nodes(candidates, app, slots)]
+
+    def __seed_placement(self):
+        """
+        Lists the nodes missing from the slot ledger. Placements made while a listing is in flight wait for it
+        rather than finding no candidates. Once any node is known the rest are listed at most once every
+        placement_seed_interval_secs, until then every placement tries again.
+        """
+        with self.placement_seed_lock:
+            unknown_nodes = [node for node in self.node_connections.keys() if not self.ledger.is_known(node)]
+            if not unknown_nodes:
+                return
+            nothing_known = len(unknown_nodes) == len(self.node_connections)
+            if not nothing_known and time.time() - self.placement_seeded_at <= placement_seed_interval_secs:
+                return
+            self.placement_seeded_at = time.time()
+            logger.debug(dict(message="Listing {} nodes missing from the slot ledger".format(len(unknown_nodes))))
+            try:
+                self.fetch_instances_by_node(node_filter=unknown_nodes)
+            except Exception as e:
+                logger.error(dict(message="Listing the nodes missing from the slot ledger failed: {}".format(e)))
+
+    def __reserve_node(self, app, node, slots, planned_app_node_counts=None):
+        """
+        Reserves slots for an instance of the app on the given node, or on the best node if none is given.
+        Returns the node and the reservation, which must be released once the start has completed.
+        """
+        if node is not None:
+            if self.__needs_recount(node):
+                # Recount this node only, the rest of the cluster is irrelevant to the capacity check
+                self.get_node_instances(node)
+            return node, self.ledger.reserve(node, slots)
+        for node in self.choose_nodes(app, slots, planned_app_node_counts):
+            try:
+                if self.__needs_recount(node):
+                    self.get_node_instances(node)
+                reservation = self.ledger.reserve(node, slots)
+            except exceptions.NodeOutOfCapacityException:
+                # Another start took the last of this node's slots since it was ranked, or the recount found it full
+                continue
+            except (ConnectionError, Timeout) as e:
+                logger.error(dict(message="Recounting the slots on {} failed, skipping it: {}".format(node, e)))
+                continue
+            logger.info(dict(message="Placing {} on {}".format(app, node)))
+            return node, reservation
+        logger.error(dict(message="No node has {} free slots for {}".format(slots, app)))
+        raise exceptions.NodeOutOfCapacityException()
+
+    def __needs_recount(self, node):
+        """
+        The inventory keeps the ledger up to date, without one a node is recounted once its count is too old.
+        """
+        if not self.ledger.is_known(node):
+            return True
+        if self.inventory is not None and self.inventory.is_populated():
+            return False
+        age_secs = self.ledger.get_age_secs(node)
+        return age_secs is None or age_secs > ledger_max_age_secs
+
+    def __start_container(self, app, node, environment, slots, hostname, slug_runner_version):
         node_connection = self.node_connections[node]
 
         # Use the version from the api parameter if it's set, otherwise use the version from config
@@ -210,32 +749,117 @@ class Connection(object):
         # inspect the container
         # it is important to inspect it *after* starting as before that it doesn't have port info in it)
         container_inspected = node_connection.inspect_container(container["Id"])
+        self.inspect_cache.put(node, container_inspected)
         logger.info(dict(message="Finished starting container for app {} on {}".format(app, node)))
 
         # and return the container converted to an Instance
-        return self.__get_instance(node, container_inspected)
+        instance = self.__get_instance(node, container_inspected)
+        self.record_started_instance(instance)
+        return instance
 
     def stop_instance(self, instance_id):
-        instances = self.get_instances()
-
-        for instance in instances:
-            if instance["id"] == instance_id:
-                docker_hostname = instance["node"]
-                docker_container_id = instance_id
-                logger.debug(dict(message="Stopping container {} on {}".format(docker_container_id, docker_hostname)))
-                self.node_connections[docker_hostname].stop(docker_container_id)
-                logger.info(dict(message="Stopped container {} on {}".format(docker_container_id, docker_hostname)))
-
-                try:
-                    self.node_connections[docker_hostname].remove_container(docker_container_id, force=True)
-                    logger.info(dict(message="Removed container {} on {}".format(docker_container_id, docker_hostname)))
-                except:
-                    logger.warn(dict(message="Failed to remove container {} on {}".format(docker_container_id, docker_hostname)))
-                    pass  # we do not care if removing the container failed
-
-                return True
+        instance = self.find_instance(instance_id)
+        if instance is None:
+            return False
+        return self.__stop_container(instance["node"], instance["id"])
+
+    def stop_instances(self, app=None, node=None, instance_ids=None, timeout=None, protected_prefix=None):
+        """
+        Stops and removes every instance matching all of the given app, node and instance ids.
+        Targets are resolved once, then stopped concurrently on the batch executor with at most
+        config.batch_node_parallelism stops in flight per node. timeout is the grace period docker gives each container before killing it.
+        Instances whose id starts with protected_prefix are skipped.
+        Returns a result per target instance, plus one per instance id that couldn't be found or that matched
+        more than one instance, which is never stopped.
+        """
+        targets, missing_ids, ambiguous_ids = self.__resolve_instances(app, node, instance_ids)
+        results = [{"id": instance_id, "status": "not_found"} for instance_id in missing_ids] + \
+                  [{"id": instance_id, "status": "ambiguous"} for instance_id in ambiguous_ids]
+        if protected_prefix:
+            results = results + [{"id": i["id"], "node": i["node"], "status": "skipped"} for i in targets if i["id"].startswith(protected_prefix)]
+            targets = [i for i in targets if not i["id"].startswith(protected_prefix)]
+        if not targets:
+            return results
+
+        stops = self.batch_executor.fan_out_by_key(lambda instance: self.__stop_container(instance["node"], instance["id"], timeout),
+                                                   targets, lambda instance: instance["node"], self.config.batch_node_parallelism)
+        for instance, future in stops:
+            result = {"id": instance["id"], "node": instance["node"]}
+            if future.exception() is not None:
+                logger.error(dict(message="Stopping {} on {} generated an exception: {}".format(instance["id"], instance["node"], repr(future.exception()))))
+                result.update(status="failed", error=type(future.exception()).__name__, message=str(future.exception()))
+            else:
+                result.update(status="stopped" if future.result() else "not_found")
+            results.append(result)
+        return results
+
+    def __resolve_instances(self, app, node, instance_ids):
+        """
+        Returns the instances matching all of the given filters, the instance ids which matched nothing and those
+        which matched more than one instance. Ids shorter than min_instance_id_prefix_length match nothing.
+        Instance ids alone are resolved through the index, a single listing covers any misses.
+        """
+        if instance_ids is not None and app is None and node is None:
+            instances = [self.index.lookup(instance_id) for instance_id in instance_ids]
+            if None not in instances:
+                return instances, [], []
+        instances = self.get_instances(node_filter=node)
+        if app is not None:
+            instances = [i for i in instances if i["app"] == app]
+        if instance_ids is None:
+            return instances, [], []
+        targets = []
+        missing_ids = []
+        ambiguous_ids = []
+        for instance_id in instance_ids:
+            matches = []
+            if len(instance_id) >= min_instance_id_prefix_length:
+                matches = [i for i in instances if i["id"].startswith(instance_id)]
+            if len(matches) == 1:
+                targets.append(matches[0])
+            elif matches:
+                logger.warn(dict(message="Not stopping {}, it matches {} instances".format(instance_id, len(matches))))
+                ambiguous_ids.append(instance_id)
+            else:
+                missing_ids.append(instance_id)
+        return targets, missing_ids, ambiguous_ids
+
+    def __stop_container(self, node, container_id, timeout=None):
+        """
+        Stops and removes a container, returning False if it no longer exists.
+        Without a timeout docker's default grace period is used.
+        """
+        logger.debug(dict(message="Stopping container {} on {}".format(container_id, node)))
+        try:
+            if timeout is None:
+                self.node_connections[node].stop(container_id)
+            else:
+                self.node_connections[node].stop(container_id, timeout=timeout)
+        except docker.errors.APIError as e:
+            if '404 Client Error' in e.message:
+                logger.info(dict(message="Container {} on {} no longer exists".format(container_id, node)))
+                self.record_removed_instance(container_id)
+                return False
+            raise
+        logger.info(dict(message="Stopped container {} on {}".format(container_id, node)))
 
-        return False
+        try:
+            self.node_connections[node].remove_container(container_id, force=True)
+            logger.info(dict(message="Removed container {} on {}".format(container_id, node)))
+        except:
+            logger.warn(dict(message="Failed to remove container {} on {}".format(container_id, node)))
+            pass  # we do not care if removing the container failed
+
+        self.record_removed_instance(container_id)
+        return True
+
+    def __connect(self, address):
+        started_at = time.time()
+        docker_conn = self.__get_connection(address)
+        docker_conn.verify = self.verify
+        docker_conn.auth = (address.username, address.password)
+        logger.debug(dict(message="Connected to {} in {:.3f}s".format(address.hostname, time.time() - started_at)))
+        return docker_conn
 
     def __get_connection(self, address):
         if address.port:
@@ -244,30 +868,24 @@ class Connection(object):
             base_url = "{}://{}".format(address.scheme, address.hostname)
 
         c = docker.Client(base_url=base_url, version="1.12", timeout=self.config.docker_timeout)
+        # Every client talks to a single node, so one pool of kept alive connections is enough. It must be big enough
+        # for the fan outs, log streams and garbage collection hitting the node at once, connections beyond
+        # docker_pool_maxsize are closed after use and each one made over https pays for a new TLS handshake.
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.config.docker_pool_maxsize, pool_block=self.config.docker_pool_block)
+        c.mount("http://", adapter)
+        c.mount("https://", adapter)
         logger.debug(dict(message="Docker client created for {}".format(address.hostname)))
 
-        # This is a hack to allow logs to work thru nginx.
-        # It will break bidirectional traffic on .attach but fortunately we don't (yet) use it.
+        # This is a hack to allow logs to work thru nginx, the stream is read through the http response rather than
+        # the raw socket. It will break bidirectional traffic on .attach but fortunately we don't (yet) use it.
         def __hacked_multiplexed_socket_stream_helper(response):
             c._raise_for_status(response)
-            data_buffer = ""
-            length = None
-            i = response.iter_content(10)
-            while True:
-                try:
-                    data_buffer += i.next()
-                except StopIteration:
-                    return
-                if not length and len(data_buffer) > 8:
-                    header = data_buffer[:8]
-                    _, length = struct.unpack('>BxxxL', header)
-
-                if length and len(data_buffer[8:]) >= length:
-                    yield data_buffer[8:8 + length]
-                    data_buffer = data_buffer[8 + length:]
-                    length = None
-                    continue
+            return (payload for stream, payload in read_frames(response.raw.read))
+
+        def __multiplexed_buffer_helper(response):
+            return (payload for stream, payload in split_frames(c._result(response, binary=True)))
         c._multiplexed_socket_stream_helper = __hacked_multiplexed_socket_stream_helper
+        c._multiplexed_buffer_helper = __multiplexed_buffer_helper
         return c
 
     def __get_instance(self, node, container):
@@ -296,15 +914,97 @@ class Connection(object):
                     slots=container["Config"]["CpuShares"],
                     hostname=container["Config"]["Hostname"])
 
-    def get_logs(self, instance_id, follow=False):
-        try:
-            instance_details = [i for i in self.get_instances() if i["id"] == instance_id][0]
-        except IndexError:
+    def get_logs(self, instance_id, follow=False, tail=None, since=None, timestamps=False):
+        """
+        Returns a generator of the instance's log messages, read from docker as they are consumed.
+        tail limits the log to its last lines, since to those written after a unix timestamp, and timestamps
+        prefixes every line with the time docker received it. Without follow every message is a single line.
+        """
+        instance_details = self.find_instance(instance_id)
+        if instance_details is None:
+            raise exceptions.NoSuchInstanceException()
+        messages, close_fn = self.__open_logs(instance_details["node"], instance_details["id"], follow, tail, since, timestamps)
+        return self.__close_after(close_fn, ({"msg": message} for message in messages))
+
+    def get_log_batches(self, instance_id, follow=False, tail=None, since=None, timestamps=False):
+        """
+        Returns a generator of lists of the instance's log messages, taking the same arguments as get_logs, so that
+        they can be encoded and written a batch at a time. A followed log is batched by whatever arrived while the
+        previous batch was being written, adding no delay.
+        """
+        instance_details = self.find_instance(instance_id)
+        if instance_details is None:
             raise exceptions.NoSuchInstanceException()
-        node = instance_details["node"]
-        node_connection = self.node_connections[node]
         if follow:
-            instance_logs = ({"msg": l} for l in node_connection.logs(instance_id, stream=True))
+            subscription = self.__subscribe_logs(instance_details["node"], instance_details["id"], tail, since, timestamps)
+            return self.__close_after(subscription.close, subscription.batches())
+        messages, close_fn = self.__open_docker_logs(instance_details["node"], instance_details["id"], follow, tail, since, timestamps)
+        return self.__close_after(close_fn, batch_messages(messages, logs_batch_max_bytes, logs_batch_max_delay_secs))
+
+    def get_app_logs(self, app, follow=False, tail=None, since=None, timestamps=False):
+        """
+        Returns a generator merging the log messages of every instance of an app, each tagged with its
+        instance id and node. The instances' logs are read concurrently, taking the same arguments as get_logs.
+        """
+        instances = [instance for instance in self.get_instances() if instance["app"] == app]
+        if not instances:
+            raise exceptions.NoSuchAppException()
+        merger = LogMerger(app_logs_stream_buffer_size)
+        for instance in instances:
+            merger.add_stream({"instance": instance["id"], "node": instance["node"]},
+                              lambda instance=instance: self.__open_logs(instance["node"], instance["id"], follow, tail, since, timestamps))
+        return merger.messages()
+
+    def __open_logs(self, node, instance_id, follow, tail, since, timestamps):
+        """
+        Requests a container's logs, returning an iterable of its messages and a function closing the request.
+        Followers of the same instance with the same arguments share one docker log stream when they ask for a
+        tail, a late joiner is given the last tail messages the stream has kept. Without a tail the whole log is
+        asked for, which only a stream of its own can give.
+        """
+        if follow and tail is not None:
+            subscription = self.__subscribe_logs(node, instance_id, tail, since, timestamps)
+            return subscription, subscription.close
+        return self.__open_docker_logs(node, instance_id, follow, tail, since, timestamps)
+
+    def __subscribe_logs(self, node, instance_id, tail, since, timestamps):
+        return self.log_hub.subscribe((instance_id, tail, since, timestamps),
+                                      lambda: self.__open_docker_logs(node, instance_id, True, tail, since, timestamps),
+                                      backlog_size=tail)
+
+    def __open_docker_logs(self, node, instance_id, follow, tail, since, timestamps):
+        response = self.__request_logs(node, instance_id, follow, tail, since, timestamps)
+        if follow:
+            messages = (payload for stream, payload in read_frames(response.raw.read))
         else:
-            instance_logs = ({"msg": "{}\n".format(l)} for l in node_connection.logs(instance_id).split("\n"))
-        return instance_logs
+            messages = (line for stream, line in iter_lines(LogDemultiplexer().frames(response.iter_content(logs_chunk_size))))
+        return messages, response.close
+
+    def __request_logs(self, node, instance_id, follow, tail, since, timestamps):
+        node_connection = self.node_connections[node]
+        params = {"stdout": 1, "stderr": 1, "follow": 1 if follow else 0, "timestamps": 1 if timestamps else 0}
+        if tail is None and since is None:
+            url = node_connection._url("/containers/{0}/logs".format(instance_id))
+        else:
+            url = "{0}/v{1}/containers/{2}/logs".format(node_connection.base_url, logs_api_version, instance_id)
+            params["tail"] = "all" if tail is None else tail
+            if since is not None:
+                params["since"] = since
+        response = node_connection._get(url, params=params, stream=True)
+        try:
+            node_connection._raise_for_status(response)
+        except docker.errors.APIError as e:
+            if '404 Client Error' in e.message:
+                # Removed outside of Captain since it was last listed
+                logger.info(dict(message="Container {} is no longer on {}".format(instance_id, node)))
+                self.record_removed_instance(instance_id)
+                raise exceptions.NoSuchInstanceException()
+            raise
+        return response
+
+    def __close_after(self, close_fn, generator):
+        try:
+            for item in generator:
+                yield item
+        finally:
+            close_fn()
@@ -0,0 +1,101 @@
+import logging
+import threading
+import time
+
+
+class NodeEventWatcher(object):
+    """
+    Subscribes to the docker events stream of a single node and applies container changes to the inventory.
+    The node is fully resynced every time the stream is (re)connected, so events missed while disconnected
+    are never lost. Runs on a daemon thread until stopped.
+    """
+
+    def __init__(self, connection, inventory, node, reconnect_delay_secs=1):
+        self.logger = logging.getLogger(__name__)
+        self.connection = connection
+        self.inventory = inventory
+        self.node = node
+        self.reconnect_delay_secs = reconnect_delay_secs
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.close_fn = None
+        self.thread = None
+        self.events_applied = 0
+        self.resyncs = 0
+        self.reconnects = 0
+        self.last_event_at = None
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self.__run, name="events-{}".format(self.node))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops watching, closing the events stream so that a watch blocked waiting for the next event returns.
+        """
+        self.stop_event.set()
+        with self.lock:
+            close_fn = self.close_fn
+        if close_fn is not None:
+            close_fn()
+
+    def get_stats(self):
+        return {"events_applied": self.events_applied,
+                "resyncs": self.resyncs,
+                "reconnects": self.reconnects,
+                "last_event_at": self.last_event_at}
+
+    def watch(self):
+        """
+        Subscribes to the node's events, resyncs the node and then applies events until the stream ends.
+        The subscription is made before the resync so that no change can fall between the two.
+        """
+        events, close_fn = self.connection.get_node_events(self.node)
+        with self.lock:
+            self.close_fn = close_fn
+        try:
+            if self.stop_event.is_set():
+                return
+            self.inventory.resync_node(self.node)
+            self.resyncs += 1
+            for event in events:
+                if self.stop_event.is_set():
+                    return
+                self.apply(event)
+        finally:
+            with self.lock:
+                self.close_fn = None
+            close_fn()
+
+    def apply(self, event):
+        status = event.get("status")
+        container_id = event.get("id")
+        self.last_event_at = time.time()
+        if status == "start":
+            instance = self.connection.get_node_instance(self.node, container_id)
+            if instance is not None:
+                self.connection.record_started_instance(instance)
+        elif status in ("die", "destroy"):
+            self.connection.record_removed_instance(container_id)
+        elif status != "create":
+            # A created container has no ports until it is started, so there is nothing to apply yet
+            return
+        self.events_applied += 1
+        self.logger.debug(dict(message="Applied {} event for {} on {}".format(status, container_id, self.node)))
+
+    def __run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.watch()
+            except Exception as e:
+                if self.stop_event.is_set():
+                    # Closing the stream to stop fails the read blocked on it
+                    break
+                self.logger.warn(dict(message="Events stream for {} failed: {}".format(self.node, e)))
+            if self.stop_event.is_set():
+                break
+            self.reconnects += 1
+            self.stop_event.wait(self.reconnect_delay_secs)
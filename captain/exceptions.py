@@ -11,3 +11,7 @@ class NodeOutOfCapacityException(Exception):
 
 class NoSuchInstanceException(Exception):
     pass
+
+
+class NoSuchAppException(Exception):
+    pass
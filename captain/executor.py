@@ -0,0 +1,119 @@
+import logging
+import threading
+from collections import deque
+
+from concurrent import futures
+
+
+class FanOutExecutor(object):
+    """
+    A long lived thread pool shared by every fan out across the docker nodes, sized by the number of nodes.
+    Work submitted from one of the pool's own threads runs inline, so nested fan outs can never deadlock
+    waiting on a pool which is full of their callers.
+    Instances of this class are thread safe.
+    """
+
+    def __init__(self, node_count, workers_per_node=2, min_workers=8, max_workers=64):
+        self.logger = logging.getLogger(__name__)
+        self.workers_per_node = workers_per_node
+        self.min_workers = min_workers
+        self.max_workers_limit = max_workers
+        self.max_workers = max(min_workers, min(max_workers, node_count * workers_per_node))
+        self.executor = futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.in_flight = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.logger.debug(dict(message="Sized fan out executor to {} workers for {} nodes".format(self.max_workers, node_count)))
+
+    def submit(self, fn, *args, **kwargs):
+        if getattr(self.local, "is_worker", False):
+            return self.__run_inline(fn, *args, **kwargs)
+        with self.lock:
+            self.queued += 1
+            self.submitted += 1
+        return self.executor.submit(self.__run, fn, *args, **kwargs)
+
+    def fan_out(self, fn, items):
+        """
+        Calls fn on every item concurrently, yielding (item, future) pairs as they complete.
+        """
+        future_to_items = dict((self.submit(fn, item), item) for item in items)
+        for future in futures.as_completed(future_to_items):
+            yield future_to_items[future], future
+
+    def fan_out_by_key(self, fn, items, key, limit_per_key):
+        """
+        Calls fn on every item with at most limit_per_key calls in flight for the items sharing a key,
+        yielding (item, future) pairs as they complete. Items wait here rather than tying up a worker.
+        """
+        pending = {}
+        for item in items:
+            pending.setdefault(key(item), deque()).append(item)
+        future_to_items = {}
+
+        def submit_next(item_key):
+            item = pending[item_key].popleft()
+            future_to_items[self.submit(fn, item)] = item
+
+        for item_key, key_items in pending.items():
+            for _ in range(min(limit_per_key, len(key_items))):
+                submit_next(item_key)
+        while future_to_items:
+            done, _ = futures.wait(future_to_items.keys(), return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                item = future_to_items.pop(future)
+                if pending[key(item)]:
+                    submit_next(key(item))
+                yield item, future
+
+    def resize(self, node_count):
+        """
+        Grows the pool when nodes are added. The pool never shrinks, idle threads cost next to nothing.
+        """
+        max_workers = max(self.min_workers, min(self.max_workers_limit, node_count * self.workers_per_node))
+        with self.lock:
+            if max_workers > self.max_workers:
+                self.logger.info(dict(message="Growing fan out executor to {} workers for {} nodes".format(max_workers, node_count)))
+                self.max_workers = max_workers
+                self.executor._max_workers = max_workers
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+    def get_stats(self):
+        with self.lock:
+            return {"workers": self.max_workers,
+                    "queued": self.queued,
+                    "in_flight": self.in_flight,
+                    "submitted": self.submitted,
+                    "completed": self.completed,
+                    "failed": self.failed}
+
+    def __run(self, fn, *args, **kwargs):
+        with self.lock:
+            self.queued -= 1
+            self.in_flight += 1
+        self.local.is_worker = True
+        try:
+            return fn(*args, **kwargs)
+        except:
+            with self.lock:
+                self.failed += 1
+            raise
+        finally:
+            self.local.is_worker = False
+            with self.lock:
+                self.in_flight -= 1
+                self.completed += 1
+
+    def __run_inline(self, fn, *args, **kwargs):
+        future = futures.Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
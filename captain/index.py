@@ -0,0 +1,89 @@
+from collections import Counter
+from threading import RLock
+
+short_id_length = 12
+
+
+class InstanceIndex(object):
+    """
+    Maps container ids, and their 12 character short id prefixes, to the last known instance record
+    so that single instance operations can go straight to the owning node.
+    Also counts each app's instances per node for placement decisions.
+    Instances of this class are thread safe.
+    """
+
+    def __init__(self):
+        self.lock = RLock()
+        self.instances = {}
+        self.short_ids = {}
+        self.node_instance_ids = {}
+        self.app_node_counts = {}
+
+    def update_node(self, node, instances):
+        """
+        Replaces everything indexed for a node with the given instances.
+        """
+        with self.lock:
+            for instance_id in self.node_instance_ids.pop(node, set()):
+                self.__remove(instance_id)
+            for instance in instances:
+                self.add(instance)
+
+    def remove_node(self, node):
+        self.update_node(node, [])
+
+    def add(self, instance):
+        with self.lock:
+            self.remove(instance["id"])
+            self.instances[instance["id"]] = instance
+            self.short_ids[instance["id"][:short_id_length]] = instance["id"]
+            self.node_instance_ids.setdefault(instance["node"], set()).add(instance["id"])
+            self.app_node_counts.setdefault(instance["app"], Counter())[instance["node"]] += 1
+
+    def remove(self, instance_id):
+        with self.lock:
+            instance = self.lookup(instance_id)
+            if instance is None:
+                return None
+            self.node_instance_ids.get(instance["node"], set()).discard(instance["id"])
+            return self.__remove(instance["id"])
+
+    def lookup(self, instance_id):
+        """
+        Returns the instance with the given id or short id prefix, or None if it isn't indexed.
+        """
+        with self.lock:
+            instance = self.instances.get(instance_id)
+            if instance is None and len(instance_id) >= short_id_length:
+                full_id = self.short_ids.get(instance_id[:short_id_length])
+                if full_id is not None and full_id.startswith(instance_id):
+                    instance = self.instances[full_id]
+            return instance
+
+    def get_instances_by_node(self):
+        """
+        Returns a dict of node to the instances indexed for that node.
+        """
+        with self.lock:
+            return dict((node, [self.instances[i] for i in instance_ids]) for node, instance_ids in self.node_instance_ids.items())
+
+    def get_app_node_counts(self, app):
+        """
+        Returns a dict of node to the number of the app's instances on that node.
+        """
+        with self.lock:
+            return dict(self.app_node_counts.get(app, {}))
+
+    def __len__(self):
+        return len(self.instances)
+
+    def __remove(self, instance_id):
+        instance = self.instances.pop(instance_id, None)
+        if instance is not None:
+            app_node_counts = self.app_node_counts[instance["app"]]
+            app_node_counts[instance["node"]] -= 1
+            if app_node_counts[instance["node"]] <= 0:
+                del app_node_counts[instance["node"]]
+        if self.short_ids.get(instance_id[:short_id_length]) == instance_id:
+            del self.short_ids[instance_id[:short_id_length]]
+        return instance
@@ -0,0 +1,104 @@
+from threading import RLock
+
+from cachetools import LRUCache, TTLCache
+
+
+def trim_container(container):
+    """
+    Returns just the parts of an inspect_container payload which are needed to build an instance.
+    """
+    return {"Id": container["Id"],
+            "Name": container["Name"],
+            "Config": {"Env": container["Config"]["Env"],
+                       "CpuShares": container["Config"]["CpuShares"],
+                       "Hostname": container["Config"]["Hostname"]},
+            "NetworkSettings": {"Ports": {"8080/tcp": container["NetworkSettings"]["Ports"]["8080/tcp"]}}}
+
+
+class InspectCache(object):
+    """
+    Caches trimmed inspect_container payloads by container id, with a separate LRU of at most
+    max_entries_per_node entries for every node so that one busy node can't evict the rest of the cluster.
+    Entries expire after ttl_secs when it is greater than 0, and are invalidated when their container is
+    destroyed or is missing from a listing of its node.
+    Instances of this class are thread safe.
+    """
+
+    def __init__(self, max_entries_per_node=1024, ttl_secs=0):
+        self.max_entries_per_node = max_entries_per_node
+        self.ttl_secs = ttl_secs
+        self.lock = RLock()
+        self.node_caches = {}
+        self.stats = {}
+
+    def get(self, node, container_id):
+        with self.lock:
+            container = self.__get_node_cache(node).get(container_id)
+            self.__increment(node, "hits" if container is not None else "misses")
+            return container
+
+    def put(self, node, container):
+        with self.lock:
+            node_cache = self.__get_node_cache(node)
+            if self.ttl_secs > 0:
+                node_cache.expire()
+            if container["Id"] not in node_cache and len(node_cache) >= self.max_entries_per_node:
+                self.__increment(node, "evictions")
+            node_cache[container["Id"]] = trim_container(container)
+
+    def invalidate(self, container_id, node=None):
+        """
+        Drops a container from the cache, looking for it on every node if its node isn't given.
+        """
+        with self.lock:
+            for cache_node in ([node] if node is not None else self.node_caches.keys()):
+                if self.node_caches.get(cache_node, {}).pop(container_id, None) is not None:
+                    self.__increment(cache_node, "invalidations")
+
+    def retain(self, node, container_ids):
+        """
+        Invalidates every container cached for a node which isn't in container_ids.
+        """
+        with self.lock:
+            node_cache = self.__get_node_cache(node)
+            for container_id in set(node_cache.keys()) - set(container_ids):
+                self.invalidate(container_id, node)
+
+    def remove_node(self, node):
+        with self.lock:
+            self.node_caches.pop(node, None)
+            self.stats.pop(node, None)
+
+    def clear(self):
+        with self.lock:
+            for node_cache in self.node_caches.values():
+                node_cache.clear()
+
+    def export(self):
+        """
+        Returns a dict of node to the trimmed containers cached for that node.
+        """
+        with self.lock:
+            return dict((node, node_cache.values()) for node, node_cache in self.node_caches.items())
+
+    def get_stats(self):
+        with self.lock:
+            stats = {}
+            for node, node_cache in self.node_caches.items():
+                node_stats = dict(hits=0, misses=0, evictions=0, invalidations=0)
+                node_stats.update(self.stats.get(node, {}))
+                node_stats["size"] = len(node_cache)
+                stats[node] = node_stats
+            return stats
+
+    def __get_node_cache(self, node):
+        if node not in self.node_caches:
+            if self.ttl_secs > 0:
+                self.node_caches[node] = TTLCache(maxsize=self.max_entries_per_node, ttl=self.ttl_secs)
+            else:
+                self.node_caches[node] = LRUCache(maxsize=self.max_entries_per_node)
+        return self.node_caches[node]
+
+    def __increment(self, node, stat):
+        node_stats = self.stats.setdefault(node, {})
+        node_stats[stat] = node_stats.get(stat, 0) + 1
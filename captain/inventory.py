@@ -0,0 +1,206 @@
+import logging
+import os
+import time
+from threading import RLock
+
+from captain.events import NodeEventWatcher
+from captain.worker import PeriodicWorker
+
+
+class Inventory(object):
+    """
+    An in-memory, versioned snapshot of the instances running on every docker node.
+    A background worker keeps the snapshot fresh so that reads never fan out to the nodes on the request path.
+    The generation is incremented every time the contents of the snapshot change, together with the epoch,
+    which is unique to this inventory, it versions the snapshot.
+    When events are enabled each node's docker events stream is applied incrementally between refreshes.
+    Instances of this class are thread safe.
+    """
+
+    def __init__(self, connection, refresh_interval_secs, events_enabled=False):
+        self.logger = logging.getLogger(__name__)
+        self.connection = connection
+        self.refresh_interval_secs = refresh_interval_secs
+        self.events_enabled = events_enabled
+        self.event_watchers = {}
+        self.lock = RLock()
+        self.node_instances = {}
+        self.epoch = os.urandom(6).encode("hex")
+        self.generation = 0
+        self.refreshed_at = None
+        # When each node's instances were last listed, a node which fails to list keeps its older instances
+        self.node_listed_at = {}
+        self.stale = False
+        # Starts and stops made while a refresh is listing the nodes, which its listing may have missed
+        self.journal = None
+        self.worker = PeriodicWorker("inventory-refresher", self.refresh, refresh_interval_secs)
+
+    def start(self):
+        self.worker.start()
+        if self.events_enabled:
+            for node in self.connection.node_connections.keys():
+                self.__start_event_watcher(node)
+
+    def stop(self):
+        self.worker.stop()
+        for event_watcher in self.event_watchers.values():
+            event_watcher.stop()
+
+    def add_node(self, node):
+        """
+        Starts watching a newly added node's events, its instances are picked up by the next refresh.
+        """
+        if self.events_enabled and self.worker.is_running():
+            self.__start_event_watcher(node)
+
+    def remove_node(self, node):
+        with self.lock:
+            self.node_listed_at.pop(node, None)
+            if self.node_instances.pop(node, None) is not None:
+                self.generation += 1
+        event_watcher = self.event_watchers.pop(node, None)
+        if event_watcher is not None:
+            event_watcher.stop()
+
+    def is_populated(self):
+        return self.refreshed_at is not None
+
+    def get_age_secs(self):
+        """
+        Returns how many seconds ago the snapshot was last refreshed, or None if it has never been populated.
+        That is the age of the oldest node's instances, as a node which failed to list keeps its older ones.
+        """
+        with self.lock:
+            if self.refreshed_at is None:
+                return None
+            listed_at = [self.node_listed_at.get(node, self.refreshed_at) for node in self.node_instances]
+            return time.time() - min(listed_at + [self.refreshed_at])
+
+    def refresh(self):
+        """
+        Lists every node and replaces the snapshot with the listing. Nodes which couldn't be listed keep their
+        instances, and starts and stops made while the nodes were being listed are applied again on top.
+        """
+        started_at = time.time()
+        with self.lock:
+            self.journal = []
+        try:
+            node_instances = self.connection.fetch_instances_by_node()
+        except:
+            with self.lock:
+                self.journal = None
+            raise
+        with self.lock:
+            journal, self.journal = self.journal, None
+            nodes = self.connection.node_connections
+            node_instances = dict((node, instances) for node, instances in node_instances.items() if node in nodes)
+            for node in node_instances:
+                self.node_listed_at[node] = started_at
+            for node, instances in self.node_instances.items():
+                if node in nodes and node not in node_instances:
+                    self.logger.debug(dict(message="Keeping the instances {} had {:.3f}s ago".format(node, started_at - self.node_listed_at.get(node, started_at))))
+                    node_instances[node] = instances
+            for apply_change, argument in journal:
+                apply_change(node_instances, argument)
+            if node_instances != self.node_instances:
+                self.node_instances = node_instances
+                self.generation += 1
+                self.logger.info(dict(message="Inventory changed, now at generation {}".format(self.generation)))
+            self.refreshed_at = started_at
+            self.stale = False
+        self.logger.debug(dict(message="Inventory refreshed in {:.3f}s".format(time.time() - started_at)))
+
+    def load(self, node_instances, refreshed_at):
+        """
+        Populates the inventory from a saved snapshot, which is served as stale until the next refresh.
+        """
+        with self.lock:
+            self.node_instances = node_instances
+            self.generation += 1
+            self.refreshed_at = refreshed_at
+            self.node_listed_at = dict((node, refreshed_at) for node in node_instances)
+            self.stale = True
+
+    def resync_node(self, node):
+        listed_at = time.time()
+        node_instances = self.connection.get_node_instances(node)
+        with self.lock:
+            # The node is dropped from the connection before it is removed from here, so this can't undo that
+            if node not in self.connection.node_connections:
+                self.logger.info(dict(message="{} left the cluster while it was being resynced".format(node)))
+                return
+            self.node_listed_at[node] = listed_at
+            if node_instances != self.node_instances.get(node):
+                self.node_instances[node] = node_instances
+                self.generation += 1
+                self.logger.info(dict(message="Resynced {}, inventory now at generation {}".format(node, self.generation)))
+
+    def get_version(self):
+        """
+        Returns a string which changes whenever the snapshot does, and which another inventory never uses.
+        """
+        with self.lock:
+            return "{}-{}".format(self.epoch, self.generation)
+
+    def get_instances(self, node_filter=None):
+        """
+        Returns the instances on every node, or just those on node_filter, a node name or a list of them.
+        """
+        instances = []
+        for node_instances in self.get_instances_by_node(node_filter).values():
+            instances.extend(node_instances)
+        return instances
+
+    def get_instances_by_node(self, node_filter=None):
+        """
+        Returns a dict of node name to the instances on it, for every node or just those in node_filter.
+        """
+        if isinstance(node_filter, basestring):
+            node_filter = [node_filter]
+        with self.lock:
+            return dict((node, list(node_instances)) for node, node_instances in self.node_instances.items()
+                        if not node_filter or node in node_filter)
+
+    def add_instance(self, instance):
+        with self.lock:
+            self.__add_to(self.node_instances, instance)
+            self.generation += 1
+            if self.journal is not None:
+                self.journal.append((self.__add_to, instance))
+
+    def remove_instance(self, instance_id):
+        with self.lock:
+            if self.journal is not None:
+                self.journal.append((self.__remove_from, instance_id))
+            if self.__remove_from(self.node_instances, instance_id):
+                self.generation += 1
+                return True
+            return False
+
+    def get_stats(self):
+        with self.lock:
+            return {"generation": self.generation,
+                    "age_secs": self.get_age_secs(),
+                    "stale": self.stale,
+                    "refresh_interval_secs": self.refresh_interval_secs,
+                    "nodes": len(self.node_instances),
+                    "instances": sum(len(i) for i in self.node_instances.values()),
+                    "event_watchers": dict((node, w.get_stats()) for node, w in self.event_watchers.items())}
+
+    def __add_to(self, node_instances, instance):
+        instances = [i for i in node_instances.get(instance["node"], []) if i["id"] != instance["id"]]
+        instances.append(instance)
+        node_instances[instance["node"]] = instances
+
+    def __remove_from(self, node_instances, instance_id):
+        for node, instances in node_instances.items():
+            remaining = [i for i in instances if i["id"] != instance_id]
+            if len(remaining) != len(instances):
+                node_instances[node] = remaining
+                return True
+        return False
+
+    def __start_event_watcher(self, node):
+        if node not in self.event_watchers:
+            self.event_watchers[node] = NodeEventWatcher(self.connection, self, node)
+            self.event_watchers[node].start()
@@ -0,0 +1,23 @@
+import json
+
+
+def iter_json_array(items, chunk_bytes=64 * 1024):
+    """
+    Encodes items as a JSON array, one item per line, yielding it in chunks of about chunk_bytes so that a long
+    list is never held in memory as one string and the first chunk can be sent as soon as it is encoded.
+    """
+    parts = ["["]
+    size = 1
+    separator = "\n"
+    for item in items:
+        encoded = json.dumps(item, sort_keys=True)
+        parts.append(separator)
+        parts.append(encoded)
+        size += len(separator) + len(encoded)
+        separator = ",\n"
+        if size >= chunk_bytes:
+            yield "".join(parts)
+            parts = []
+            size = 0
+    parts.append("\n]\n")
+    yield "".join(parts)
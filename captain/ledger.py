@@ -0,0 +1,104 @@
+import time
+from threading import RLock
+
+from captain import exceptions
+
+
+class SlotLedger(object):
+    """
+    Tracks the slots used by the instances on every node, plus the slots reserved by starts still in flight.
+    A start reserves its slots before creating its container, so concurrent starts can't oversubscribe a node.
+    Each node listing reconciles the ledger with reality, instances recorded since the listing was taken are
+    kept for started_grace_secs so that a listing racing a start doesn't undercount the node.
+    Instances of this class are thread safe.
+    """
+
+    def __init__(self, slots_per_node, started_grace_secs=60):
+        self.slots_per_node = slots_per_node
+        self.started_grace_secs = started_grace_secs
+        self.lock = RLock()
+        self.node_instance_slots = {}
+        self.node_used = {}
+        self.node_reserved = {}
+        self.reconciled_at = {}
+        self.recently_started = {}
+        self.reservations = {}
+
+    def is_known(self, node):
+        return node in self.node_used
+
+    def get_age_secs(self, node):
+        """
+        Returns how many seconds ago the node was last reconciled with a listing, or None if it never has been.
+        """
+        reconciled_at = self.reconciled_at.get(node)
+        if reconciled_at is None:
+            return None
+        return time.time() - reconciled_at
+
+    def reconcile(self, node, instances):
+        with self.lock:
+            instance_slots = dict((instance["id"], instance["slots"]) for instance in instances)
+            previous_instance_slots = self.node_instance_slots.get(node, {})
+            now = time.time()
+            for instance_id, started_at in self.recently_started.items():
+                if instance_id in instance_slots or now - started_at > self.started_grace_secs:
+                    del self.recently_started[instance_id]
+                elif instance_id in previous_instance_slots:
+                    instance_slots[instance_id] = previous_instance_slots[instance_id]
+            self.node_instance_slots[node] = instance_slots
+            self.node_used[node] = sum(instance_slots.values())
+            self.reconciled_at[node] = now
+
+    def add_instance(self, instance):
+        with self.lock:
+            instance_slots = self.node_instance_slots.setdefault(instance["node"], {})
+            instance_slots[instance["id"]] = instance["slots"]
+            self.node_used[instance["node"]] = sum(instance_slots.values())
+            self.recently_started[instance["id"]] = time.time()
+
+    def remove_instance(self, instance):
+        with self.lock:
+            instance_slots = self.node_instance_slots.get(instance["node"], {})
+            if instance_slots.pop(instance["id"], None) is not None:
+                self.node_used[instance["node"]] = sum(instance_slots.values())
+            self.recently_started.pop(instance["id"], None)
+
+    def remove_node(self, node):
+        with self.lock:
+            for instance_id in self.node_instance_slots.pop(node, {}):
+                self.recently_started.pop(instance_id, None)
+            self.node_used.pop(node, None)
+            self.reconciled_at.pop(node, None)
+
+    def reserve(self, node, slots):
+        """
+        Atomically reserves slots on a node, returning a reservation which must be released once the
+        start has either failed or been recorded with add_instance.
+        Raises NodeOutOfCapacityException if the node doesn't have enough free slots.
+        """
+        with self.lock:
+            if self.get_used(node) + slots > self.slots_per_node:
+                raise exceptions.NodeOutOfCapacityException()
+            reservation = object()
+            self.reservations[reservation] = (node, slots)
+            self.node_reserved[node] = self.node_reserved.get(node, 0) + slots
+            return reservation
+
+    def release(self, reservation):
+        with self.lock:
+            node, slots = self.reservations.pop(reservation, (None, 0))
+            if node is not None:
+                self.node_reserved[node] -= slots
+
+    def get_used(self, node):
+        """
+        Returns the slots used on a node, including those reserved by starts still in flight.
+        """
+        with self.lock:
+            return self.node_used.get(node, 0) + self.node_reserved.get(node, 0)
+
+    def get_stats(self):
+        with self.lock:
+            return dict((node, {"used": self.node_used.get(node, 0), "reserved": self.node_reserved.get(node, 0)})
+                        for node in set(self.node_used.keys()) | set(self.node_reserved.keys()))
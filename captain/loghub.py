@@ -0,0 +1,179 @@
+import logging
+import threading
+from collections import deque
+
+
+class LogSubscription(object):
+    """
+    A follower of a shared log stream. Messages wait in a ring buffer of at most buffer_size messages,
+    a follower which falls that far behind skips ahead, losing the oldest messages, rather than holding up
+    the stream. Iterate over it for the messages, close it from any thread to stop following.
+    """
+
+    def __init__(self, stream, buffer_size, backlog):
+        self.stream = stream
+        self.buffer = deque(backlog, maxlen=buffer_size)
+        self.dropped = 0
+        self.closed = False
+
+    def __iter__(self):
+        for messages in self.batches():
+            for message in messages:
+                yield message
+
+    def batches(self):
+        """
+        Yields lists of every message waiting in the buffer, as soon as there is at least one.
+        """
+        try:
+            while True:
+                with self.stream.condition:
+                    while not self.buffer and not self.stream.ended and not self.closed:
+                        self.stream.condition.wait()
+                    if self.closed or not self.buffer:
+                        return
+                    messages = list(self.buffer)
+                    self.buffer.clear()
+                yield messages
+        finally:
+            self.close()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.stream.unsubscribe(self)
+
+
+class SharedLogStream(object):
+    """
+    One upstream log stream read on a daemon thread and broadcast to every subscription.
+    The last history_size messages are kept so that followers joining late start with some context, each is
+    given no more of them than it asked for.
+    """
+
+    def __init__(self, hub, key, open_fn, history_size):
+        self.logger = logging.getLogger(__name__)
+        self.hub = hub
+        self.key = key
+        self.open_fn = open_fn
+        self.condition = threading.Condition()
+        self.subscriptions = []
+        self.history = deque(maxlen=history_size)
+        self.messages_read = 0
+        self.ended = False
+        self.close_fn = None
+
+    def open(self):
+        """
+        Opens the upstream stream and starts reading it. Errors opening it are raised to the caller.
+        """
+        try:
+            messages, self.close_fn = self.open_fn()
+        except:
+            self.__end()
+            raise
+        with self.condition:
+            abandoned = not self.subscriptions
+        if abandoned:
+            # Every follower left while the stream was being opened
+            self.close_fn()
+            self.__end()
+            return
+        thread = threading.Thread(target=self.__read, args=(messages,), name="log-hub-{}".format(self.key[0]))
+        thread.daemon = True
+        thread.start()
+
+    def subscribe(self, buffer_size, backlog_size=None):
+        with self.condition:
+            backlog = list(self.history)
+            if backlog_size is not None:
+                backlog = backlog[len(backlog) - backlog_size:] if backlog_size > 0 else []
+            subscription = LogSubscription(self, buffer_size, backlog)
+            self.subscriptions.append(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self.hub.lock:
+            with self.condition:
+                if subscription in self.subscriptions:
+                    self.subscriptions.remove(subscription)
+                self.condition.notify_all()
+                last = not self.subscriptions
+            if last:
+                self.hub.remove(self)
+        if last and self.close_fn is not None:
+            self.logger.debug(dict(message="Last follower of {} left, closing its log stream".format(self.key[0])))
+            try:
+                self.close_fn()
+            except Exception as e:
+                self.logger.debug(dict(message="Closing log stream of {} failed: {}".format(self.key[0], e)))
+
+    def get_stats(self):
+        with self.condition:
+            return {"followers": len(self.subscriptions),
+                    "messages": self.messages_read,
+                    "dropped": sum(s.dropped for s in self.subscriptions)}
+
+    def __read(self, messages):
+        try:
+            for message in messages:
+                with self.condition:
+                    self.messages_read += 1
+                    self.history.append(message)
+                    for subscription in self.subscriptions:
+                        if len(subscription.buffer) == subscription.buffer.maxlen:
+                            subscription.dropped += 1
+                        subscription.buffer.append(message)
+                    self.condition.notify_all()
+        except Exception as e:
+            self.logger.debug(dict(message="Log stream of {} ended: {}".format(self.key[0], e)))
+        finally:
+            self.__end()
+
+    def __end(self):
+        with self.hub.lock:
+            self.hub.remove(self)
+            with self.condition:
+                self.ended = True
+                self.condition.notify_all()
+
+
+class LogBroadcastHub(object):
+    """
+    Shares one upstream log stream between every concurrent follower of the same instance and parameters.
+    The first follower opens the stream, later followers attach to it, and the stream is closed when the
+    last one leaves.
+    Instances of this class are thread safe.
+    """
+
+    def __init__(self, buffer_size=1000, history_size=100):
+        self.buffer_size = buffer_size
+        self.history_size = history_size
+        self.lock = threading.RLock()
+        self.streams = {}
+
+    def subscribe(self, key, open_fn, backlog_size=None):
+        """
+        Returns a LogSubscription to the stream for key, calling open_fn to open it if it isn't already open.
+        open_fn returns an iterable of messages and a function which closes the stream. A follower joining an
+        open stream starts with at most backlog_size of its latest messages, or all of the history kept.
+        """
+        with self.lock:
+            stream = self.streams.get(key)
+            opening = stream is None
+            if opening:
+                stream = self.streams[key] = SharedLogStream(self, key, open_fn, self.history_size)
+            subscription = stream.subscribe(self.buffer_size, backlog_size)
+        if opening:
+            stream.open()
+        return subscription
+
+    def remove(self, stream):
+        with self.lock:
+            if self.streams.get(stream.key) is stream:
+                del self.streams[stream.key]
+
+    def get_stats(self):
+        with self.lock:
+            streams = self.streams.values()
+        return [dict(stream.get_stats(), instance=stream.key[0]) for stream in streams]
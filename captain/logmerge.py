@@ -0,0 +1,88 @@
+import logging
+import threading
+import Queue
+
+# Marks the end of a stream in its queue
+end_of_stream = object()
+
+
+class LogStream(object):
+
+    def __init__(self, tags, open_fn, buffer_size):
+        self.tags = tags
+        self.open_fn = open_fn
+        self.queue = Queue.Queue(maxsize=buffer_size)
+        self.close_fn = None
+
+
+class LogMerger(object):
+    """
+    Merges many log streams into one, each read on its own daemon thread (a greenlet under gunicorn's gevent
+    worker). A stream may have at most buffer_size messages waiting to be consumed, a stream which gets that
+    far ahead is paused until the consumer catches up while the others carry on, so one slow node never
+    stalls the merged output.
+    Every message is a dict of the stream's tags plus either the message or, if the stream failed, the error.
+    """
+
+    def __init__(self, buffer_size=100, put_timeout_secs=0.5):
+        self.logger = logging.getLogger(__name__)
+        self.buffer_size = buffer_size
+        self.put_timeout_secs = put_timeout_secs
+        self.streams = []
+        self.ready = Queue.Queue()
+        self.stop_event = threading.Event()
+
+    def add_stream(self, tags, open_fn):
+        """
+        Adds a stream, open_fn is called on the stream's thread and returns an iterable of messages and a
+        function which closes the stream.
+        """
+        self.streams.append(LogStream(tags, open_fn, self.buffer_size))
+
+    def messages(self):
+        for i, stream in enumerate(self.streams):
+            thread = threading.Thread(target=self.__read, args=(i, stream), name="logs-{}".format(i))
+            thread.daemon = True
+            thread.start()
+        finished = 0
+        try:
+            while finished < len(self.streams):
+                stream = self.streams[self.ready.get()]
+                message = stream.queue.get_nowait()
+                if message is end_of_stream:
+                    finished += 1
+                    continue
+                yield message
+        finally:
+            self.stop()
+
+    def stop(self):
+        self.stop_event.set()
+        for stream in self.streams:
+            if stream.close_fn is not None:
+                try:
+                    stream.close_fn()
+                except Exception as e:
+                    self.logger.debug(dict(message="Closing log stream {} failed: {}".format(stream.tags, e)))
+
+    def __read(self, i, stream):
+        try:
+            messages, stream.close_fn = stream.open_fn()
+            for message in messages:
+                if not self.__put(i, stream, dict(stream.tags, msg=message)):
+                    return
+        except Exception as e:
+            if not self.stop_event.is_set():
+                self.logger.error(dict(message="Log stream {} failed: {}".format(stream.tags, e)))
+                self.__put(i, stream, dict(stream.tags, error=repr(e)))
+        self.__put(i, stream, end_of_stream)
+
+    def __put(self, i, stream, message):
+        while not self.stop_event.is_set():
+            try:
+                stream.queue.put(message, timeout=self.put_timeout_secs)
+            except Queue.Full:
+                continue
+            self.ready.put(i)
+            return True
+        return False
@@ -0,0 +1,126 @@
+import struct
+import time
+
+# Every frame of a multiplexed docker stream starts with the stream type, 3 bytes of padding and the payload length
+stream_header = struct.Struct('>BxxxL')
+stream_names = {0: "stdin", 1: "stdout", 2: "stderr"}
+
+
+def read_frames(read_fn):
+    """
+    Demultiplexes a docker log stream, yielding a (stream name, payload) tuple for every frame.
+    read_fn(size) returns at most size bytes and an empty string at the end of the stream. Exactly the
+    bytes of each header and payload are asked for, so following a quiet container never waits on
+    output which hasn't been written yet.
+    """
+    while True:
+        header = _read_exactly(read_fn, stream_header.size)
+        if header is None:
+            return
+        stream, length = stream_header.unpack_from(header)
+        payload = _read_exactly(read_fn, length) if length else ""
+        if payload is None:
+            return
+        yield stream_names.get(stream, "stdout"), payload
+
+
+def split_frames(data):
+    """
+    Demultiplexes a complete docker log stream held in memory, see LogDemultiplexer.
+    """
+    return LogDemultiplexer().feed(data)
+
+
+class LogDemultiplexer(object):
+    """
+    Demultiplexes a docker log stream arriving in arbitrarily sized chunks, yielding a (stream name, payload)
+    tuple for every complete frame. Chunks are appended to one reusable buffer, headers are parsed in
+    place and each payload is copied out exactly once.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.offset = 0
+
+    def frames(self, chunks):
+        for chunk in chunks:
+            for frame in self.feed(chunk):
+                yield frame
+
+    def feed(self, chunk):
+        self.buffer.extend(chunk)
+        frames = []
+        view = memoryview(self.buffer)
+        try:
+            while len(self.buffer) - self.offset >= stream_header.size:
+                stream, length = stream_header.unpack_from(self.buffer, self.offset)
+                start = self.offset + stream_header.size
+                if len(self.buffer) - start < length:
+                    break
+                frames.append((stream_names.get(stream, "stdout"), view[start:start + length].tobytes()))
+                self.offset = start + length
+        finally:
+            # The buffer can't be resized while a view of it exists
+            del view
+        if self.offset > len(self.buffer) / 2:
+            del self.buffer[:self.offset]
+            self.offset = 0
+        return frames
+
+
+def iter_lines(frames):
+    """
+    Joins the payloads of (stream name, payload) frames into complete lines, yielding a (stream name, line)
+    tuple as soon as each line ends. Lines are kept per stream, so interleaved stdout and stderr never mix,
+    and a final line without a newline is yielded at the end.
+    """
+    partial_lines = {}
+    for stream, payload in frames:
+        lines = payload.split("\n")
+        if len(lines) == 1:
+            partial_lines[stream] = partial_lines.get(stream, "") + payload
+            continue
+        lines[0] = partial_lines.pop(stream, "") + lines[0]
+        for line in lines[:-1]:
+            yield stream, line + "\n"
+        if lines[-1]:
+            partial_lines[stream] = lines[-1]
+    for stream, line in partial_lines.items():
+        if line:
+            yield stream, line + "\n"
+
+
+def batch_messages(messages, max_bytes=64 * 1024, max_delay_secs=0.1):
+    """
+    Groups messages into lists holding at most max_bytes, or less if max_delay_secs has passed since the
+    first message of the list by the time another arrives, so that each list can be encoded and written at once.
+    """
+    batch = []
+    batch_bytes = 0
+    batch_started_at = None
+    for message in messages:
+        if not batch:
+            batch_started_at = time.time()
+        batch.append(message)
+        batch_bytes += len(message)
+        if batch_bytes >= max_bytes or time.time() - batch_started_at >= max_delay_secs:
+            yield batch
+            batch = []
+            batch_bytes = 0
+    if batch:
+        yield batch
+
+
+def _read_exactly(read_fn, size):
+    data = read_fn(size)
+    if len(data) == size:
+        return data
+    blocks = [data]
+    remaining = size - len(data)
+    while remaining > 0:
+        block = read_fn(remaining)
+        if not block:
+            return None
+        blocks.append(block)
+        remaining -= len(block)
+    return "".join(blocks)
@@ -0,0 +1,56 @@
+import threading
+
+
+class LazyDockerClient(object):
+    """
+    Stands in for the docker.Client of a node, creating it with connect_fn on first use rather than up front.
+    Every attribute not defined here is looked up on the underlying client.
+    Instances of this class are thread safe.
+    """
+
+    def __init__(self, node, connect_fn):
+        self.node = node
+        self.connect_fn = connect_fn
+        self.client = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        """
+        Returns the node's docker.Client, creating it if this is the first use.
+        """
+        if self.client is None:
+            with self.lock:
+                if self.client is None:
+                    self.client = self.connect_fn()
+        return self.client
+
+    def is_connected(self):
+        return self.client is not None
+
+    def get_pool_stats(self):
+        """
+        Sums the connections opened and the requests made across the client's connection pools, every request
+        beyond the first on a connection reused a kept alive connection instead of making a new one.
+        """
+        stats = {"connected": self.is_connected(), "connections": 0, "requests": 0, "reused": 0}
+        if self.client is None:
+            return stats
+        for adapter in set(self.client.adapters.values()):
+            pools = getattr(getattr(adapter, "poolmanager", None), "pools", None)
+            if pools is None:
+                continue
+            for pool_key in pools.keys():
+                pool = pools[pool_key]
+                stats["connections"] += pool.num_connections
+                stats["requests"] += pool.num_requests
+        stats["reused"] = max(0, stats["requests"] - stats["connections"])
+        return stats
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self.connect(), name)
@@ -0,0 +1,55 @@
+import abc
+from abc import abstractmethod
+
+
+class PlacementStrategy(object):
+    """
+    Ranks candidate nodes for a new instance from cached usage alone, without calling docker.
+    Each candidate is a dict with the node's id, the slots used on it and the number of the app's instances on it.
+    """
+    __metaclass__ = abc.ABCMeta
+
+    @abstractmethod
+    def rank_nodes(self, candidates, app, slots):
+        pass
+
+
+class BinPackPlacementStrategy(PlacementStrategy):
+    """
+    Fills the fullest nodes first, keeping whole nodes free for large instances.
+    """
+
+    def rank_nodes(self, candidates, app, slots):
+        return sorted(candidates, key=lambda candidate: (-candidate["used"], candidate["id"]))
+
+
+class SpreadPlacementStrategy(PlacementStrategy):
+    """
+    Places instances on the emptiest nodes first.
+    """
+
+    def rank_nodes(self, candidates, app, slots):
+        return sorted(candidates, key=lambda candidate: (candidate["used"], candidate["id"]))
+
+
+class AppSpreadPlacementStrategy(PlacementStrategy):
+    """
+    Places instances on the nodes running the fewest instances of the same app, then on the emptiest nodes,
+    so that losing a node takes out as few of an app's instances as possible.
+    """
+
+    def rank_nodes(self, candidates, app, slots):
+        return sorted(candidates, key=lambda candidate: (candidate["app_instances"], candidate["used"], candidate["id"]))
+
+
+placement_strategies = {
+    "binpack": BinPackPlacementStrategy,
+    "spread": SpreadPlacementStrategy,
+    "app-spread": AppSpreadPlacementStrategy
+}
+
+
+def get_placement_strategy(name):
+    if name not in placement_strategies:
+        raise Exception("Unknown placement strategy '{}', must be one of {}".format(name, sorted(placement_strategies.keys())))
+    return placement_strategies[name]()
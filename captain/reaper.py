@@ -0,0 +1,179 @@
+import logging
+import threading
+import time
+# futures and datetime together do weird things
+#  https://mail.python.org/pipermail/python-list/2012-December/650103.html
+import datetime, _strptime
+
+import docker
+
+from captain.executor import FanOutExecutor
+from captain.worker import PeriodicWorker
+
+
+class RateLimiter(object):
+    """
+    Spaces out calls to acquire so that no more than rate_per_sec are let through each second.
+    Instances of this class are thread safe.
+    """
+
+    def __init__(self, rate_per_sec):
+        self.interval_secs = 1.0 / rate_per_sec if rate_per_sec > 0 else 0
+        self.next_slot = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.time()
+            wait_secs = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval_secs
+        if wait_secs > 0:
+            time.sleep(wait_secs)
+
+
+class ContainerReaper(object):
+    """
+    Garbage collects exited containers which are older than the gc grace period, in the background.
+    Each run handles at most batch_size exited containers per node, with up to node_concurrency
+    concurrent docker calls against a node and no more than max_removals_per_sec removals per node.
+    Containers found to be too young are not inspected again until they become eligible.
+    At most node_parallelism nodes are reaped at once, on the reaper's own threads rather than the connection's
+    shared executor, as reaping a node can take several seconds of rate limited sleeping. Their docker calls share
+    another long lived pool of the reaper's, sized to node_concurrency calls for each node being reaped.
+    """
+
+    def __init__(self, connection, interval_secs, grace_period_secs, batch_size=50, max_removals_per_sec=5, node_concurrency=2,
+                 node_parallelism=4):
+        self.logger = logging.getLogger(__name__)
+        self.connection = connection
+        self.interval_secs = interval_secs
+        self.grace_period_secs = grace_period_secs
+        self.batch_size = batch_size
+        self.max_removals_per_sec = max_removals_per_sec
+        self.node_concurrency = node_concurrency
+        self.executor = FanOutExecutor(0, min_workers=node_parallelism, max_workers=node_parallelism)
+        container_workers = node_parallelism * node_concurrency
+        self.container_executor = FanOutExecutor(0, min_workers=container_workers, max_workers=container_workers)
+        self.lock = threading.RLock()
+        self.node_locks = {}
+        self.rate_limiters = {}
+        self.eligible_at = {}
+        self.stats = {}
+        self.worker = PeriodicWorker("container-reaper", self.reap, interval_secs)
+
+    def start(self):
+        self.worker.start()
+
+    def stop(self):
+        self.worker.stop()
+        self.executor.shutdown(wait=False)
+        self.container_executor.shutdown(wait=False)
+
+    def remove_node(self, node):
+        with self.lock:
+            for states in (self.node_locks, self.rate_limiters, self.eligible_at, self.stats):
+                states.pop(node, None)
+
+    def get_stats(self):
+        with self.lock:
+            return dict((node, dict(node_stats)) for node, node_stats in self.stats.items())
+
+    def reap(self):
+        nodes = self.connection.node_connections.keys()
+        for node, future in self.executor.fan_out(self.reap_node, nodes):
+            if future.exception() is not None:
+                self.__increment(node, "errors")
+                self.logger.error(dict(message="Reaping {} generated an exception: {}".format(node, future.exception())))
+
+    def reap_node(self, node):
+        """
+        Removes up to batch_size exited containers from a node which are older than the grace period.
+        Returns the number of containers removed, a node which is already being reaped is skipped.
+        """
+        node_lock = self.__get_node_state(self.node_locks, node, threading.Lock)
+        if not node_lock.acquire(False):
+            self.logger.debug(dict(message="{} is already being reaped, skipping".format(node)))
+            return 0
+        try:
+            started_at = time.time()
+            node_conn = self.connection.node_connections[node]
+            node_containers = node_conn.containers(
+                quiet=False, all=True, trunc=False, latest=False,
+                since=None, before=None, limit=-1)
+            exited_container_ids = [c["Id"] for c in node_containers if not c["Status"].startswith("Up ")]
+
+            eligible_at = self.__get_node_state(self.eligible_at, node, dict)
+            for container_id in set(eligible_at.keys()) - set(exited_container_ids):
+                del eligible_at[container_id]
+            candidates = [i for i in exited_container_ids if eligible_at.get(i, 0) <= started_at][:self.batch_size]
+
+            rate_limiter = self.__get_node_state(self.rate_limiters, node, lambda: RateLimiter(self.max_removals_per_sec))
+            # Every candidate is on this node, so this caps the node's concurrent calls
+            reaps = self.container_executor.fan_out_by_key(
+                lambda container_id: self.__safely_reap_container(node, node_conn, container_id, rate_limiter),
+                candidates, lambda container_id: node, self.node_concurrency)
+            removed = sum(future.result() for _, future in reaps)
+
+            with self.lock:
+                node_stats = self.stats.setdefault(node, {})
+                node_stats["runs"] = node_stats.get("runs", 0) + 1
+                node_stats["exited"] = len(exited_container_ids)
+                node_stats["last_run_at"] = started_at
+                node_stats["last_run_secs"] = time.time() - started_at
+            self.logger.debug(dict(message="Found {} exited containers on {}, {} were removed".format(len(exited_container_ids), node, removed)))
+            return removed
+        finally:
+            node_lock.release()
+
+    def __safely_reap_container(self, node, node_conn, container_id, rate_limiter):
+        try:
+            return self.__reap_container(node, node_conn, container_id, rate_limiter)
+        except Exception as e:
+            self.__increment(node, "errors")
+            self.logger.error(dict(message="Reaping container {} on {} generated an exception: {}".format(container_id, node, e)))
+            return 0
+
+    def __reap_container(self, node, node_conn, container_id, rate_limiter):
+        try:
+            node_container = node_conn.inspect_container(container_id)
+        except docker.errors.APIError as e:
+            if '404 Client Error' in e.message:
+                return 0
+            raise
+        self.__increment(node, "inspected")
+
+        created_time = self.__parse_docker_time(node_container["Created"])
+        exit_time = self.__parse_docker_time(node_container["State"]['FinishedAt'])
+        eligible_time = max(created_time, exit_time) + datetime.timedelta(seconds=self.grace_period_secs)
+        eligible_in_secs = (eligible_time - datetime.datetime.now()).total_seconds()
+        if eligible_in_secs > 0:
+            self.logger.debug(dict(message="Exited container {} on {} not older than gc period, ignoring".format(container_id, node)))
+            self.eligible_at[node][container_id] = time.time() + eligible_in_secs
+            self.__increment(node, "skipped")
+            return 0
+
+        rate_limiter.acquire()
+        try:
+            node_conn.remove_container(container_id)
+            self.logger.warn(dict(message="Exited container {} on {} with exit time at {} older than gc period, removed".format(container_id, node, node_container["State"]['FinishedAt'])))
+        except docker.errors.APIError as e:
+            if '404 Client Error' in e.message:
+                self.logger.info(dict(message='Container already removed: {}'.format(container_id)))
+                return 0
+            raise
+        self.__increment(node, "removed")
+        return 1
+
+    def __parse_docker_time(self, formatted_time):
+        return datetime.datetime.strptime(formatted_time.rstrip("Z").split('.')[0], '%Y-%m-%dT%H:%M:%S')
+
+    def __get_node_state(self, states, node, factory):
+        with self.lock:
+            if node not in states:
+                states[node] = factory()
+            return states[node]
+
+    def __increment(self, node, stat):
+        with self.lock:
+            node_stats = self.stats.setdefault(node, {})
+            node_stats[stat] = node_stats.get(stat, 0) + 1
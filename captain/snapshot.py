@@ -0,0 +1,91 @@
+import logging
+import marshal
+import os
+import time
+
+from captain.worker import PeriodicWorker
+
+snapshot_version = 1
+
+
+def write_snapshot(path, snapshot):
+    """
+    Writes a snapshot with marshal to a temporary file which is then renamed over path,
+    so readers only ever see a complete snapshot.
+    """
+    temp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(temp_path, "wb") as snapshot_file:
+        marshal.dump(snapshot, snapshot_file)
+    os.rename(temp_path, path)
+
+
+def read_snapshot(path):
+    """
+    Returns the snapshot at path, or None if there isn't a readable snapshot of the current version.
+    """
+    try:
+        with open(path, "rb") as snapshot_file:
+            snapshot = marshal.load(snapshot_file)
+    except (IOError, EOFError, ValueError, TypeError):
+        return None
+    if not isinstance(snapshot, dict) or snapshot.get("version") != snapshot_version:
+        return None
+    return snapshot
+
+
+class Snapshotter(object):
+    """
+    Periodically saves the instance index and the inspect cache to local disk, and restores them on boot,
+    so that a restarted Captain starts warm instead of inspecting every container on every node again.
+    Restored instances are served as stale until the nodes have been listed again.
+    """
+
+    def __init__(self, connection, path, interval_secs):
+        self.logger = logging.getLogger(__name__)
+        self.connection = connection
+        self.path = path
+        self.worker = PeriodicWorker("snapshotter", self.save, interval_secs)
+        self.saved_at = None
+        self.restored_at = None
+
+    def start(self):
+        self.worker.start()
+
+    def stop(self):
+        self.worker.stop()
+        self.save()
+
+    def save(self):
+        started_at = time.time()
+        container_nodes = self.connection.inspect_cache.export()
+        nodes = {}
+        for node, instances in self.connection.index.get_instances_by_node().items():
+            nodes[node] = {"instances": instances, "containers": container_nodes.get(node, [])}
+        write_snapshot(self.path, {"version": snapshot_version, "written_at": started_at, "nodes": nodes})
+        self.saved_at = started_at
+        self.logger.debug(dict(message="Saved snapshot of {} nodes to {} in {:.3f}s".format(len(nodes), self.path, time.time() - started_at)))
+
+    def restore(self):
+        """
+        Loads the snapshot on disk, if any, into the index, the inspect cache and the inventory.
+        Nodes which are no longer configured are ignored. Returns True if a snapshot was restored.
+        """
+        started_at = time.time()
+        snapshot = read_snapshot(self.path)
+        if snapshot is None:
+            self.logger.info(dict(message="No snapshot to restore from {}".format(self.path)))
+            return False
+        node_instances = {}
+        for node, node_snapshot in snapshot["nodes"].items():
+            if node not in self.connection.node_connections:
+                continue
+            for container in node_snapshot["containers"]:
+                self.connection.inspect_cache.put(node, container)
+            self.connection.index.update_node(node, node_snapshot["instances"])
+            node_instances[node] = node_snapshot["instances"]
+        if self.connection.inventory is not None:
+            self.connection.inventory.load(node_instances, snapshot["written_at"])
+        self.restored_at = started_at
+        self.logger.info(dict(message="Restored snapshot of {} nodes written {:.0f}s ago in {:.3f}s".format(
+            len(node_instances), started_at - snapshot["written_at"], time.time() - started_at)))
+        return True
@@ -3,6 +3,9 @@ os.environ["SLUG_RUNNER_COMMAND"] = ''
 os.environ["SLUG_RUNNER_IMAGE"] = ''
 os.environ["LOG_CONFIG_FILE_PATH"] = "{}/../../logging.conf".format(os.path.dirname(os.path.abspath(__file__)))
 os.environ['DOCKER_NODES'] = '1.1.1.1,2.2.2.2'
+os.environ['DOCKER_GC_INTERVAL_SECS'] = '0'
+os.environ['NODE_REFRESH_INTERVAL_SECS'] = '0'
+os.environ['INSTANCE_WATCH_INTERVAL_SECS'] = '0'
 
 import captain_web
 import json
@@ -42,3 +45,258 @@ class TestApi(unittest.TestCase):
         eq_(test_response.content_type, 'application/json')
         eq_(json.loads(test_response.data), {"description": "There aren't enough free slots on node-1 to service your request"})
         eq_(test_response.status_code, 503)
+
+    @patch('captain_web.Connection.start_instance')
+    def test_start_instance_without_node_with_capacity_error(self, mock_captain_connection_start_instance):
+        """
+        When starting an instance without a node and no node has enough slots we should have a 503 response
+        """
+        mock_captain_connection_start_instance.side_effect = exceptions.NodeOutOfCapacityException()
+        headers = [('Content-Type', 'application/json')]
+        payload = dict(app='paye', slug_uri='http://host/paye.tgz')
+        test_response = self.test_app.post('/instances/', headers=headers, data=json.dumps(payload))
+        eq_(json.loads(test_response.data), {"description": "There aren't enough free slots on any node to service your request"})
+        eq_(test_response.status_code, 503)
+
+    @patch('captain_web.Connection.start_instances')
+    def test_start_batch_of_instances_by_app_and_count(self, mock_captain_connection_start_instances):
+        """
+        Starting a batch with an app and count should start count copies of the request and report partial failures
+        """
+        mock_captain_connection_start_instances.return_value = [
+            {"index": 0, "status": "started", "instance": {"id": "80be2a9e62ba00"}},
+            {"index": 1, "status": "failed", "error": "NodeOutOfCapacityException", "message": ""}]
+        headers = [('Content-Type', 'application/json')]
+        payload = dict(app='paye', slug_uri='http://host/paye.tgz', slots=2, count=2)
+        test_response = self.test_app.post('/instances/batch', headers=headers, data=json.dumps(payload))
+        mock_captain_connection_start_instances.assert_called_with([dict(app='paye', slug_uri='http://host/paye.tgz', slots=2)] * 2)
+        eq_(test_response.status_code, 207)
+        eq_(json.loads(test_response.data)["started"], 1)
+        eq_(json.loads(test_response.data)["failed"], 1)
+
+    def test_start_batch_without_instances_or_count(self):
+        headers = [('Content-Type', 'application/json')]
+        test_response = self.test_app.post('/instances/batch', headers=headers, data=json.dumps(dict(app='paye')))
+        eq_(test_response.status_code, 400)
+
+    @patch('captain_web.Connection.start_instances')
+    def test_start_batch_with_invalid_count(self, mock_captain_connection_start_instances):
+        """
+        A count which isn't a whole number from 1 to the configured maximum should be refused before anything starts
+        """
+        headers = [('Content-Type', 'application/json')]
+        for count in [0, -1, 101, 10 ** 9, "2", 2.5, True, None, [2]]:
+            payload = dict(app='paye', slug_uri='http://host/paye.tgz', count=count)
+            test_response = self.test_app.post('/instances/batch', headers=headers, data=json.dumps(payload))
+            eq_(test_response.status_code, 400, "count {!r} wasn't refused".format(count))
+        self.assertFalse(mock_captain_connection_start_instances.called)
+
+    @patch('captain_web.Connection.start_instances')
+    def test_start_batch_with_too_many_instances(self, mock_captain_connection_start_instances):
+        headers = [('Content-Type', 'application/json')]
+        for instances in [[], [dict(app='paye')] * 101, dict(app='paye'), ["paye"]]:
+            test_response = self.test_app.post('/instances/batch', headers=headers, data=json.dumps(dict(instances=instances)))
+            eq_(test_response.status_code, 400)
+        for body in [[dict(app='paye')] * 101, "paye", 2]:
+            test_response = self.test_app.post('/instances/batch', headers=headers, data=json.dumps(body))
+            eq_(test_response.status_code, 400)
+        self.assertFalse(mock_captain_connection_start_instances.called)
+
+    @patch('captain_web.Connection.start_instances')
+    def test_start_batch_of_instances_from_a_list(self, mock_captain_connection_start_instances):
+        mock_captain_connection_start_instances.return_value = [
+            {"index": 0, "status": "started", "instance": {"id": "80be2a9e62ba00"}}]
+        headers = [('Content-Type', 'application/json')]
+        instances = [dict(app='paye', slug_uri='http://host/paye.tgz')]
+        test_response = self.test_app.post('/instances/batch', headers=headers, data=json.dumps(instances))
+        mock_captain_connection_start_instances.assert_called_with(instances)
+        eq_(test_response.status_code, 201)
+
+    @patch('captain_web.Connection.stop_instances')
+    def test_stop_instances_by_app(self, mock_captain_connection_stop_instances):
+        """
+        Stopping instances in bulk should pass the filters through and aggregate the results
+        """
+        mock_captain_connection_stop_instances.return_value = [
+            {"id": "80be2a9e62ba00", "node": "node-2", "status": "stopped"},
+            {"id": "eba8bea2600029", "node": "node-1", "status": "failed", "error": "ConnectionError", "message": ""}]
+        test_response = self.test_app.delete('/instances/?app=paye&grace=5')
+        eq_(mock_captain_connection_stop_instances.call_args[1]["app"], "paye")
+        eq_(mock_captain_connection_stop_instances.call_args[1]["timeout"], 5)
+        eq_(test_response.status_code, 200)
+        eq_(json.loads(test_response.data)["stopped"], 1)
+        eq_(json.loads(test_response.data)["failed"], 1)
+
+    def test_stop_instances_without_filters(self):
+        test_response = self.test_app.delete('/instances/')
+        eq_(test_response.status_code, 400)
+
+    @patch('captain_web.Connection.stop_instances')
+    def test_stop_instances_with_invalid_ids(self, mock_captain_connection_stop_instances):
+        """
+        Empty or short ids, and a body which isn't a list of ids, should be refused before anything is stopped
+        """
+        headers = [('Content-Type', 'application/json')]
+        eq_(self.test_app.delete('/instances/?id=').status_code, 400)
+        eq_(self.test_app.delete('/instances/?id=656').status_code, 400)
+        eq_(self.test_app.delete('/instances/', headers=headers, data=json.dumps("656ca7c307d178")).status_code, 400)
+        eq_(self.test_app.delete('/instances/', headers=headers, data=json.dumps(["656ca7c307d178", 6])).status_code, 400)
+        self.assertFalse(mock_captain_connection_stop_instances.called)
+
+    @patch('captain_web.Connection.get_logs')
+    def test_get_logs_with_tail_since_and_timestamps(self, mock_captain_connection_get_logs):
+        mock_captain_connection_get_logs.return_value = iter([{"msg": "this is line 1\n"}])
+        test_response = self.test_app.get('/instances/80be2a9e62ba00/logs?tail=5&since=1408696448&timestamps=1')
+        eq_(test_response.status_code, 200)
+        eq_(test_response.data, '{"msg": "this is line 1\\n"}\n')
+        mock_captain_connection_get_logs.assert_called_once_with("80be2a9e62ba00", follow=False, tail=5, since=1408696448, timestamps=True)
+
+    @patch('captain_web.Connection.get_log_batches')
+    def test_get_logs_as_plain_text(self, mock_captain_connection_get_log_batches):
+        mock_captain_connection_get_log_batches.return_value = iter([["this is line 1\n", "this is line 2\n"], ["this is line 3\n"]])
+        test_response = self.test_app.get('/instances/80be2a9e62ba00/logs?tail=5', headers={"Accept": "text/plain"})
+        eq_(test_response.status_code, 200)
+        eq_(test_response.mimetype, "text/plain")
+        eq_(test_response.data, "this is line 1\nthis is line 2\nthis is line 3\n")
+        mock_captain_connection_get_log_batches.assert_called_once_with("80be2a9e62ba00", follow=False, tail=5, since=None, timestamps=False)
+
+    @patch('captain_web.Connection.get_log_batches')
+    def test_get_logs_in_batches(self, mock_captain_connection_get_log_batches):
+        mock_captain_connection_get_log_batches.return_value = iter([["this is line 1\n", "this is line 2\n"]])
+        test_response = self.test_app.get('/instances/80be2a9e62ba00/logs?batch=1')
+        eq_(test_response.status_code, 200)
+        eq_(test_response.data, '{"msgs": ["this is line 1\\n", "this is line 2\\n"]}\n')
+
+    @patch('captain_web.Connection.get_nodes')
+    def test_get_nodes_not_modified(self, mock_captain_connection_get_nodes):
+        mock_captain_connection_get_nodes.return_value = [{"id": "node-1", "slots": {"total": 10, "used": 2, "free": 8}, "state": "healthy"}]
+        test_response = self.test_app.get('/nodes/')
+        eq_(test_response.status_code, 200)
+        etag = test_response.headers["ETag"]
+
+        test_response = self.test_app.get('/nodes/', headers={"If-None-Match": etag})
+        eq_(test_response.status_code, 304)
+        eq_(test_response.data, "")
+
+        mock_captain_connection_get_nodes.return_value = [{"id": "node-1", "slots": {"total": 10, "used": 3, "free": 7}, "state": "healthy"}]
+        test_response = self.test_app.get('/nodes/', headers={"If-None-Match": etag})
+        eq_(test_response.status_code, 200)
+
+    @patch('captain_web.Connection.get_node')
+    def test_get_node_not_modified(self, mock_captain_connection_get_node):
+        mock_captain_connection_get_node.return_value = {"id": "node-1", "slots": {"total": 10, "used": 2, "free": 8}, "state": "healthy"}
+        test_response = self.test_app.get('/nodes/node-1')
+        eq_(test_response.status_code, 200)
+        etag = test_response.headers["ETag"]
+
+        test_response = self.test_app.get('/nodes/node-1', headers={"If-None-Match": etag})
+        eq_(test_response.status_code, 304)
+        eq_(test_response.data, "")
+
+        mock_captain_connection_get_node.return_value = {"id": "node-1", "slots": {"total": 10, "used": 3, "free": 7}, "state": "healthy"}
+        test_response = self.test_app.get('/nodes/node-1', headers={"If-None-Match": etag})
+        eq_(test_response.status_code, 200)
+
+    @patch('captain_web.Connection.get_inventory_age')
+    @patch('captain_web.Connection.get_inventory_version')
+    @patch('captain_web.Connection.get_instances')
+    def test_get_instances_not_modified_since_inventory_version(self, mock_captain_connection_get_instances,
+                                                                mock_captain_connection_get_inventory_version,
+                                                                mock_captain_connection_get_inventory_age):
+        mock_captain_connection_get_inventory_age.return_value = None
+        mock_captain_connection_get_inventory_version.return_value = "0a1b2c-7"
+        mock_captain_connection_get_instances.return_value = [{"id": "80be2a9e62ba00", "app": "paye"}]
+        test_response = self.test_app.get('/instances/')
+        eq_(test_response.status_code, 200)
+        eq_(test_response.headers["ETag"], '"v-0a1b2c-7"')
+
+        test_response = self.test_app.get('/instances/', headers={"If-None-Match": '"v-0a1b2c-7"'})
+        eq_(test_response.status_code, 304)
+        # The inventory version answered the request without getting the instances again
+        eq_(mock_captain_connection_get_instances.call_count, 1)
+
+    @patch('captain_web.Connection.watch_instances')
+    def test_watch_instances(self, mock_captain_connection_watch_instances):
+        mock_captain_connection_watch_instances.return_value = iter([
+            {"type": "added", "token": "0a1b2c-8", "instance": {"id": "80be2a9e62ba00"}}])
+        test_response = self.test_app.get('/instances/?watch=1&token=0a1b2c-7')
+        eq_(test_response.status_code, 200)
+        eq_(test_response.mimetype, "application/jsonstream")
+        eq_(json.loads(test_response.data)["token"], "0a1b2c-8")
+        mock_captain_connection_watch_instances.assert_called_once_with("0a1b2c-7")
+
+    @patch('captain_web.Connection.get_instance_changes')
+    def test_get_instance_changes(self, mock_captain_connection_get_instance_changes):
+        changes = {"token": "0a1b2c-8", "resync": False,
+                   "changes": [{"type": "added", "token": "0a1b2c-8", "instance": {"id": "80be2a9e62ba00"}}]}
+        mock_captain_connection_get_instance_changes.return_value = changes
+        test_response = self.test_app.get('/instances/changes?since=0a1b2c-7')
+        eq_(test_response.status_code, 200)
+        eq_(json.loads(test_response.data), changes)
+        mock_captain_connection_get_instance_changes.assert_called_once_with("0a1b2c-7")
+
+    @patch('captain_web.Connection.get_inventory_age')
+    @patch('captain_web.Connection.get_inventory_version')
+    @patch('captain_web.Connection.find_instances')
+    def test_get_instances_filtered_and_paged(self, mock_captain_connection_find_instances,
+                                              mock_captain_connection_get_inventory_version,
+                                              mock_captain_connection_get_inventory_age):
+        mock_captain_connection_get_inventory_age.return_value = None
+        mock_captain_connection_get_inventory_version.return_value = None
+        mock_captain_connection_find_instances.return_value = ([{"id": "80be2a9e62ba00", "port": 9225}], "80be2a9e62ba00")
+        test_response = self.test_app.get('/instances/?app=paye&node=node-1&node=node-2&fields=id,port&limit=1&cursor=7')
+        eq_(test_response.status_code, 200)
+        eq_(json.loads(test_response.data), [{"id": "80be2a9e62ba00", "port": 9225}])
+        eq_(test_response.headers["X-Next-Cursor"], "80be2a9e62ba00")
+        mock_captain_connection_find_instances.assert_called_once_with(app="paye", nodes=["node-1", "node-2"], fields=["id", "port"],
+                                                                      limit=1, after="7")
+
+    def test_get_instances_with_invalid_limit(self):
+        test_response = self.test_app.get('/instances/?limit=0')
+        eq_(test_response.status_code, 400)
+
+    @patch('captain_web.Connection.get_inventory_age')
+    @patch('captain_web.Connection.get_inventory_version')
+    @patch('captain_web.Connection.get_instances')
+    def test_get_instances_is_streamed(self, mock_captain_connection_get_instances,
+                                       mock_captain_connection_get_inventory_version,
+                                       mock_captain_connection_get_inventory_age):
+        mock_captain_connection_get_inventory_age.return_value = None
+        mock_captain_connection_get_inventory_version.return_value = None
+        instances = [{"id": "{:014d}".format(i), "app": "paye", "environment": {"PORT": str(i)}} for i in range(2000)]
+        mock_captain_connection_get_instances.return_value = instances
+        test_response = self.test_app.get('/instances/')
+        eq_(test_response.status_code, 200)
+        eq_(test_response.content_type, 'application/json')
+        eq_(test_response.headers.get("Content-Length"), None)
+        eq_(json.loads(test_response.data), instances)
+        # Without an inventory version there is nothing to tag the list with short of encoding it twice
+        eq_(test_response.headers.get("ETag"), None)
+
+    @patch('captain_web.socket.gethostname')
+    @patch('captain_web.Connection.stop_instance')
+    @patch('captain_web.Connection.find_instance')
+    def test_stop_instance_redirects_when_a_short_id_resolves_to_captain_itself(self, mock_captain_connection_find_instance,
+                                                                             mock_captain_connection_stop_instance,
+                                                                             mock_gethostname):
+        mock_gethostname.return_value = "8c2a5c30ab1f"
+        mock_captain_connection_find_instance.return_value = {"id": "8c2a5c30ab1f9d54e3c8a7b1", "node": "node-1"}
+        test_response = self.test_app.delete('/instances/8c2a5c30')
+        eq_(test_response.status_code, 307)
+        mock_captain_connection_find_instance.assert_called_once_with("8c2a5c30")
+        self.assertFalse(mock_captain_connection_stop_instance.called)
+
+    @patch('captain_web.Connection.stop_instance')
+    @patch('captain_web.Connection.find_instance')
+    def test_stop_instance_by_short_id(self, mock_captain_connection_find_instance, mock_captain_connection_stop_instance):
+        mock_captain_connection_find_instance.return_value = {"id": "80be2a9e62ba00", "node": "node-2"}
+        mock_captain_connection_stop_instance.return_value = True
+        test_response = self.test_app.delete('/instances/80be2a')
+        eq_(test_response.status_code, 204)
+        mock_captain_connection_stop_instance.assert_called_once_with("80be2a9e62ba00")
+
+    @patch('captain_web.Connection.get_logs')
+    def test_get_logs_of_a_missing_instance(self, mock_captain_connection_get_logs):
+        mock_captain_connection_get_logs.side_effect = exceptions.NoSuchInstanceException()
+        test_response = self.test_app.get('/instances/80be2a9e62ba00/logs')
+        eq_(test_response.status_code, 404)
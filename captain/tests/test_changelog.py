@@ -0,0 +1,72 @@
+import threading
+import unittest
+from captain.changelog import InstanceChangeLog
+
+
+class TestInstanceChangeLog(unittest.TestCase):
+
+    def test_records_added_modified_and_removed_instances(self):
+        # given
+        changelog = InstanceChangeLog()
+        token = changelog.record({"node-1": [{"id": "a", "node": "node-1", "port": 1}, {"id": "b", "node": "node-1", "port": 2}]})
+
+        # when
+        changelog.record({"node-1": [{"id": "a", "node": "node-1", "port": 3}, {"id": "c", "node": "node-1", "port": 4}]})
+        changes = changelog.changes_since(token)
+
+        # then
+        self.assertEqual([("a", "modified"), ("b", "removed"), ("c", "added")],
+                         sorted((c["instance"]["id"], c["type"]) for c in changes))
+        self.assertEqual(changelog.snapshot()[0], changes[-1]["token"])
+        self.assertEqual([], changelog.changes_since(changes[-1]["token"]))
+        self.assertEqual(sorted(["a", "c"]), sorted(i["id"] for i in changelog.snapshot()[1]))
+
+    def test_unchanged_instances_record_nothing(self):
+        changelog = InstanceChangeLog()
+        token = changelog.record({"node-1": [{"id": "a", "node": "node-1", "port": 1}]})
+
+        self.assertEqual(token, changelog.record({"node-1": [{"id": "a", "node": "node-1", "port": 1}]}))
+
+    def test_instances_of_a_node_which_could_not_be_listed_are_kept(self):
+        # given
+        changelog = InstanceChangeLog()
+        token = changelog.record({"node-1": [{"id": "a", "node": "node-1"}], "node-2": [{"id": "b", "node": "node-2"}]})
+
+        # when
+        changelog.record({"node-2": [{"id": "b", "node": "node-2"}, {"id": "c", "node": "node-2"}]})
+
+        # then
+        self.assertEqual([("c", "added")], [(c["instance"]["id"], c["type"]) for c in changelog.changes_since(token)])
+        self.assertEqual(["a", "b", "c"], sorted(i["id"] for i in changelog.snapshot()[1]))
+
+    def test_instances_of_a_removed_node_are_removed(self):
+        changelog = InstanceChangeLog()
+        token = changelog.record({"node-1": [{"id": "a", "node": "node-1"}], "node-2": [{"id": "b", "node": "node-2"}]})
+
+        changelog.remove_node("node-1")
+
+        self.assertEqual([("a", "removed")], [(c["instance"]["id"], c["type"]) for c in changelog.changes_since(token)])
+
+    def test_tokens_pushed_out_of_the_log_or_from_another_log_are_rejected(self):
+        # given
+        changelog = InstanceChangeLog(max_changes=1)
+        first = changelog.record({"node-1": [{"id": "a", "node": "node-1"}]})
+        second = changelog.record({"node-1": [{"id": "a", "node": "node-1"}, {"id": "b", "node": "node-1"}]})
+
+        # when
+        changelog.record({"node-1": [{"id": "a", "node": "node-1"}, {"id": "b", "node": "node-1"}, {"id": "c", "node": "node-1"}]})
+
+        # then
+        self.assertIsNone(changelog.changes_since(first))
+        self.assertEqual(["c"], [c["instance"]["id"] for c in changelog.changes_since(second)])
+        self.assertIsNone(changelog.changes_since(InstanceChangeLog().record({"node-1": [{"id": "a", "node": "node-1"}]})))
+        self.assertIsNone(changelog.changes_since("not-a-token"))
+
+    def test_wait_returns_when_a_change_is_recorded(self):
+        changelog = InstanceChangeLog()
+        token = changelog.record({})
+        threading.Timer(0.05, lambda: changelog.record({"node-1": [{"id": "a", "node": "node-1"}]})).start()
+
+        changelog.wait(token, 5)
+
+        self.assertEqual(["a"], [c["instance"]["id"] for c in changelog.changes_since(token)])
@@ -94,15 +94,38 @@ class TestConfig(unittest.TestCase):
         self.assertEqual(config.slug_runner_version, '0.0.0')
 
         self.assertEqual(config.docker_gc_grace_period, 86400)
+        self.assertEqual(config.docker_gc_interval_secs, 300)
+        self.assertEqual(config.docker_gc_batch_size, 50)
+        self.assertEqual(config.docker_gc_max_removals_per_sec, 5)
+        self.assertEqual(config.docker_gc_node_concurrency, 2)
+        self.assertEqual(config.docker_gc_node_parallelism, 4)
+        self.assertEqual(config.fanout_workers_per_node, 2)
+        self.assertEqual(config.docker_pool_maxsize, 16)
+        self.assertFalse(config.docker_pool_block)
+        self.assertEqual(config.fanout_max_workers, 64)
+        self.assertEqual(config.inspect_cache_max_entries_per_node, 1024)
+        self.assertEqual(config.inspect_cache_ttl_secs, 0)
 
         self.assertEqual(config.slots_per_node, 110)
         self.assertEqual(config.slot_memory_mb, int(self.SLOT_MEMORY_MB))
         self.assertEqual(config.default_slots_per_instance, int(self.DEFAULT_SLOTS_PER_INSTANCE))
+        self.assertEqual(config.placement_strategy, "spread")
+        self.assertEqual(config.batch_node_parallelism, 4)
+        self.assertEqual(config.batch_max_workers, 16)
+        self.assertEqual(config.batch_max_instances, 100)
 
         self.assertEqual(config.aws_call_interval_secs, 60)
         self.assertEqual(config.aws_docker_host_tag_name, "role")
+        self.assertEqual(config.node_refresh_interval_secs, 60)
+        self.assertEqual(config.instance_watch_interval_secs, 5)
+        self.assertFalse(config.node_warm_up_enabled)
+        self.assertEqual(config.node_slow_response_secs, 2)
         self.assertIsNone(config.aws_docker_host_tag_value)
         self.assertEqual(config.log_config_file_path, "logging.conf")
+        self.assertEqual(config.inventory_refresh_interval_secs, 0)
+        self.assertFalse(config.inventory_events_enabled)
+        self.assertIsNone(config.snapshot_path)
+        self.assertEqual(config.snapshot_interval_secs, 60)
 
     @mock.patch("os.getenv")
     def test_fails_when_no_slug_runner_command_specified(self, mock_getenv):
@@ -3,26 +3,20 @@ import unittest
 from mock import patch, MagicMock, call
 from captain.connection import Connection
 from captain import exceptions
-from captain.tests.util_mock import ClientMock
+from captain.tests.util_mock import ClientMock, mock_config
 from requests.exceptions import ConnectionError
 from testfixtures import LogCapture
 import itertools
+import socket
+import threading
+import time
+import docker
 
 
 class TestConnection(unittest.TestCase):
 
     def setUp(self):
-        self.config = MagicMock()
-        self.config.docker_nodes = ["http://node-1/", "http://node-2/", "http://node-3/"]
-        self.config.slug_runner_command = "runner command"
-        self.config.slug_runner_image = "runner/image"
-        self.config.slug_runner_version = "0.0.73"
-        self.config.docker_gc_grace_period = 86400
-        self.config.slots_per_node = 10
-        self.config.slot_memory_mb = 128
-        self.config.default_slots_per_instance = 2
-        self.config.aws_docker_host_tag_name = None
-        self.config.aws_docker_host_tag_value = None
+        self.config = mock_config()
 
         self.docker_node_resolver = MagicMock()
         self.docker_node_resolver.get_docker_nodes = MagicMock(return_value=["http://node-1/", "http://node-2/", "http://node-3/"])
@@ -109,12 +103,9 @@ class TestConnection(unittest.TestCase):
         self.assertEqual(2, instance3["environment"].__len__())
         self.assertEqual("-Dapplication.log=INFO -Drun.mode=Prod -Dlogger.resource=/application-json-logger.xml -Dhttp.port=8080", instance3["environment"]["HMRC_CONFIG"])
         self.assertEqual("-Xmx256m -Xms256m", instance3["environment"]["JAVA_OPTS"])
-        # One container stopped
-        docker_conn1.remove_container.assert_has_calls([call("381587e2978216")])
-        # One container with FinishedAt time of 0 removed
-        docker_conn1.remove_container.assert_has_calls([call("3815178hgdasf6")])
-        self.assertEqual(docker_conn1.remove_container.call_count, 2)
-        self.assertEqual(docker_conn2.remove_container.call_count, 1)
+        # Exited containers are left to the reaper
+        self.assertFalse(docker_conn1.remove_container.called)
+        self.assertFalse(docker_conn2.remove_container.called)
         # jh23899fg00029 doesn't have captain ports defined and should be ignored.
         self.assertFalse([i for i in instances if i["id"] == "jh23899fg00029"])
 
@@ -320,6 +311,19 @@ class TestConnection(unittest.TestCase):
             ({"msg": "this is line 1"}, {"msg": "this is line 2"}, {"msg": "this is line 3"}),
             tuple(itertools.islice(instance_logs, 3)))
 
+    @patch('docker.Client')
+    def test_followers_without_a_tail_each_get_the_whole_log(self, docker_client):
+        (mock_client_node1, mock_client_node2, mock_client_node3) = ClientMock().mock_two_docker_nodes(docker_client)
+        connection = Connection(self.config, self.docker_node_resolver)
+
+        first = connection.get_logs("eba8bea2600029", follow=True)
+        second = connection.get_logs("eba8bea2600029", follow=True)
+
+        self.assertEqual({"msg": "this is line 1"}, first.next())
+        self.assertEqual({"msg": "this is line 1"}, second.next())
+        self.assertEqual(2, mock_client_node1._get.call_count)
+        self.assertEqual([], connection.get_log_stream_stats())
+
     @patch('docker.Client')
     def test_get_nodes(self, docker_client):
         (mock_client_node1, mock_client_node2, mock_client_node3) = ClientMock().mock_two_docker_nodes(docker_client)
@@ -334,18 +338,581 @@ class TestConnection(unittest.TestCase):
         )
 
     @patch('docker.Client')
-    def test_gc(self, docker_client):
-        # given
+    def test_get_node_instance(self, docker_client):
         (docker_conn1, docker_conn2, docker_conn3) = ClientMock().mock_two_docker_nodes(docker_client)
+        connection = Connection(self.config, self.docker_node_resolver)
+
+        self.assertEqual("80be2a9e62ba00", connection.get_node_instance("node-2", "80be2a9e62ba00")["id"])
+        self.assertIsNone(connection.get_node_instance("node-2", "no-such-container"))
+
+    @patch('docker.Client')
+    def test_get_node_events(self, docker_client):
+        (docker_conn1, docker_conn2, docker_conn3) = ClientMock().mock_two_docker_nodes(docker_client)
+        docker_conn1._stream_helper = MagicMock(return_value=iter(['{"status": "start", "id": "eba8bea2600029", "time": 1408696448}']))
+        connection = Connection(self.config, self.docker_node_resolver)
+
+        events, close_fn = connection.get_node_events("node-1")
+
+        self.assertTrue(docker_conn1._stream_helper.called)
+        self.assertEqual([{"status": "start", "id": "eba8bea2600029", "time": 1408696448}], list(events))
+        close_fn()
+        docker_conn1._get_raw_response_socket.return_value.shutdown.assert_called_once_with(socket.SHUT_RDWR)
+        docker_conn1.get.return_value.close.assert_called_once_with()
+
+    @patch('docker.Client')
+    def test_stop_instance_only_touches_owning_node_once_indexed(self, docker_client):
+        # given
+        (mock_client_node1, mock_client_node2, mock_client_node3) = ClientMock().mock_two_docker_nodes(docker_client)
+        connection = Connection(self.config, self.docker_node_resolver)
+        connection.get_instances()
+        mock_client_node1.reset_mock()
+        mock_client_node2.reset_mock()
+
+        # when
+        result = connection.stop_instance("80be2a9e62ba")
+
+        # then
+        self.assertTrue(result)
+        self.assertEqual([], mock_client_node1.mock_calls)
+        self.assertFalse(mock_client_node2.containers.called)
+        mock_client_node2.stop.assert_called_with('80be2a9e62ba00')
+        self.assertIsNone(connection.index.lookup("80be2a9e62ba00"))
+
+    @patch('docker.Client')
+    def test_get_instance_falls_back_to_node_lookup_on_index_miss(self, docker_client):
+        # given
+        (mock_client_node1, mock_client_node2, mock_client_node3) = ClientMock().mock_two_docker_nodes(docker_client)
+        connection = Connection(self.config, self.docker_node_resolver)
+
+        # when
+        instance = connection.get_instance("80be2a9e62ba00")
+
+        # then
+        self.assertEqual("node-2", instance["node"])
+        self.assertFalse(mock_client_node1.containers.called)
+        self.assertFalse(mock_client_node2.containers.called)
+        self.assertEqual(instance, connection.index.lookup("80be2a9e62ba00"))
+        self.assertIsNone(connection.get_instance("nonexisting-instance"))
+
+        # when
+        mock_client_node2.inspect_container.reset_mock()
+        connection.get_instance("80be2a9e62ba00")
+
+        # then
+        mock_client_node2.inspect_container.assert_called_once_with("80be2a9e62ba00")
+
+    @patch('docker.Client')
+    def test_start_instance_capacity_check_only_lists_target_node(self, docker_client):
+        # given
+        (mock_client_node1, mock_client_node2, mock_client_node3) = ClientMock().mock_two_docker_nodes(docker_client)
+        connection = Connection(self.config, self.docker_node_resolver)
+
+        # when
+        connection.start_instance("paye", "https://host/paye_216.tgz", "node-1", None, {}, 2)
+        connection.start_instance("paye", "https://host/paye_216.tgz", "node-1", None, {}, 2)
+
+        # then
+        self.assertEqual(1, mock_client_node1.containers.call_count)
+        self.assertFalse(mock_client_node2.containers.called)
+        self.assertEqual(4, connection.ledger.get_used("node-1"))
+
+    @patch('docker.Client')
+    def test_start_instance_releases_reservation_on_failure(self, docker_client):
+        # given
+        (mock_client_node1, mock_client_node2, mock_client_node3) = ClientMock().mock_two_docker_nodes(docker_client)
+        mock_client_node1.start.side_effect = ConnectionError()
+        connection = Connection(self.config, self.docker_node_resolver)
+
+        # when
+        self.assertRaises(ConnectionError, connection.start_instance, "ers", "https://host/ers_1.tgz", "node-1", None, {}, 6)
+
+        # then
+        self.assertEqual(4, connection.ledger.get_used("node-1"))
+
+    @patch('docker.Client')
+    def test_start_instance_without_node_places_it(self, docker_client):
+        # given
+        (mock_client_node1, mock_client_node2, mock_client_node3) = ClientMock().mock_two_docker_nodes(docker_client)
+        mock_client_node2.create_container = MagicMock(return_value={'Id': '80be2a9e62ba00'})
+        connection = Connection(self.config, self.docker_node_resolver)
 
         # when
+        started_instance = connection.start_instance("paye", "https://host/paye_216.tgz", slots=2)
+
+        # then
+        self.assertEqual("node-2", started_instance["node"])
+        self.assertFalse(mock_client_node1.create_container.called)
+        self.assertEqual(["node-2", "node-1"], connection.choose_nodes("paye", 2))
+        self.assertEqual(["node-2"], connection.choose_nodes("paye", 7))
+        self.assertRaises(exceptions.NodeOutOfCapacityException,
+                          connection.start_instance, "paye", "https://host/paye_216.tgz", slots=9)
+
+    @patch('docker.Client')
+    def test_choose_nodes_uses_cached_usage(self, docker_client):
+        # given
+        (mock_client_node1, mock_client_node2, mock_client_node3) = ClientMock().mock_two_docker_nodes(docker_client)
+        self.config.placement_strategy = "binpack"
+        connection = Connection(self.config, self.docker_node_resolver)
+        connection.choose_nodes("paye", 2)
+        mock_client_node1.reset_mock()
+        mock_client_node3.reset_mock()
+
+        # when
+        nodes = connection.choose_nodes("paye", 2)
+
+        # then
+        self.assertEqual(["node-1", "node-2"], nodes)
+        self.assertEqual([], mock_client_node1.mock_calls)
+        self.assertEqual([], mock_client_node3.mock_calls)
+
+    @patch('docker.Client')
+    def test_concurrent_placements_wait_for_the_listing_in_flight(self, docker_client):
+        # given
+        (mock_client_node1, mock_client_node2, mock_client_node3) = ClientMock().mock_two_docker_nodes(docker_client)
+        containers = mock_client_node1.containers.return_value
+        mock_client_node1.containers = MagicMock(side_effect=lambda **kwargs: time.sleep(0.2) or containers)
+        connection = Connection(self.config, self.docker_node_resolver)
+        chosen = []
+
+        # when
+        placements = [threading.Thread(target=lambda: chosen.append(connection.choose_nodes("paye", 2))) for _ in range(3)]
+        for placement in placements:
+            placement.start()
+        for placement in placements:
+            placement.join()
+
+        # then
+        self.assertEqual([["node-2", "node-1"]] * 3, chosen)
+        self.assertEqual(1, len(mock_client_node1.containers.call_args_list))
+
+    @patch('docker.Client')
+    def test_placement_lists_again_while_no_node_is_known(self, docker_client):
+        # given
+        (mock_client_node1, mock_client_node2, mock_client_node3) = ClientMock().mock_two_docker_nodes(docker_client)
+        containers = mock_client_node1.containers.return_value
+        mock_client_node1.containers = MagicMock(side_effect=[ConnectionError(), containers])
+        mock_client_node2.containers = MagicMock(side_effect=ConnectionError())
+        connection = Connection(self.config, self.docker_node_resolver)
+        self.assertEqual([], connection.choose_nodes("paye", 2))
+
+        # when
+        nodes = connection.choose_nodes("paye", 2)
+
+        # then
+        self.assertEqual(["node-1"], nodes)
+        self.assertEqual(2, mock_client_node1.containers.call_count)
+        # node-1 is known now, so the nodes still missing wait for the next interval
+        connection.choose_nodes("paye", 2)
+        self.assertEqual(2, mock_client_node2.containers.call_count)
+
+    @patch('docker.Client')
+    def test_start_instances_spreads_batch_and_reports_partial_failures(self, docker_client):
+        # given
+        (mock_client_node1, mock_client_node2, mock_client_node3) = ClientMock().mock_two_docker_nodes(docker_client)
+        mock_client_node2.create_container = MagicMock(return_value={'Id': '80be2a9e62ba00'})
+        self.config.placement_strategy = "app-spread"
+        self.config.batch_node_parallelism = 2
+        connection = Connection(self.config, self.docker_node_resolver)
+        instance_request = {"app": "ers", "slug_uri": "https://host/ers_1.tgz", "slots": 2, "environment": {"JAVA_OPTS": "-Xmx256m"}}
+
+        # when
+        results = connection.start_instances([instance_request, instance_request, {"slug_uri": "https://host/no_app.tgz"},
+                                              dict(instance_request, node="node-1", slots=9)])
+
+        # then
+        self.assertEqual(["started", "started", "failed", "failed"], [r["status"] for r in results])
+        self.assertEqual(set(["node-1", "node-2"]), set(r["instance"]["node"] for r in results[:2]))
+        self.assertEqual("KeyError", results[2]["error"])
+        self.assertEqual("NodeOutOfCapacityException", results[3]["error"])
+        self.assertEqual(1, mock_client_node1.create_container.call_count)
+        self.assertEqual(1, mock_client_node2.create_container.call_count)
+        self.assertEqual({"JAVA_OPTS": "-Xmx256m"}, instance_request["environment"])
+        self.assertEqual(0, connection.ledger.get_stats()["node-1"]["reserved"])
+
+    @patch('docker.Client')
+    def test_stop_instances_by_app_with_grace_period(self, docker_client):
+        # given
+        (mock_client_node1, mock_client_node2, mock_client_node3) = ClientMock().mock_two_docker_nodes(docker_client)
+        self.config.batch_node_parallelism = 2
+        connection = Connection(self.config, self.docker_node_resolver)
+
+        # when
+        results = connection.stop_instances(app="paye", timeout=3)
+
+        # then
+        self.assertEqual(set([("eba8bea2600029", "stopped"), ("80be2a9e62ba00", "stopped")]),
+                         set((r["id"], r["status"]) for r in results))
+        mock_client_node1.stop.assert_called_once_with("eba8bea2600029", timeout=3)
+        mock_client_node2.stop.assert_called_once_with("80be2a9e62ba00", timeout=3)
+        mock_client_node1.remove_container.assert_called_once_with("eba8bea2600029", force=True)
+        self.assertIsNone(connection.index.lookup("eba8bea2600029"))
+
+    @patch('docker.Client')
+    def test_stop_instances_by_node_and_ids(self, docker_client):
+        # given
+        (mock_client_node1, mock_client_node2, mock_client_node3) = ClientMock().mock_two_docker_nodes(docker_client)
+        self.config.batch_node_parallelism = 2
+        mock_client_node1.stop.side_effect = [None, ConnectionError()]
+        connection = Connection(self.config, self.docker_node_resolver)
+
+        # when
+        results = connection.stop_instances(node="node-1", instance_ids=["656ca7c307d1", "nonexisting-instance"],
+                                            protected_prefix="eba8bea26000")
+        failed_results = connection.stop_instances(node="node-1", instance_ids=["eba8bea26000"])
+
+        # then
+        self.assertEqual([{"id": "nonexisting-instance", "status": "not_found"},
+                          {"id": "656ca7c307d178", "node": "node-1", "status": "stopped"}], results)
+        self.assertFalse(mock_client_node2.stop.called)
+        self.assertEqual([("eba8bea2600029", "failed", "ConnectionError")],
+                         [(r["id"], r["status"], r["error"]) for r in failed_results])
+
+    @patch('docker.Client')
+    def test_stop_instances_runs_on_the_batch_executor(self, docker_client):
+        # given
+        (mock_client_node1, mock_client_node2, mock_client_node3) = ClientMock().mock_two_docker_nodes(docker_client)
         connection = Connection(self.config, self.docker_node_resolver)
-        # trigger gc
         connection.get_instances()
+        connection.executor = MagicMock()
+
+        # when
+        results = connection.stop_instances(instance_ids=["656ca7c307d178", "80be2a9e62ba00"])
 
         # then
-        # 61c2695fd82a is a freshly created but not yet started container and so shouldn't be gc'd
-        self.assertNotIn(call("61c2695fd82a"), docker_conn2.start.mock_calls)
+        self.assertEqual(["stopped", "stopped"], [r["status"] for r in results])
+        self.assertFalse(connection.executor.fan_out_by_key.called)
+        self.assertEqual(2, connection.get_executor_stats()["batch"]["completed"])
+
+    @patch('docker.Client')
+    def test_stop_instances_never_guesses_between_ids(self, docker_client):
+        # given
+        (mock_client_node1, mock_client_node2, mock_client_node3) = ClientMock().mock_two_docker_nodes(docker_client)
+        connection = Connection(self.config, self.docker_node_resolver)
+        connection.get_instances = MagicMock(return_value=[{"id": "656ca7c307d178", "node": "node-1", "app": "paye"},
+                                                           {"id": "656cf00d2a4e11", "node": "node-2", "app": "paye"}])
+
+        # when
+        results = connection.stop_instances(instance_ids=["", "6", "656c", "656ca"])
+
+        # then
+        self.assertEqual([{"id": "", "status": "not_found"},
+                          {"id": "6", "status": "not_found"},
+                          {"id": "656c", "status": "ambiguous"},
+                          {"id": "656ca7c307d178", "node": "node-1", "status": "stopped"}], results)
+        mock_client_node1.stop.assert_called_once_with("656ca7c307d178")
+        self.assertFalse(mock_client_node2.stop.called)
+
+    @patch('docker.Client')
+    def test_get_nodes_pings_and_lists_each_node_once(self, docker_client):
+        # given
+        (mock_client_node1, mock_client_node2, mock_client_node3) = ClientMock().mock_two_docker_nodes(docker_client)
+        connection = Connection(self.config, self.docker_node_resolver)
+
+        # when
+        nodes = connection.get_nodes()
+
+        # then
+        self.assertEqual(["node-1", "node-2", "node-3"], sorted(node["id"] for node in nodes))
+        for mock_client in (mock_client_node1, mock_client_node2):
+            self.assertEqual(1, mock_client.ping.call_count)
+            self.assertEqual(1, mock_client.containers.call_count)
+
+    @patch('docker.Client')
+    def test_get_node_reports_slow_nodes(self, docker_client):
+        (mock_client_node1, mock_client_node2, mock_client_node3) = ClientMock().mock_two_docker_nodes(docker_client)
+        self.config.node_slow_response_secs = -1
+        connection = Connection(self.config, self.docker_node_resolver)
 
-        # 61c2695fd82b is an old container with epoch start and exit times and should be gc'd
-        docker_conn2.remove_container.assert_has_calls([call("61c2695fd82b")])
+        self.assertEqual("slow", connection.get_node("node-1")["state"])
+
+    @patch('docker.Client')
+    def test_get_node_does_not_count_inspections_towards_slowness(self, docker_client):
+        # given
+        (mock_client_node1, mock_client_node2, mock_client_node3) = ClientMock().mock_two_docker_nodes(docker_client)
+        inspect_container = mock_client_node1.inspect_container.side_effect
+        mock_client_node1.inspect_container.side_effect = lambda container_id: time.sleep(0.15) or inspect_container(container_id)
+        self.config.node_slow_response_secs = 0.2
+        connection = Connection(self.config, self.docker_node_resolver)
+
+        # when
+        node = connection.get_node("node-1")
+
+        # then
+        self.assertEqual(2, mock_client_node1.inspect_container.call_count)
+        self.assertEqual("healthy", node["state"])
+
+    @patch('docker.Client')
+    def test_listing_reuses_cached_inspections_until_containers_go_away(self, docker_client):
+        # given
+        (mock_client_node1, mock_client_node2, mock_client_node3) = ClientMock().mock_two_docker_nodes(docker_client)
+        connection = Connection(self.config, self.docker_node_resolver)
+        connection.get_node_instances("node-1")
+        mock_client_node1.inspect_container.reset_mock()
+
+        # when
+        instances = connection.get_node_instances("node-1")
+
+        # then
+        self.assertEqual(2, len(instances))
+        self.assertFalse(mock_client_node1.inspect_container.called)
+        self.assertEqual(2, connection.get_cache_stats()["node-1"]["hits"])
+
+        # and when
+        connection.record_removed_instance("eba8bea2600029")
+
+        # then
+        self.assertIsNone(connection.inspect_cache.get("node-1", "eba8bea2600029"))
+
+    @patch('docker.Client')
+    def test_refresh_nodes_adds_and_removes_nodes_in_place(self, docker_client):
+        # given
+        (mock_client_node1, mock_client_node2, mock_client_node3) = ClientMock().mock_two_docker_nodes(docker_client)
+        connection = Connection(self.config, self.docker_node_resolver)
+        connection.get_instances()
+        self.docker_node_resolver.get_docker_nodes.return_value = ["http://node-1/", "http://node-3/"]
+
+        # when
+        added_nodes, removed_nodes = connection.refresh_nodes()
+
+        # then
+        self.assertEqual([], added_nodes)
+        self.assertEqual(["node-2"], removed_nodes)
+        self.assertEqual(["node-1", "node-3"], sorted(connection.node_connections.keys()))
+        self.assertIs(mock_client_node1, connection.node_connections["node-1"].connect())
+        mock_client_node2.close.assert_called_once_with()
+        self.assertIsNone(connection.index.lookup("80be2a9e62ba00"))
+        self.assertNotIn("node-2", connection.get_cache_stats())
+        self.assertFalse(connection.ledger.is_known("node-2"))
+
+        # and when
+        self.docker_node_resolver.get_docker_nodes.return_value = ["http://node-1/", "http://node-2/", "http://node-3/"]
+
+        # then
+        self.assertEqual((["node-2"], []), connection.refresh_nodes())
+        self.assertEqual(["node-1", "node-2", "node-3"], sorted(connection.node_connections.keys()))
+
+    @patch('docker.Client')
+    def test_a_listing_finishing_after_its_node_left_does_not_bring_it_back(self, docker_client):
+        # given
+        (mock_client_node1, mock_client_node2, mock_client_node3) = ClientMock().mock_two_docker_nodes(docker_client)
+        connection = Connection(self.config, self.docker_node_resolver)
+        containers = mock_client_node2.containers.return_value
+
+        def remove_node_2_while_listing(**kwargs):
+            self.docker_node_resolver.get_docker_nodes.return_value = ["http://node-1/", "http://node-3/"]
+            connection.refresh_nodes()
+            return containers
+        mock_client_node2.containers = MagicMock(side_effect=remove_node_2_while_listing)
+
+        # when
+        instances = connection.get_instances()
+
+        # then
+        self.assertEqual(["node-1"], sorted(set(i["node"] for i in instances)))
+        self.assertIsNone(connection.index.lookup("80be2a9e62ba00"))
+        self.assertFalse(connection.ledger.is_known("node-2"))
+        self.assertNotIn("node-2", connection.get_cache_stats())
+        self.assertNotIn("node-2", [i["node"] for i in connection.changelog.snapshot()[1]])
+        self.assertFalse(connection.stop_instance("80be2a9e62ba00"))
+
+    @patch('docker.Client')
+    def test_refresh_nodes_ignores_an_empty_answer(self, docker_client):
+        ClientMock().mock_two_docker_nodes(docker_client)
+        connection = Connection(self.config, self.docker_node_resolver)
+        self.docker_node_resolver.get_docker_nodes.return_value = []
+
+        self.assertEqual(([], []), connection.refresh_nodes())
+        self.assertEqual(3, len(connection.node_connections))
+
+    @patch('docker.Client')
+    def test_clients_connect_on_first_use_or_warm_up(self, docker_client):
+        # given
+        (mock_client_node1, mock_client_node2, mock_client_node3) = ClientMock().mock_two_docker_nodes(docker_client)
+        mock_client_node3.ping.side_effect = ConnectionError()
+
+        # when
+        connection = Connection(self.config, self.docker_node_resolver)
+
+        # then
+        self.assertFalse(docker_client.called)
+        connection.get_node_instances("node-1")
+        self.assertEqual(1, docker_client.call_count)
+
+        # and when
+        failed_nodes = connection.warm_up()
+
+        # then
+        self.assertEqual(["node-3"], failed_nodes)
+        # The clients were created concurrently, and a mock's call_count isn't thread safe while its call list is
+        self.assertEqual(3, len(docker_client.call_args_list))
+        self.assertTrue(all(c.is_connected() for c in connection.node_connections.values()))
+
+    @patch('docker.Client')
+    def test_get_logs_pushes_tail_since_and_timestamps_down_to_docker(self, docker_client):
+        # given
+        (mock_client_node1, mock_client_node2, mock_client_node3) = ClientMock().mock_two_docker_nodes(docker_client)
+        connection = Connection(self.config, self.docker_node_resolver)
+
+        # when
+        instance_logs = connection.get_logs("80be2a9e62ba00", tail=10, since=1408696448, timestamps=True)
+
+        # then
+        self.assertEqual([{"msg": "this is line 1\n"}, {"msg": "this is line 2\n"}], list(instance_logs))
+        mock_client_node2._get.assert_called_once_with(
+            "http://node-2/v1.19/containers/80be2a9e62ba00/logs",
+            params={"stdout": 1, "stderr": 1, "follow": 0, "timestamps": 1, "tail": 10, "since": 1408696448},
+            stream=True)
+
+    @patch('docker.Client')
+    def test_get_app_logs_merges_logs_of_every_instance(self, docker_client):
+        # given
+        (mock_client_node1, mock_client_node2, mock_client_node3) = ClientMock().mock_two_docker_nodes(docker_client)
+        connection = Connection(self.config, self.docker_node_resolver)
+
+        # when
+        app_logs = list(connection.get_app_logs("paye", tail=2))
+
+        # then
+        self.assertEqual(4, len(app_logs))
+        self.assertIn({"instance": "80be2a9e62ba00", "node": "node-2", "msg": "this is line 2\n"}, app_logs)
+        self.assertIn({"instance": "eba8bea2600029", "node": "node-1", "msg": "this is line 1\n"}, app_logs)
+        self.assertRaises(exceptions.NoSuchAppException, connection.get_app_logs, "no-such-app")
+
+    @patch('docker.Client')
+    def test_get_log_batches(self, docker_client):
+        (mock_client_node1, mock_client_node2, mock_client_node3) = ClientMock().mock_two_docker_nodes(docker_client)
+        connection = Connection(self.config, self.docker_node_resolver)
+
+        self.assertEqual([["this is line 1\n", "this is line 2\n"]], list(connection.get_log_batches("80be2a9e62ba00")))
+        followed = [m for batch in connection.get_log_batches("80be2a9e62ba00", follow=True) for m in batch]
+        self.assertEqual(["this is line {}".format(l) for l in xrange(1, 100)], followed)
+
+    @patch('docker.Client')
+    def test_watch_instances_sends_a_snapshot_then_changes(self, docker_client):
+        # given
+        ClientMock().mock_two_docker_nodes(docker_client)
+        connection = Connection(self.config, self.docker_node_resolver)
+        events = connection.watch_instances(heartbeat_secs=0)
+
+        # when
+        snapshot = events.next()
+        connection.changelog.record({"node-2": []})
+        removed = events.next()
+        heartbeat = events.next()
+
+        # then
+        self.assertEqual("snapshot", snapshot["type"])
+        self.assertEqual(3, len(snapshot["instances"]))
+        self.assertEqual(("removed", "80be2a9e62ba00"), (removed["type"], removed["instance"]["id"]))
+        self.assertEqual({"type": "heartbeat", "token": removed["token"]}, heartbeat)
+        self.assertEqual(1, connection.get_changelog_stats()["watchers"])
+
+        # when a watcher resumes from the snapshot's token
+        resumed = connection.watch_instances(snapshot["token"], heartbeat_secs=0)
+
+        # then
+        self.assertEqual(removed, resumed.next())
+        events.close()
+        resumed.close()
+        self.assertEqual(0, connection.get_changelog_stats()["watchers"])
+
+    @patch('docker.Client')
+    def test_get_instance_changes_since_a_token(self, docker_client):
+        # given
+        (mock_client_node1, mock_client_node2, mock_client_node3) = ClientMock().mock_two_docker_nodes(docker_client)
+        connection = Connection(self.config, self.docker_node_resolver)
+        resync = connection.get_instance_changes()
+        mock_client_node2.containers.return_value = []
+
+        # when
+        changes = connection.get_instance_changes(resync["token"])
+
+        # then
+        self.assertTrue(resync["resync"])
+        self.assertEqual(3, len(resync["instances"]))
+        self.assertFalse(changes["resync"])
+        self.assertEqual([("removed", "80be2a9e62ba00")], [(c["type"], c["instance"]["id"]) for c in changes["changes"]])
+        self.assertEqual({"token": changes["token"], "resync": False, "changes": []}, connection.get_instance_changes(changes["token"]))
+        self.assertTrue(connection.get_instance_changes("0a1b2c-7")["resync"])
+
+    @patch('docker.Client')
+    def test_get_instance_changes_keeps_the_instances_of_a_node_which_could_not_be_listed(self, docker_client):
+        # given
+        (mock_client_node1, mock_client_node2, mock_client_node3) = ClientMock().mock_two_docker_nodes(docker_client)
+        connection = Connection(self.config, self.docker_node_resolver)
+        token = connection.get_instance_changes()["token"]
+        mock_client_node1.containers.side_effect = ConnectionError()
+
+        # when
+        changes = connection.get_instance_changes(token)
+
+        # then
+        self.assertEqual({"token": token, "resync": False, "changes": []}, changes)
+
+    @patch('docker.Client')
+    def test_find_instances_filters_projects_and_pages(self, docker_client):
+        # given
+        (mock_client_node1, mock_client_node2, mock_client_node3) = ClientMock().mock_two_docker_nodes(docker_client)
+        connection = Connection(self.config, self.docker_node_resolver)
+
+        # when
+        first_page, cursor = connection.find_instances(nodes=["node-1", "node-2"], fields=["id", "node"], limit=2)
+        second_page, last_cursor = connection.find_instances(nodes=["node-1", "node-2"], fields=["id", "node"], limit=2, after=cursor)
+
+        # then
+        pages = first_page + second_page
+        self.assertEqual(3, len(pages))
+        self.assertEqual(sorted(i["id"] for i in pages), [i["id"] for i in pages])
+        self.assertEqual(set(["id", "node"]), set(pages[0].keys()))
+        self.assertEqual(first_page[-1]["id"], cursor)
+        self.assertIsNone(last_cursor)
+
+    @patch('docker.Client')
+    def test_find_instances_only_lists_the_nodes_asked_for(self, docker_client):
+        # given
+        (mock_client_node1, mock_client_node2, mock_client_node3) = ClientMock().mock_two_docker_nodes(docker_client)
+        connection = Connection(self.config, self.docker_node_resolver)
+
+        # when
+        instances, cursor = connection.find_instances(app="paye", nodes=["node-2"])
+
+        # then
+        self.assertEqual(["80be2a9e62ba00"], [i["id"] for i in instances])
+        self.assertFalse(mock_client_node1.containers.called)
+        self.assertFalse(mock_client_node3.containers.called)
+
+    @patch('docker.Client')
+    def test_get_logs_of_a_container_removed_outside_captain(self, docker_client):
+        # given
+        (mock_client_node1, mock_client_node2, mock_client_node3) = ClientMock().mock_two_docker_nodes(docker_client)
+        connection = Connection(self.config, self.docker_node_resolver)
+        self.assertIsNotNone(connection.find_instance("80be2a9e62ba00"))
+        mock_client_node2._raise_for_status.side_effect = docker.errors.APIError(
+            "404 Client Error: Not Found", MagicMock(status_code=404, reason="Not Found"), explanation="No such container: 80be2a9e62ba00")
+
+        # when
+        self.assertRaises(exceptions.NoSuchInstanceException, connection.get_logs, "80be2a9e62ba00")
+
+        # then
+        self.assertIsNone(connection.index.lookup("80be2a9e62ba00"))
+
+    @patch('docker.Client')
+    def test_start_recounts_a_node_whose_slot_count_is_old(self, docker_client):
+        # given
+        (mock_client_node1, mock_client_node2, mock_client_node3) = ClientMock().mock_two_docker_nodes(docker_client)
+        connection = Connection(self.config, self.docker_node_resolver)
+        connection.start_instance("paye", "https://host/paye_216.tgz", "node-1", None, {}, 2)
+        listings = mock_client_node1.containers.call_count
+
+        # when
+        connection.start_instance("paye", "https://host/paye_216.tgz", "node-1", None, {}, 2)
+
+        # then a fresh count is trusted
+        self.assertEqual(listings, mock_client_node1.containers.call_count)
+
+        # when
+        connection.ledger.reconciled_at["node-1"] -= 60
+        connection.start_instance("paye", "https://host/paye_216.tgz", "node-1", None, {}, 2)
+
+        # then
+        self.assertEqual(listings + 1, mock_client_node1.containers.call_count)
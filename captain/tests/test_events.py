@@ -0,0 +1,80 @@
+import Queue
+import time
+import unittest
+from mock import patch, MagicMock
+from captain.connection import Connection
+from captain.events import NodeEventWatcher
+from captain.inventory import Inventory
+from captain.tests.util_mock import ClientMock, mock_config
+
+
+class TestNodeEventWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.config = mock_config()
+
+        self.docker_node_resolver = MagicMock()
+        self.docker_node_resolver.get_docker_nodes = MagicMock(return_value=["http://node-1/", "http://node-2/", "http://node-3/"])
+
+    @patch('docker.Client')
+    def test_watch_resyncs_node_then_applies_events(self, docker_client):
+        # given
+        (docker_conn1, docker_conn2, docker_conn3) = ClientMock().mock_two_docker_nodes(docker_client)
+        docker_conn2._stream_helper = MagicMock(return_value=iter([
+            '{"status": "die", "id": "80be2a9e62ba00", "time": 1408696448}',
+            '{"status": "create", "id": "80be2a9e62ba00", "time": 1408696449}',
+            '{"status": "start", "id": "80be2a9e62ba00", "time": 1408696450}',
+            '{"status": "pull", "id": "hmrc/slugrunner:latest", "time": 1408696451}']))
+        connection = Connection(self.config, self.docker_node_resolver)
+        inventory = connection.inventory = Inventory(connection, 60)
+        watcher = NodeEventWatcher(connection, inventory, "node-2")
+
+        # when
+        watcher.watch()
+
+        # then
+        self.assertEqual(1, docker_conn2.containers.call_count)
+        self.assertEqual(["80be2a9e62ba00"], [i["id"] for i in inventory.get_instances(node_filter="node-2")])
+        self.assertEqual(3, inventory.generation)
+        self.assertEqual(3, watcher.get_stats()["events_applied"])
+        self.assertEqual(1, watcher.get_stats()["resyncs"])
+
+    @patch('docker.Client')
+    def test_destroyed_container_is_removed_without_relisting_node(self, docker_client):
+        # given
+        (docker_conn1, docker_conn2, docker_conn3) = ClientMock().mock_two_docker_nodes(docker_client)
+        connection = Connection(self.config, self.docker_node_resolver)
+        inventory = connection.inventory = Inventory(connection, 60)
+        inventory.refresh()
+        watcher = NodeEventWatcher(connection, inventory, "node-1")
+        docker_conn1.containers.reset_mock()
+
+        # when
+        watcher.apply({"status": "destroy", "id": "656ca7c307d178", "time": 1408696448})
+
+        # then
+        self.assertFalse(docker_conn1.containers.called)
+        self.assertEqual(["eba8bea2600029"], [i["id"] for i in inventory.get_instances(node_filter="node-1")])
+
+    @patch('docker.Client')
+    def test_stop_closes_a_stream_waiting_for_events(self, docker_client):
+        # given
+        (docker_conn1, docker_conn2, docker_conn3) = ClientMock().mock_two_docker_nodes(docker_client)
+        events = Queue.Queue()
+        docker_conn2._stream_helper = MagicMock(return_value=iter(events.get, None))
+        docker_conn2._get_raw_response_socket.return_value.shutdown.side_effect = lambda how: events.put(None)
+        connection = Connection(self.config, self.docker_node_resolver)
+        inventory = connection.inventory = Inventory(connection, 60)
+        watcher = NodeEventWatcher(connection, inventory, "node-2")
+        watcher.start()
+        deadline = time.time() + 5
+        while watcher.get_stats()["resyncs"] == 0 and time.time() < deadline:
+            time.sleep(0.01)
+
+        # when
+        watcher.stop()
+        watcher.thread.join(5)
+
+        # then
+        self.assertFalse(watcher.thread.is_alive())
+        self.assertTrue(docker_conn2.get.return_value.close.called)
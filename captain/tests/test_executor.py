@@ -0,0 +1,66 @@
+import threading
+import unittest
+from captain.executor import FanOutExecutor
+
+
+class TestFanOutExecutor(unittest.TestCase):
+
+    def test_is_sized_by_node_count_within_bounds(self):
+        self.assertEqual(8, FanOutExecutor(2, workers_per_node=2).max_workers)
+        self.assertEqual(40, FanOutExecutor(20, workers_per_node=2).max_workers)
+        self.assertEqual(64, FanOutExecutor(100, workers_per_node=2, max_workers=64).max_workers)
+
+    def test_fan_out_yields_every_item_with_its_future(self):
+        executor = FanOutExecutor(3)
+
+        results = dict((item, future.result()) for item, future in executor.fan_out(lambda x: x * 2, [1, 2, 3]))
+
+        self.assertEqual({1: 2, 2: 4, 3: 6}, results)
+        stats = executor.get_stats()
+        self.assertEqual(3, stats["submitted"])
+        self.assertEqual(3, stats["completed"])
+        self.assertEqual(0, stats["queued"])
+        self.assertEqual(0, stats["in_flight"])
+
+    def test_fan_out_records_failures(self):
+        executor = FanOutExecutor(1)
+
+        def fail(item):
+            raise ValueError(item)
+
+        [(item, future)] = list(executor.fan_out(fail, ["node-1"]))
+
+        self.assertIsInstance(future.exception(), ValueError)
+        self.assertEqual(1, executor.get_stats()["failed"])
+
+    def test_nested_fan_out_runs_inline_rather_than_deadlocking(self):
+        executor = FanOutExecutor(1, min_workers=1)
+
+        def outer(item):
+            return sum(future.result() for _, future in executor.fan_out(lambda x: x + 1, [item, item]))
+
+        results = [future.result() for _, future in executor.fan_out(outer, [1, 2])]
+
+        self.assertEqual([4, 6], sorted(results))
+
+    def test_fan_out_by_key_limits_calls_in_flight_per_key(self):
+        executor = FanOutExecutor(10)
+        lock = threading.Lock()
+        in_flight = {}
+        peaks = {}
+        release = threading.Event()
+
+        def call(item):
+            with lock:
+                in_flight[item[0]] = in_flight.get(item[0], 0) + 1
+                peaks[item[0]] = max(peaks.get(item[0], 0), in_flight[item[0]])
+            release.wait(0.01)
+            with lock:
+                in_flight[item[0]] -= 1
+            return item
+
+        items = [("node-1", i) for i in range(6)] + [("node-2", i) for i in range(3)]
+        done = [item for item, future in executor.fan_out_by_key(call, items, lambda item: item[0], 2)]
+
+        self.assertEqual(sorted(items), sorted(done))
+        self.assertLessEqual(max(peaks.values()), 2)
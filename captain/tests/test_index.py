@@ -0,0 +1,46 @@
+import unittest
+from captain.index import InstanceIndex
+
+
+class TestInstanceIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.instance1 = {"id": "656ca7c307d178a2b3", "node": "node-1", "app": "paye"}
+        self.instance2 = {"id": "80be2a9e62ba00c4d5", "node": "node-2", "app": "paye"}
+        self.under_test = InstanceIndex()
+        self.under_test.update_node("node-1", [self.instance1])
+        self.under_test.update_node("node-2", [self.instance2])
+
+    def test_looks_up_instances_by_id_and_short_id(self):
+        self.assertEqual(self.instance1, self.under_test.lookup("656ca7c307d178a2b3"))
+        self.assertEqual(self.instance1, self.under_test.lookup("656ca7c307d1"))
+        self.assertEqual(self.instance1, self.under_test.lookup("656ca7c307d178"))
+        self.assertIsNone(self.under_test.lookup("656ca7c307d1ff"))
+        self.assertIsNone(self.under_test.lookup("656ca7"))
+
+    def test_update_node_replaces_only_that_nodes_instances(self):
+        instance3 = {"id": "eba8bea2600029e6f7", "node": "node-1", "app": "ers"}
+
+        self.under_test.update_node("node-1", [instance3])
+
+        self.assertIsNone(self.under_test.lookup("656ca7c307d178a2b3"))
+        self.assertEqual(instance3, self.under_test.lookup("eba8bea26000"))
+        self.assertEqual(self.instance2, self.under_test.lookup("80be2a9e62ba00c4d5"))
+        self.assertEqual(2, len(self.under_test))
+
+    def test_remove_by_short_id(self):
+        self.assertEqual(self.instance2, self.under_test.remove("80be2a9e62ba"))
+
+        self.assertIsNone(self.under_test.lookup("80be2a9e62ba00c4d5"))
+        self.assertIsNone(self.under_test.remove("80be2a9e62ba"))
+        self.under_test.remove_node("node-1")
+        self.assertEqual(0, len(self.under_test))
+
+    def test_counts_app_instances_per_node(self):
+        self.under_test.add({"id": "eba8bea2600029e6f7", "node": "node-1", "app": "paye"})
+
+        self.assertEqual({"node-1": 2, "node-2": 1}, self.under_test.get_app_node_counts("paye"))
+        self.under_test.remove("80be2a9e62ba00c4d5")
+        self.under_test.update_node("node-1", [])
+        self.assertEqual({}, self.under_test.get_app_node_counts("paye"))
+        self.assertEqual({}, self.under_test.get_app_node_counts("ers"))
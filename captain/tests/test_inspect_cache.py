@@ -0,0 +1,60 @@
+import time
+import unittest
+from captain.inspect_cache import InspectCache
+
+
+def container(container_id, port=9000):
+    return {"Id": container_id,
+            "Name": "/paye_" + container_id,
+            "Config": {"Env": ["SLUG_URL=http://host/paye.tgz"], "CpuShares": 2, "Hostname": container_id[:12],
+                       "Image": "slugrunner", "Cmd": ["start", "web"]},
+            "State": {"Running": True},
+            "NetworkSettings": {"IPAddress": "172.17.0.2",
+                                "Ports": {"8080/tcp": [{"HostIp": "0.0.0.0", "HostPort": str(port)}]}}}
+
+
+class TestInspectCache(unittest.TestCase):
+
+    def test_stores_only_the_fields_needed_for_an_instance(self):
+        cache = InspectCache()
+
+        cache.put("node-1", container("abc"))
+
+        cached = cache.get("node-1", "abc")
+        self.assertNotIn("State", cached)
+        self.assertNotIn("Image", cached["Config"])
+        self.assertEqual({"Ports": {"8080/tcp": [{"HostIp": "0.0.0.0", "HostPort": "9000"}]}}, cached["NetworkSettings"])
+
+    def test_limits_entries_per_node(self):
+        cache = InspectCache(max_entries_per_node=2)
+
+        for container_id in ["a", "b", "c"]:
+            cache.put("node-1", container(container_id))
+        cache.put("node-2", container("d"))
+
+        self.assertIsNone(cache.get("node-1", "a"))
+        self.assertIsNotNone(cache.get("node-1", "c"))
+        self.assertIsNotNone(cache.get("node-2", "d"))
+        stats = cache.get_stats()
+        self.assertEqual({"hits": 1, "misses": 1, "evictions": 1, "invalidations": 0, "size": 2}, stats["node-1"])
+        self.assertEqual(0, stats["node-2"]["evictions"])
+
+    def test_invalidates_destroyed_containers_and_those_missing_from_a_listing(self):
+        cache = InspectCache()
+        for container_id in ["a", "b", "c"]:
+            cache.put("node-1", container(container_id))
+
+        cache.invalidate("a")
+        cache.retain("node-1", ["c"])
+
+        self.assertIsNone(cache.get("node-1", "b"))
+        self.assertIsNotNone(cache.get("node-1", "c"))
+        self.assertEqual(2, cache.get_stats()["node-1"]["invalidations"])
+
+    def test_entries_expire_after_ttl(self):
+        cache = InspectCache(ttl_secs=0.05)
+        cache.put("node-1", container("a"))
+
+        time.sleep(0.1)
+
+        self.assertIsNone(cache.get("node-1", "a"))
@@ -0,0 +1,178 @@
+import unittest
+from mock import patch, MagicMock
+from captain.connection import Connection
+from captain.inventory import Inventory
+from captain.tests.util_mock import ClientMock, mock_config
+
+
+class TestInventory(unittest.TestCase):
+
+    def setUp(self):
+        self.config = mock_config()
+
+        self.docker_node_resolver = MagicMock()
+        self.docker_node_resolver.get_docker_nodes = MagicMock(return_value=["http://node-1/", "http://node-2/", "http://node-3/"])
+
+    @patch('docker.Client')
+    def test_refresh_populates_snapshot_and_bumps_generation_only_on_change(self, docker_client):
+        # given
+        ClientMock().mock_two_docker_nodes(docker_client)
+        connection = Connection(self.config, self.docker_node_resolver)
+        inventory = Inventory(connection, 60)
+        self.assertFalse(inventory.is_populated())
+        self.assertIsNone(inventory.get_age_secs())
+
+        # when
+        inventory.refresh()
+        generation = inventory.generation
+        inventory.refresh()
+
+        # then
+        self.assertTrue(inventory.is_populated())
+        self.assertEqual(1, generation)
+        self.assertEqual(generation, inventory.generation)
+        self.assertEqual(3, len(inventory.get_instances()))
+        self.assertEqual(["80be2a9e62ba00"], [i["id"] for i in inventory.get_instances(node_filter="node-2")])
+        self.assertEqual(3, len(inventory.get_instances(node_filter=["node-1", "node-2"])))
+        self.assertTrue(inventory.get_age_secs() >= 0)
+
+    @patch('docker.Client')
+    def test_connection_serves_reads_from_populated_inventory(self, docker_client):
+        # given
+        (docker_conn1, docker_conn2, docker_conn3) = ClientMock().mock_two_docker_nodes(docker_client)
+        connection = Connection(self.config, self.docker_node_resolver)
+        connection.inventory = Inventory(connection, 60)
+        connection.inventory.refresh()
+        docker_conn1.containers.reset_mock()
+
+        # when
+        instances = connection.get_instances()
+        node_instances = connection.get_instances(node_filter="node-1")
+
+        # then
+        self.assertEqual(3, len(instances))
+        self.assertEqual(2, len(node_instances))
+        self.assertFalse(docker_conn1.containers.called)
+        self.assertIsNotNone(connection.get_inventory_age())
+        self.assertEqual(connection.inventory.get_version(), connection.get_inventory_version())
+        self.assertNotEqual(Inventory(connection, 60).get_version(), Inventory(connection, 60).get_version())
+
+    @patch('docker.Client')
+    def test_started_and_stopped_instances_are_applied_to_the_snapshot(self, docker_client):
+        # given
+        (docker_conn1, docker_conn2, docker_conn3) = ClientMock().mock_two_docker_nodes(docker_client)
+        docker_conn2.create_container = MagicMock(return_value={'Id': '80be2a9e62ba00'})
+        connection = Connection(self.config, self.docker_node_resolver)
+        connection.inventory = Inventory(connection, 60)
+        connection.inventory.refresh()
+        generation = connection.inventory.generation
+
+        # when
+        connection.stop_instance("80be2a9e62ba00")
+
+        # then
+        self.assertEqual(generation + 1, connection.inventory.generation)
+        self.assertEqual([], connection.get_instances(node_filter="node-2"))
+
+        # when
+        connection.start_instance("paye", "https://host/paye_216.tgz", "node-2", None, {}, 2)
+
+        # then
+        self.assertEqual(generation + 2, connection.inventory.generation)
+        self.assertEqual(["80be2a9e62ba00"], [i["id"] for i in connection.get_instances(node_filter="node-2")])
+
+    @patch('docker.Client')
+    def test_stops_and_starts_made_during_a_refresh_are_not_undone(self, docker_client):
+        # given
+        ClientMock().mock_two_docker_nodes(docker_client)
+        connection = Connection(self.config, self.docker_node_resolver)
+        inventory = Inventory(connection, 60)
+        inventory.refresh()
+        listing = connection.fetch_instances_by_node()
+        started = dict(listing["node-2"][0], id="0f5e3c1b8a7d22")
+
+        def fetch_while_stopping_and_starting():
+            inventory.remove_instance("80be2a9e62ba00")
+            inventory.add_instance(started)
+            return listing
+
+        connection.fetch_instances_by_node = MagicMock(side_effect=fetch_while_stopping_and_starting)
+
+        # when
+        inventory.refresh()
+
+        # then
+        self.assertEqual(["0f5e3c1b8a7d22"], [i["id"] for i in inventory.get_instances(node_filter="node-2")])
+        self.assertIsNone(inventory.journal)
+
+    @patch('docker.Client')
+    def test_nodes_which_could_not_be_listed_keep_their_instances(self, docker_client):
+        # given
+        ClientMock().mock_two_docker_nodes(docker_client)
+        connection = Connection(self.config, self.docker_node_resolver)
+        inventory = Inventory(connection, 60)
+        inventory.refresh()
+        inventory.node_listed_at["node-1"] -= 100
+        listing = connection.fetch_instances_by_node()
+        del listing["node-1"]
+        connection.fetch_instances_by_node = MagicMock(return_value=listing)
+        generation = inventory.generation
+
+        # when
+        inventory.refresh()
+
+        # then
+        self.assertEqual(2, len(inventory.get_instances(node_filter="node-1")))
+        self.assertEqual(generation, inventory.generation)
+        # The snapshot is as old as the instances kept for node-1
+        self.assertTrue(100 <= inventory.get_age_secs() < 105)
+
+        # and when
+        connection.fetch_instances_by_node.return_value = dict(listing, **{"node-1": []})
+        inventory.refresh()
+
+        # then
+        self.assertTrue(0 <= inventory.get_age_secs() < 5)
+
+    @patch('docker.Client')
+    def test_a_resync_finishing_after_its_node_left_does_not_bring_it_back(self, docker_client):
+        # given
+        ClientMock().mock_two_docker_nodes(docker_client)
+        connection = Connection(self.config, self.docker_node_resolver)
+        inventory = Inventory(connection, 60)
+        inventory.refresh()
+        node_instances = connection.get_node_instances("node-2")
+
+        def remove_node_2_while_listing(node):
+            del connection.node_connections["node-2"]
+            inventory.remove_node("node-2")
+            return node_instances
+        connection.get_node_instances = MagicMock(side_effect=remove_node_2_while_listing)
+
+        # when
+        inventory.resync_node("node-2")
+
+        # then
+        self.assertEqual({}, inventory.get_instances_by_node("node-2"))
+
+    @patch('docker.Client')
+    def test_loaded_snapshot_is_stale_until_refreshed(self, docker_client):
+        # given
+        ClientMock().mock_two_docker_nodes(docker_client)
+        connection = Connection(self.config, self.docker_node_resolver)
+        inventory = Inventory(connection, 60)
+
+        # when
+        inventory.load({"node-1": [{"id": "eba8bea2600029", "node": "node-1"}]}, 1000)
+
+        # then
+        self.assertTrue(inventory.is_populated())
+        self.assertTrue(inventory.get_stats()["stale"])
+        self.assertEqual(["eba8bea2600029"], [i["id"] for i in inventory.get_instances()])
+
+        # and when
+        inventory.refresh()
+
+        # then
+        self.assertFalse(inventory.get_stats()["stale"])
+        self.assertEqual(3, len(inventory.get_instances()))
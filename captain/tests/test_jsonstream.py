@@ -0,0 +1,22 @@
+import json
+import unittest
+from captain.jsonstream import iter_json_array
+
+
+class TestJsonStream(unittest.TestCase):
+
+    def test_streams_a_json_array_in_chunks(self):
+        # given
+        items = [{"id": "{:014d}".format(i), "environment": {"PORT": str(i)}} for i in range(100)]
+
+        # when
+        chunks = list(iter_json_array(items, chunk_bytes=512))
+
+        # then
+        self.assertTrue(len(chunks) > 1)
+        self.assertTrue(all(len(chunk) < 1024 for chunk in chunks))
+        self.assertEqual(items, json.loads("".join(chunks)))
+
+    def test_streams_an_empty_array(self):
+        self.assertEqual([], json.loads("".join(iter_json_array([]))))
+        self.assertEqual([], json.loads("".join(iter_json_array(iter([])))))
@@ -0,0 +1,68 @@
+import threading
+import unittest
+from mock import patch
+from captain import exceptions
+from captain.ledger import SlotLedger
+
+
+class TestSlotLedger(unittest.TestCase):
+
+    def setUp(self):
+        self.under_test = SlotLedger(10)
+        self.under_test.reconcile("node-1", [{"id": "656ca7c307d178", "node": "node-1", "slots": 2},
+                                             {"id": "eba8bea2600029", "node": "node-1", "slots": 4}])
+
+    def test_reserve_admits_starts_up_to_capacity(self):
+        reservation = self.under_test.reserve("node-1", 4)
+
+        self.assertEqual(10, self.under_test.get_used("node-1"))
+        self.assertRaises(exceptions.NodeOutOfCapacityException, self.under_test.reserve, "node-1", 1)
+
+        self.under_test.release(reservation)
+        self.assertEqual(6, self.under_test.get_used("node-1"))
+        self.under_test.reserve("node-1", 1)
+
+    def test_concurrent_reservations_never_oversubscribe_a_node(self):
+        admitted = []
+
+        def reserve():
+            try:
+                admitted.append(self.under_test.reserve("node-1", 1))
+            except exceptions.NodeOutOfCapacityException:
+                pass
+
+        threads = [threading.Thread(target=reserve) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(4, len(admitted))
+        self.assertEqual(10, self.under_test.get_used("node-1"))
+
+    def test_reconcile_keeps_recently_started_instances_missing_from_listing(self):
+        self.under_test.add_instance({"id": "80be2a9e62ba00", "node": "node-1", "slots": 2})
+
+        self.under_test.reconcile("node-1", [{"id": "656ca7c307d178", "node": "node-1", "slots": 2}])
+
+        self.assertEqual(4, self.under_test.get_used("node-1"))
+
+        with patch('time.time', return_value=self.under_test.recently_started["80be2a9e62ba00"] + 61):
+            self.under_test.reconcile("node-1", [{"id": "656ca7c307d178", "node": "node-1", "slots": 2}])
+
+        self.assertEqual(2, self.under_test.get_used("node-1"))
+
+    def test_removed_instances_free_their_slots(self):
+        self.under_test.remove_instance({"id": "eba8bea2600029", "node": "node-1", "slots": 4})
+
+        self.assertEqual(2, self.under_test.get_used("node-1"))
+        self.assertTrue(self.under_test.is_known("node-1"))
+        self.under_test.remove_node("node-1")
+        self.assertFalse(self.under_test.is_known("node-1"))
+
+    def test_age_since_last_reconciled(self):
+        self.assertTrue(0 <= self.under_test.get_age_secs("node-1") < 5)
+        self.assertIsNone(self.under_test.get_age_secs("node-2"))
+
+        self.under_test.remove_node("node-1")
+        self.assertIsNone(self.under_test.get_age_secs("node-1"))
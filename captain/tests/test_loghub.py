@@ -0,0 +1,89 @@
+import threading
+import unittest
+import Queue
+from mock import MagicMock
+from captain.loghub import LogBroadcastHub
+
+
+class TestLogBroadcastHub(unittest.TestCase):
+
+    def upstream(self):
+        """
+        Returns a queue feeding an upstream log stream and a mock open function for it, None ends the stream.
+        """
+        messages = Queue.Queue()
+        close_fn = MagicMock(side_effect=lambda: messages.put(None))
+        open_fn = MagicMock(return_value=(iter(messages.get, None), close_fn))
+        return messages, open_fn, close_fn
+
+    def test_followers_share_one_upstream_which_closes_when_the_last_leaves(self):
+        # given
+        hub = LogBroadcastHub()
+        messages, open_fn, close_fn = self.upstream()
+        first = hub.subscribe(("eba8bea2600029", None, None, False), open_fn)
+        first_messages = iter(first)
+        messages.put("line 1")
+        self.assertEqual("line 1", first_messages.next())
+
+        # when
+        second = hub.subscribe(("eba8bea2600029", None, None, False), open_fn)
+        second_messages = iter(second)
+        messages.put("line 2")
+
+        # then
+        self.assertEqual(1, open_fn.call_count)
+        self.assertEqual("line 2", first_messages.next())
+        self.assertEqual(["line 1", "line 2"], [second_messages.next(), second_messages.next()])
+        self.assertEqual([{"instance": "eba8bea2600029", "followers": 2, "messages": 2, "dropped": 0}], hub.get_stats())
+
+        # and when
+        first.close()
+        self.assertFalse(close_fn.called)
+        second.close()
+
+        # then
+        close_fn.assert_called_once_with()
+        self.assertEqual([], hub.get_stats())
+
+    def test_slow_followers_skip_ahead_instead_of_blocking_others(self):
+        # given
+        hub = LogBroadcastHub(buffer_size=2, history_size=0)
+        messages, open_fn, close_fn = self.upstream()
+        slow = hub.subscribe(("eba8bea2600029", None, None, False), open_fn)
+        fast = iter(hub.subscribe(("eba8bea2600029", None, None, False), open_fn))
+
+        # when
+        for i in range(5):
+            messages.put("line {}".format(i))
+            self.assertEqual("line {}".format(i), fast.next())
+
+        # then
+        self.assertEqual(3, hub.get_stats()[0]["dropped"])
+        messages.put(None)
+        self.assertEqual(["line 3", "line 4"], list(slow))
+
+    def test_open_errors_are_raised_to_the_first_follower(self):
+        hub = LogBroadcastHub()
+
+        self.assertRaises(IOError, hub.subscribe, ("eba8bea2600029", None, None, False), MagicMock(side_effect=IOError()))
+        self.assertEqual([], hub.get_stats())
+
+    def test_late_followers_get_no_more_history_than_they_asked_for(self):
+        # given
+        hub = LogBroadcastHub(history_size=3)
+        messages, open_fn, close_fn = self.upstream()
+        first = iter(hub.subscribe(("eba8bea2600029", 2, None, False), open_fn, backlog_size=2))
+        for i in range(5):
+            messages.put("line {}".format(i))
+            self.assertEqual("line {}".format(i), first.next())
+
+        # when
+        tail_two = hub.subscribe(("eba8bea2600029", 2, None, False), open_fn, backlog_size=2)
+        tail_ten = hub.subscribe(("eba8bea2600029", 2, None, False), open_fn, backlog_size=10)
+        tail_none = hub.subscribe(("eba8bea2600029", 2, None, False), open_fn, backlog_size=0)
+        messages.put(None)
+
+        # then
+        self.assertEqual(["line 3", "line 4"], list(tail_two))
+        self.assertEqual(["line 2", "line 3", "line 4"], list(tail_ten))
+        self.assertEqual([], list(tail_none))
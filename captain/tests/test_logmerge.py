@@ -0,0 +1,51 @@
+import threading
+import unittest
+from captain.logmerge import LogMerger
+
+
+class TestLogMerger(unittest.TestCase):
+
+    def test_merges_every_stream_tagging_each_message(self):
+        merger = LogMerger()
+        merger.add_stream({"instance": "a"}, lambda: (iter(["a1", "a2"]), lambda: None))
+        merger.add_stream({"instance": "b"}, lambda: (iter(["b1"]), lambda: None))
+
+        messages = list(merger.messages())
+
+        self.assertEqual([{"instance": "a", "msg": "a1"}, {"instance": "a", "msg": "a2"}, {"instance": "b", "msg": "b1"}],
+                         sorted(messages))
+        self.assertEqual(["a1", "a2"], [m["msg"] for m in messages if m["instance"] == "a"])
+
+    def test_a_failed_stream_reports_its_error_without_stopping_the_others(self):
+        def fail():
+            raise IOError("node down")
+
+        merger = LogMerger()
+        merger.add_stream({"instance": "a"}, fail)
+        merger.add_stream({"instance": "b"}, lambda: (iter(["b1"]), lambda: None))
+
+        messages = list(merger.messages())
+
+        self.assertIn({"instance": "b", "msg": "b1"}, messages)
+        self.assertIn({"instance": "a", "error": "IOError('node down',)"}, messages)
+
+    def test_a_stalled_stream_does_not_hold_up_the_others(self):
+        stalled = threading.Event()
+        closed = threading.Event()
+
+        def stalled_messages():
+            stalled.wait(5)
+            return
+            yield
+
+        merger = LogMerger(buffer_size=2, put_timeout_secs=0.01)
+        merger.add_stream({"instance": "slow"}, lambda: (stalled_messages(), closed.set))
+        merger.add_stream({"instance": "fast"}, lambda: (iter(["fast {}".format(i) for i in range(10)]), lambda: None))
+        messages = merger.messages()
+
+        first_ten = [messages.next() for _ in range(10)]
+        messages.close()
+        stalled.set()
+
+        self.assertEqual(["fast {}".format(i) for i in range(10)], [m["msg"] for m in first_ten])
+        self.assertTrue(closed.is_set())
@@ -0,0 +1,61 @@
+import struct
+import unittest
+from StringIO import StringIO
+from captain.logstream import LogDemultiplexer, batch_messages, iter_lines, read_frames, split_frames
+
+
+def frame(stream, payload):
+    return struct.pack('>BxxxL', stream, len(payload)) + payload
+
+
+class TestLogStream(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = frame(1, "this is line 1\n") + frame(2, "an error\n") + frame(1, "") + frame(1, "this is line 2\n")
+        self.expected = [("stdout", "this is line 1\n"), ("stderr", "an error\n"), ("stdout", ""), ("stdout", "this is line 2\n")]
+
+    def test_read_frames_reads_exactly_each_header_and_payload(self):
+        data = StringIO(self.stream)
+        reads = []
+
+        def read(size):
+            reads.append(size)
+            return data.read(size)
+
+        self.assertEqual(self.expected, list(read_frames(read)))
+        self.assertEqual([8, 15, 8, 9, 8, 8, 15, 8], reads[:8])
+
+    def test_read_frames_handles_short_reads_and_truncated_streams(self):
+        data = StringIO(self.stream[:-3])
+
+        frames = list(read_frames(lambda size: data.read(min(size, 3))))
+
+        self.assertEqual(self.expected[:3], frames)
+
+    def test_demultiplexer_handles_frames_split_across_chunks(self):
+        for chunk_size in [1, 3, 8, 10, 1024]:
+            chunks = [self.stream[i:i + chunk_size] for i in range(0, len(self.stream), chunk_size)]
+
+            self.assertEqual(self.expected, list(LogDemultiplexer().frames(chunks)))
+
+    def test_split_frames(self):
+        self.assertEqual(self.expected, split_frames(self.stream))
+
+    def test_iter_lines_joins_frames_into_lines_per_stream(self):
+        frames = [("stdout", "first "), ("stderr", "an err"), ("stdout", "line\nsecond line\nthi"), ("stderr", "or\n"), ("stdout", "rd")]
+
+        self.assertEqual([("stderr", "an error\n"), ("stdout", "first line\n"), ("stdout", "second line\n"), ("stdout", "third\n")],
+                         sorted(iter_lines(frames)))
+
+    def test_batch_messages_by_size(self):
+        messages = ["{:>9}\n".format(i) for i in range(10)]
+
+        batches = list(batch_messages(messages, max_bytes=30))
+
+        self.assertEqual([3, 3, 3, 1], [len(b) for b in batches])
+        self.assertEqual(messages, [m for b in batches for m in b])
+
+    def test_batch_messages_by_delay(self):
+        batches = list(batch_messages(["a\n", "b\n", "c\n"], max_bytes=1024, max_delay_secs=0))
+
+        self.assertEqual([["a\n"], ["b\n"], ["c\n"]], batches)
@@ -0,0 +1,45 @@
+import unittest
+import requests
+from mock import MagicMock
+from requests.adapters import HTTPAdapter
+from captain.node_client import LazyDockerClient
+
+
+class TestLazyDockerClient(unittest.TestCase):
+
+    def test_connects_on_first_use_only(self):
+        client = MagicMock()
+        connect_fn = MagicMock(return_value=client)
+        lazy_client = LazyDockerClient("node-1", connect_fn)
+        self.assertFalse(lazy_client.is_connected())
+
+        lazy_client.ping()
+        lazy_client.containers()
+
+        connect_fn.assert_called_once_with()
+        client.ping.assert_called_once_with()
+        self.assertTrue(lazy_client.is_connected())
+
+    def test_close_does_not_connect(self):
+        connect_fn = MagicMock()
+        LazyDockerClient("node-1", connect_fn).close()
+
+        self.assertFalse(connect_fn.called)
+
+    def test_pool_stats_count_reused_connections(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        pool = adapter.poolmanager.connection_from_host("node-1", 4243)
+        pool.num_connections = 2
+        pool.num_requests = 10
+        lazy_client = LazyDockerClient("node-1", lambda: session)
+        self.assertEqual({"connected": False, "connections": 0, "requests": 0, "reused": 0}, lazy_client.get_pool_stats())
+
+        lazy_client.connect()
+
+        stats = lazy_client.get_pool_stats()
+        self.assertEqual(2, stats["connections"])
+        self.assertEqual(10, stats["requests"])
+        self.assertEqual(8, stats["reused"])
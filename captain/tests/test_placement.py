@@ -0,0 +1,43 @@
+import gc
+import time
+import unittest
+from captain.placement import get_placement_strategy, BinPackPlacementStrategy, SpreadPlacementStrategy, AppSpreadPlacementStrategy
+
+
+class TestPlacementStrategies(unittest.TestCase):
+
+    def setUp(self):
+        self.candidates = [{"id": "node-1", "used": 4, "app_instances": 2},
+                           {"id": "node-2", "used": 8, "app_instances": 0},
+                           {"id": "node-3", "used": 2, "app_instances": 1}]
+
+    def test_binpack_prefers_fullest_nodes(self):
+        ranked = BinPackPlacementStrategy().rank_nodes(self.candidates, "paye", 2)
+        self.assertEqual(["node-2", "node-1", "node-3"], [c["id"] for c in ranked])
+
+    def test_spread_prefers_emptiest_nodes(self):
+        ranked = SpreadPlacementStrategy().rank_nodes(self.candidates, "paye", 2)
+        self.assertEqual(["node-3", "node-1", "node-2"], [c["id"] for c in ranked])
+
+    def test_app_spread_prefers_nodes_with_fewest_instances_of_the_app(self):
+        ranked = AppSpreadPlacementStrategy().rank_nodes(self.candidates, "paye", 2)
+        self.assertEqual(["node-2", "node-3", "node-1"], [c["id"] for c in ranked])
+
+    def test_get_placement_strategy(self):
+        self.assertIsInstance(get_placement_strategy("app-spread"), AppSpreadPlacementStrategy)
+        self.assertRaises(Exception, get_placement_strategy, "random")
+
+    def test_ranks_a_large_cluster_in_milliseconds(self):
+        candidates = [{"id": "node-{}".format(i), "used": i % 110, "app_instances": i % 3} for i in xrange(500)]
+
+        # A collection of whatever earlier tests left behind can take longer than the ranking being timed
+        gc.disable()
+        try:
+            started_at = time.time()
+            for name in ["binpack", "spread", "app-spread"]:
+                get_placement_strategy(name).rank_nodes(candidates, "paye", 2)
+            elapsed_secs = time.time() - started_at
+        finally:
+            gc.enable()
+
+        self.assertTrue(elapsed_secs < 0.1)
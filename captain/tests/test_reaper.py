@@ -0,0 +1,99 @@
+import unittest
+from mock import patch, MagicMock, call
+from captain.connection import Connection
+from captain.reaper import ContainerReaper, RateLimiter
+from captain.tests.util_mock import ClientMock, mock_config
+
+
+class TestContainerReaper(unittest.TestCase):
+
+    def setUp(self):
+        self.config = mock_config()
+
+        self.docker_node_resolver = MagicMock()
+        self.docker_node_resolver.get_docker_nodes = MagicMock(return_value=["http://node-1/", "http://node-2/", "http://node-3/"])
+
+    @patch('docker.Client')
+    def test_reap_removes_exited_containers_older_than_grace_period(self, docker_client):
+        # given
+        (docker_conn1, docker_conn2, docker_conn3) = ClientMock().mock_two_docker_nodes(docker_client)
+        connection = Connection(self.config, self.docker_node_resolver)
+        reaper = ContainerReaper(connection, 60, self.config.docker_gc_grace_period, max_removals_per_sec=0)
+
+        # when
+        reaper.reap()
+
+        # then
+        # One container stopped
+        docker_conn1.remove_container.assert_has_calls([call("381587e2978216")])
+        # One container with FinishedAt time of 0 removed
+        docker_conn1.remove_container.assert_has_calls([call("3815178hgdasf6")])
+        self.assertEqual(docker_conn1.remove_container.call_count, 2)
+        # 61c2695fd82b is an old container with epoch start and exit times and should be gc'd
+        docker_conn2.remove_container.assert_has_calls([call("61c2695fd82b")])
+        self.assertEqual(docker_conn2.remove_container.call_count, 1)
+        # 61c2695fd82a is a freshly created but not yet started container and so shouldn't be gc'd
+        self.assertNotIn(call("61c2695fd82a"), docker_conn2.remove_container.mock_calls)
+
+        stats = reaper.get_stats()
+        self.assertEqual(2, stats["node-1"]["removed"])
+        self.assertEqual(1, stats["node-2"]["removed"])
+        self.assertEqual(2, stats["node-2"]["skipped"])
+        self.assertEqual(1, stats["node-3"]["errors"])
+
+    @patch('docker.Client')
+    def test_reap_runs_on_its_own_threads(self, docker_client):
+        # given
+        ClientMock().mock_two_docker_nodes(docker_client)
+        connection = Connection(self.config, self.docker_node_resolver)
+        connection.executor = MagicMock()
+        reaper = ContainerReaper(connection, 60, self.config.docker_gc_grace_period, max_removals_per_sec=0, node_parallelism=2)
+
+        # when
+        reaper.reap()
+
+        # then
+        self.assertFalse(connection.executor.fan_out.called)
+        self.assertEqual(2, reaper.executor.get_stats()["workers"])
+        self.assertEqual(3, reaper.executor.get_stats()["completed"])
+
+    @patch('docker.Client')
+    def test_young_containers_are_not_inspected_again_until_eligible(self, docker_client):
+        # given
+        (docker_conn1, docker_conn2, docker_conn3) = ClientMock().mock_two_docker_nodes(docker_client)
+        connection = Connection(self.config, self.docker_node_resolver)
+        reaper = ContainerReaper(connection, 60, self.config.docker_gc_grace_period, max_removals_per_sec=0)
+        reaper.reap_node("node-2")
+        docker_conn2.inspect_container.reset_mock()
+
+        # when
+        reaper.reap_node("node-2")
+
+        # then
+        inspected = [c[1][0] for c in docker_conn2.inspect_container.mock_calls]
+        self.assertNotIn("61c2695fd82a", inspected)
+        self.assertNotIn("389821jsv78216", inspected)
+
+    @patch('docker.Client')
+    def test_reap_node_handles_at_most_batch_size_containers(self, docker_client):
+        # given
+        (docker_conn1, docker_conn2, docker_conn3) = ClientMock().mock_two_docker_nodes(docker_client)
+        connection = Connection(self.config, self.docker_node_resolver)
+        reaper = ContainerReaper(connection, 60, self.config.docker_gc_grace_period, batch_size=1, max_removals_per_sec=0)
+
+        # when
+        removed = reaper.reap_node("node-1")
+
+        # then
+        self.assertEqual(1, removed)
+        self.assertEqual(1, docker_conn1.inspect_container.call_count)
+
+    @patch('time.sleep')
+    def test_rate_limiter_spaces_out_calls(self, sleep):
+        rate_limiter = RateLimiter(2)
+
+        rate_limiter.acquire()
+        rate_limiter.acquire()
+
+        self.assertEqual(1, sleep.call_count)
+        self.assertAlmostEqual(0.5, sleep.call_args[0][0], places=1)
@@ -0,0 +1,58 @@
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch, MagicMock
+from captain.connection import Connection
+from captain.snapshot import read_snapshot, write_snapshot, Snapshotter
+from captain.tests.util_mock import ClientMock, mock_config
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.snapshot_dir = tempfile.mkdtemp()
+        self.snapshot_path = os.path.join(self.snapshot_dir, "captain.snapshot")
+
+        self.config = mock_config()
+
+        self.docker_node_resolver = MagicMock()
+        self.docker_node_resolver.get_docker_nodes = MagicMock(return_value=["http://node-1/", "http://node-2/", "http://node-3/"])
+
+    def tearDown(self):
+        shutil.rmtree(self.snapshot_dir)
+
+    def test_write_then_read_snapshot(self):
+        write_snapshot(self.snapshot_path, {"version": 1, "written_at": 1.5, "nodes": {u"node-1": {"instances": []}}})
+
+        self.assertEqual({"version": 1, "written_at": 1.5, "nodes": {u"node-1": {"instances": []}}}, read_snapshot(self.snapshot_path))
+        self.assertEqual(["captain.snapshot"], os.listdir(self.snapshot_dir))
+
+    def test_read_snapshot_ignores_missing_corrupt_and_old_snapshots(self):
+        self.assertIsNone(read_snapshot(self.snapshot_path))
+
+        with open(self.snapshot_path, "wb") as snapshot_file:
+            snapshot_file.write("not a snapshot")
+        self.assertIsNone(read_snapshot(self.snapshot_path))
+
+        write_snapshot(self.snapshot_path, {"version": 0, "nodes": {}})
+        self.assertIsNone(read_snapshot(self.snapshot_path))
+
+    @patch('docker.Client')
+    def test_restored_snapshot_avoids_inspecting_containers_again(self, docker_client):
+        # given
+        (mock_client_node1, mock_client_node2, mock_client_node3) = ClientMock().mock_two_docker_nodes(docker_client)
+        connection = Connection(self.config, self.docker_node_resolver)
+        instances = connection.get_node_instances("node-1")
+        Snapshotter(connection, self.snapshot_path, 60).save()
+        mock_client_node1.inspect_container.reset_mock()
+
+        # when
+        self.config.snapshot_path = self.snapshot_path
+        restarted_connection = Connection(self.config, self.docker_node_resolver)
+
+        # then
+        self.assertEqual(instances[0], restarted_connection.find_instance(instances[0]["id"]))
+        self.assertEqual(sorted(instances), sorted(restarted_connection.get_node_instances("node-1")))
+        self.assertFalse(mock_client_node1.inspect_container.called)
+        restarted_connection.close()
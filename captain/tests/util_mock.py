@@ -1,38 +1,99 @@
 from mock import MagicMock
 import docker.errors
 from requests.exceptions import ConnectionError
+from StringIO import StringIO
 import datetime
+import struct
+
+
+def mock_config(**settings):
+    """
+    Returns a mock config holding the settings a Connection reads, with every background worker disabled,
+    overridden by settings.
+    """
+    config = MagicMock()
+    config.docker_nodes = ["http://node-1/", "http://node-2/", "http://node-3/"]
+    config.aws_docker_host_tag_name = None
+    config.aws_docker_host_tag_value = None
+    config.slug_runner_command = "runner command"
+    config.slug_runner_image = "runner/image"
+    config.slug_runner_version = "0.0.73"
+    config.slots_per_node = 10
+    config.slot_memory_mb = 128
+    config.default_slots_per_instance = 2
+    config.placement_strategy = "spread"
+    config.batch_node_parallelism = 4
+    config.batch_max_workers = 16
+    config.batch_max_instances = 100
+    config.docker_timeout = 15
+    config.docker_pool_maxsize = 16
+    config.docker_pool_block = False
+    config.docker_gc_interval_secs = 0
+    config.docker_gc_grace_period = 86400
+    config.docker_gc_batch_size = 50
+    config.docker_gc_max_removals_per_sec = 5
+    config.docker_gc_node_concurrency = 2
+    config.docker_gc_node_parallelism = 4
+    config.fanout_workers_per_node = 2
+    config.fanout_max_workers = 64
+    config.inspect_cache_max_entries_per_node = 1024
+    config.inspect_cache_ttl_secs = 0
+    config.inventory_refresh_interval_secs = 0
+    config.inventory_events_enabled = False
+    config.node_refresh_interval_secs = 0
+    config.node_slow_response_secs = 2
+    config.instance_watch_interval_secs = 0
+    config.snapshot_path = None
+    config.snapshot_interval_secs = 60
+    for name, value in settings.items():
+        setattr(config, name, value)
+    return config
 
 
 class ClientMock():
 
     def __init__(self):
-        def __logs(i, stream=False):
-            if stream:
-                return ("this is line {}".format(l) for l in xrange(1, 100))
+        def __logs(url, params, stream=False):
+            # Docker multiplexes each write to stdout or stderr into a frame with an 8 byte header
+            if params["follow"]:
+                lines = ["this is line {}".format(l) for l in xrange(1, 100)]
             else:
-                return "\n".join(["this is line {}".format(l) for l in xrange(1, 3)])
+                lines = ["\n".join(["this is line {}".format(l) for l in xrange(1, 3)])]
+            data = StringIO("".join(struct.pack('>BxxxL', 1, len(line)) + line for line in lines))
+            response = MagicMock()
+            response.raw.read = data.read
+            response.iter_content = lambda chunk_size: iter(lambda: data.read(chunk_size), "")
+            return response
 
         self.client_node1 = MagicMock()
+        self.client_node1.base_url = "http://node-1"
         self.client_node1.containers = MagicMock(return_value=self.__containers_cmd_return_node1)
         self.client_node1.inspect_container = MagicMock(side_effect=lambda container_id:
                                                         self.__get_container(self.__inspect_container_cmd_return_node1,
                                                                              container_id))
         self.client_node1.create_container = MagicMock(return_value={'Id': 'eba8bea2600029'})
         self.client_node1.start = MagicMock()
-        self.client_node1.logs = MagicMock(side_effect=__logs)
+        self.client_node1._get = MagicMock(side_effect=__logs)
+        # Created up front, as a mock's attributes are created on first use and two threads using one at once
+        # can each create their own, losing the other's calls
+        self.client_node1.stop = MagicMock()
+        self.client_node1.remove_container = MagicMock()
 
         self.client_node2 = MagicMock()
+        self.client_node2.base_url = "http://node-2"
         self.client_node2.containers = MagicMock(return_value=self.__containers_cmd_return_node2)
         self.client_node2.inspect_container = MagicMock(side_effect=lambda container_id:
                                                         self.__get_container(self.__inspect_container_cmd_return_node2,
                                                                              container_id))
-        self.client_node2.logs = MagicMock(side_effect=__logs)
+        self.client_node2._get = MagicMock(side_effect=__logs)
+        self.client_node2.stop = MagicMock()
+        self.client_node2.remove_container = MagicMock()
 
         self.client_node3 = MagicMock()
+        self.client_node3.base_url = "http://node-3"
         self.client_node3.containers = MagicMock(side_effect=ConnectionError())
         self.client_node3.inspect_container = MagicMock(side_effect=ConnectionError())
-        self.client_node3.logs = MagicMock(side_effect=__logs)
+        self.client_node3._get = MagicMock(side_effect=__logs)
 
     def mock_two_docker_nodes(self, docker_client):
         docker_client.side_effect = self.__side_effect
@@ -54,7 +115,8 @@ class ClientMock():
         try:
             return data[container_id]
         except KeyError as e:
-            raise docker.errors.APIError(e, "dummy", explanation="No such container: {}".format(container_id))
+            raise docker.errors.APIError("404 Client Error: Not Found", MagicMock(status_code=404, reason="Not Found"),
+                                         explanation="No such container: {}".format(container_id))
 
     __containers_cmd_return_node1 = [
         {u'Command': u'/runner/init start web',
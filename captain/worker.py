@@ -0,0 +1,40 @@
+import logging
+import threading
+
+
+class PeriodicWorker(object):
+    """
+    Calls a target function every interval_secs on a daemon thread until stopped.
+    Exceptions raised by the target are logged and do not stop the worker.
+    """
+
+    def __init__(self, name, target, interval_secs):
+        self.logger = logging.getLogger(__name__)
+        self.name = name
+        self.target = target
+        self.interval_secs = interval_secs
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self.__run, name=self.name)
+        self.thread.daemon = True
+        self.thread.start()
+        self.logger.debug(dict(message="Started {} with an interval of {}s".format(self.name, self.interval_secs)))
+
+    def stop(self):
+        self.stop_event.set()
+
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive() and not self.stop_event.is_set()
+
+    def __run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.target()
+            except Exception as e:
+                self.logger.exception(dict(message="{} failed: {}".format(self.name, e)))
+            self.stop_event.wait(self.interval_secs)
+        self.logger.debug(dict(message="Stopped {}".format(self.name)))
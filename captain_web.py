@@ -1,6 +1,8 @@
+import hashlib
 import json
 import logging.config
 import socket
+from collections import Counter
 
 from flask import Flask, request, redirect, Response, current_app
 from flask.ext import restful
@@ -8,8 +10,9 @@ from flask.ext.restful import reqparse
 
 from captain import exceptions
 from captain.config import Config
-from captain.connection import Connection
+from captain.connection import Connection, min_instance_id_prefix_length
 from captain.docker_node import DockerNodeResolverFactory
+from captain.jsonstream import iter_json_array
 
 app_config = Config()
 
@@ -33,23 +36,141 @@ def get_captain_conn():
     return persistent_captain_conn
 
 
+def inventory_headers(captain_conn):
+    inventory_age = captain_conn.get_inventory_age()
+    if inventory_age is None:
+        return {}
+    headers = {"X-Inventory-Age": "{:.3f}".format(inventory_age)}
+    if captain_conn.is_inventory_stale():
+        headers["X-Inventory-Stale"] = "true"
+    return headers
+
+
+def conditional_response(data, headers=None, version=None):
+    """
+    Tags data with an ETag, answering 304 Not Modified if the client already has it. The ETag is derived from
+    version when given, otherwise from a hash of the data.
+    """
+    if version is not None:
+        etag = "v-{}".format(version)
+    else:
+        etag = "h-{}".format(hashlib.md5(json.dumps(data, sort_keys=True)).hexdigest())
+    headers = dict(headers or {}, ETag='"{}"'.format(etag))
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+    return data, 200, headers
+
+
+def streamed_list_response(items, headers=None, version=None):
+    """
+    Streams the list as a JSON array a chunk at a time. It is tagged with an ETag only when there is a version,
+    hashing the content would mean encoding all of it before the first byte could be sent.
+    """
+    headers = dict(headers or {})
+    if version is not None:
+        headers["ETag"] = '"v-{}"'.format(version)
+    return Response(iter_json_array(items), mimetype='application/json', headers=headers)
+
+
+def not_modified_response(version, headers=None):
+    """
+    Returns a 304 Not Modified if the client already has version, before anything is fetched, otherwise None.
+    """
+    if version is None or not request.if_none_match.contains("v-{}".format(version)):
+        return None
+    return Response(status=304, headers=dict(headers or {}, ETag='"v-{}"'.format(version)))
+
+
 class RestCache(restful.Resource):
     def get(self):
         logger.debug(dict(message='Getting cached instance data'))
         captain_conn = get_captain_conn()
-        return captain_conn._get_lru_instance_details.cache_info()._asdict()
+        return captain_conn.get_cache_stats()
 
     def delete(self):
-        logger.debug(dict(message='Clearing lru cache'))
+        logger.debug(dict(message='Clearing inspect cache'))
+        captain_conn = get_captain_conn()
+        return captain_conn.clear_cache()
+
+
+class RestGarbageCollector(restful.Resource):
+    def get(self):
+        logger.debug(dict(message='Getting garbage collection stats'))
+        captain_conn = get_captain_conn()
+        return captain_conn.get_gc_stats()
+
+
+class RestConnections(restful.Resource):
+    def get(self):
+        logger.debug(dict(message='Getting docker connection pool stats'))
+        captain_conn = get_captain_conn()
+        return captain_conn.get_connection_stats()
+
+
+class RestLogStreams(restful.Resource):
+    def get(self):
+        logger.debug(dict(message='Getting shared log stream stats'))
+        captain_conn = get_captain_conn()
+        return captain_conn.get_log_stream_stats()
+
+
+class RestChangelog(restful.Resource):
+    def get(self):
+        logger.debug(dict(message='Getting instance changelog stats'))
         captain_conn = get_captain_conn()
-        return captain_conn._get_lru_instance_details.cache_clear()
+        return captain_conn.get_changelog_stats()
+
+
+class RestExecutor(restful.Resource):
+    def get(self):
+        logger.debug(dict(message='Getting fan out executor stats'))
+        captain_conn = get_captain_conn()
+        return captain_conn.get_executor_stats()
+
+
+class RestInventory(restful.Resource):
+    def get(self):
+        logger.debug(dict(message='Getting inventory stats'))
+        captain_conn = get_captain_conn()
+        return captain_conn.get_inventory_stats()
 
 
 class RestInstances(restful.Resource):
     def get(self):
-        logger.debug(dict(message='Getting instances'))
+        parser = reqparse.RequestParser()
+        parser.add_argument('watch', type=int, location='args', default=0)
+        parser.add_argument('token', type=str, location='args')
+        parser.add_argument('app', type=str, location='args')
+        parser.add_argument('node', type=str, location='args', action='append')
+        parser.add_argument('fields', type=str, location='args')
+        parser.add_argument('limit', type=int, location='args')
+        parser.add_argument('cursor', type=str, location='args')
+        args = parser.parse_args()
+
         captain_conn = get_captain_conn()
-        return captain_conn.get_instances()
+        if args.watch == 1:
+            logger.debug(dict(message='Watching instances from token {}'.format(args.token)))
+            events = captain_conn.watch_instances(args.token)
+            return Response(("{}\n".format(json.dumps(e)) for e in events), mimetype='application/jsonstream')
+
+        logger.debug(dict(message='Getting instances'))
+        # The version is read before the instances, so a change in between is never hidden behind an old ETag
+        version = captain_conn.get_inventory_version()
+        not_modified = not_modified_response(version, inventory_headers(captain_conn))
+        if not_modified is not None:
+            return not_modified
+        if args.app is None and args.node is None and args.fields is None and args.limit is None and args.cursor is None:
+            return streamed_list_response(captain_conn.get_instances(), inventory_headers(captain_conn), version)
+
+        if args.limit is not None and args.limit < 1:
+            restful.abort(400, description="limit must be at least 1")
+        fields = [field.strip() for field in args.fields.split(",") if field.strip()] if args.fields else None
+        instances, next_cursor = captain_conn.find_instances(app=args.app, nodes=args.node, fields=fields,
+                                                             limit=args.limit, after=args.cursor)
+        headers = inventory_headers(captain_conn)
+        if next_cursor is not None:
+            headers["X-Next-Cursor"] = next_cursor
+        return streamed_list_response(instances, headers, version)
 
     def post(self):
         logger.debug(dict(message='Starting instance'))
@@ -62,24 +183,119 @@ class RestInstances(restful.Resource):
             instance_response = captain_conn.start_instance(**instance_request)
             logger.debug(dict(message='Started instance: {}'.format(instance_response)))
         except exceptions.NodeOutOfCapacityException:
-            logger.error("There aren't enough free slots on {} to service your request".format(instance_request['node']))
-            restful.abort(503, description="There aren't enough free slots on {} to service your request".format(instance_request['node']))
+            node = instance_request.get('node') or 'any node'
+            logger.error("There aren't enough free slots on {} to service your request".format(node))
+            restful.abort(503, description="There aren't enough free slots on {} to service your request".format(node))
 
         return instance_response, 201
 
+    def delete(self):
+        parser = reqparse.RequestParser()
+        parser.add_argument('app', type=str, location='args')
+        parser.add_argument('node', type=str, location='args')
+        parser.add_argument('id', type=str, location='args', action='append')
+        parser.add_argument('grace', type=int, location='args')
+        args = parser.parse_args()
+
+        instance_ids = args.id
+        if request.json:
+            if not isinstance(request.json, list):
+                restful.abort(400, description="The body must be a list of instance ids")
+            instance_ids = (instance_ids or []) + request.json
+        for instance_id in instance_ids or []:
+            # A short prefix would stop whichever instance happens to match it
+            if not isinstance(instance_id, basestring) or len(instance_id) < min_instance_id_prefix_length:
+                restful.abort(400, description="Instance ids must be at least {} characters long".format(min_instance_id_prefix_length))
+        if args.app is None and args.node is None and not instance_ids:
+            restful.abort(400, description="At least one of app, node or id must be given")
+        logger.debug(dict(message='Stopping instances matching app {}, node {} and ids {}'.format(args.app, args.node, instance_ids)))
+
+        captain_conn = get_captain_conn()
+        # Never stop the instance serving this request
+        results = captain_conn.stop_instances(app=args.app, node=args.node, instance_ids=instance_ids, timeout=args.grace,
+                                              protected_prefix=socket.gethostname())
+        summary = Counter(result["status"] for result in results)
+        logger.info(dict(message='Stopped {} of {} instances'.format(summary["stopped"], len(results))))
+        return {"stopped": summary["stopped"],
+                "failed": summary["failed"],
+                "not_found": summary["not_found"],
+                "skipped": summary["skipped"],
+                "ambiguous": summary["ambiguous"],
+                "results": results}
+
+
+class RestInstanceChanges(restful.Resource):
+    def get(self):
+        parser = reqparse.RequestParser()
+        parser.add_argument('since', type=str, location='args')
+        args = parser.parse_args()
+
+        logger.debug(dict(message='Getting instance changes since {}'.format(args.since)))
+        captain_conn = get_captain_conn()
+        changes = captain_conn.get_instance_changes(args.since)
+        if changes["resync"]:
+            logger.info(dict(message='Sending a resync of every instance for changes since {}'.format(args.since)))
+        return changes, 200, inventory_headers(captain_conn)
+
+
+class RestInstancesBatch(restful.Resource):
+    def post(self):
+        logger.debug(dict(message='Starting batch of instances'))
+        if not request.json:
+            restful.abort(400)
+
+        # A bare list is taken as the list of instances
+        batch_request = {"instances": request.json} if isinstance(request.json, list) else request.json
+        if not isinstance(batch_request, dict):
+            restful.abort(400, description="The body must be a list of start requests or an object")
+        batch_request = dict(batch_request)
+        max_instances = app_config.batch_max_instances
+        if "instances" in batch_request:
+            instance_requests = batch_request["instances"]
+            if not isinstance(instance_requests, list) or not 1 <= len(instance_requests) <= max_instances \
+                    or not all(isinstance(instance_request, dict) for instance_request in instance_requests):
+                restful.abort(400, description="instances must be a list of 1 to {} start requests".format(max_instances))
+        elif "count" in batch_request:
+            count = batch_request.pop("count")
+            # bool is an int too, but true isn't a count
+            if not isinstance(count, int) or isinstance(count, bool) or not 1 <= count <= max_instances:
+                restful.abort(400, description="count must be a whole number from 1 to {}".format(max_instances))
+            instance_requests = [batch_request] * count
+        else:
+            restful.abort(400, description="Either a list of instances or an app and count must be given")
+
+        captain_conn = get_captain_conn()
+        results = captain_conn.start_instances(instance_requests)
+        started = len([result for result in results if result["status"] == "started"])
+        logger.info(dict(message='Started {} of {} instances in batch'.format(started, len(results))))
+
+        if started == len(results):
+            status = 201
+        elif started == 0:
+            status = 503
+        else:
+            status = 207
+        return {"started": started, "failed": len(results) - started, "results": results}, status
+
 
 class RestInstance(restful.Resource):
     def get(self, instance_id):
-        try:
-            logger.debug(dict(message='Getting instance data for {}'.format(instance_id)))
-            captain_conn = get_captain_conn()
-            return filter(lambda instance: instance["id"] == instance_id, captain_conn.get_instances())[0]
-        except IndexError:
+        logger.debug(dict(message='Getting instance data for {}'.format(instance_id)))
+        captain_conn = get_captain_conn()
+        instance = captain_conn.get_instance(instance_id)
+        if instance is None:
             restful.abort(404)
+        return conditional_response(instance, inventory_headers(captain_conn))
 
     def delete(self, instance_id):
         logger.debug(dict(message='Stopping instance {}'.format(instance_id)))
-        if instance_id.startswith(socket.gethostname()):
+        captain_conn = get_captain_conn()
+        # Ids are resolved by prefix, so check the full id of the instance it resolves to
+        instance = captain_conn.find_instance(instance_id)
+        if instance is None:
+            logger.error(dict(message='Issue stopping {}, no such instance'.format(instance_id)))
+            restful.abort(404)
+        if instance["id"].startswith(socket.gethostname()):
             logger.warn(dict(message='Sending redirect as a captain instance has been asked to stop itself {}'.format(instance_id)))
             # My hostname is the short container ID.
             # I've just been asked to kill myself.
@@ -90,8 +306,7 @@ class RestInstance(restful.Resource):
                     instance_id=instance_id,
                 ), code=307)
 
-        captain_conn = get_captain_conn()
-        stopped = captain_conn.stop_instance(instance_id)
+        stopped = captain_conn.stop_instance(instance["id"])
 
         if stopped:
             logger.debug(dict(message='Stopped {}'.format(instance_id)))
@@ -105,16 +320,47 @@ class RestInstanceLogs(restful.Resource):
     def get(self, instance_id):
         parser = reqparse.RequestParser()
         parser.add_argument('follow', type=int, location='args', default=0)
+        parser.add_argument('tail', type=int, location='args')
+        parser.add_argument('since', type=int, location='args')
+        parser.add_argument('timestamps', type=int, location='args', default=0)
+        parser.add_argument('batch', type=int, location='args', default=0)
         args = parser.parse_args()
 
         try:
             captain_conn = get_captain_conn()
-            r = Response(("{}\n".format(json.dumps(l)) for l in captain_conn.get_logs(instance_id, follow=args.follow == 1)), mimetype='application/jsonstream')
+            log_args = dict(follow=args.follow == 1, tail=args.tail, since=args.since, timestamps=args.timestamps == 1)
+            if request.accept_mimetypes.best_match(['application/jsonstream', 'text/plain']) == 'text/plain':
+                # Raw passthrough, the log is written as docker sent it without any per line encoding
+                log_batches = captain_conn.get_log_batches(instance_id, **log_args)
+                return Response(("".join(b) for b in log_batches), mimetype='text/plain')
+            if args.batch == 1:
+                log_batches = captain_conn.get_log_batches(instance_id, **log_args)
+                return Response(("{}\n".format(json.dumps({"msgs": b})) for b in log_batches), mimetype='application/jsonstream')
+            instance_logs = captain_conn.get_logs(instance_id, **log_args)
+            r = Response(("{}\n".format(json.dumps(l)) for l in instance_logs), mimetype='application/jsonstream')
             return r
         except exceptions.NoSuchInstanceException:
             restful.abort(404)
 
 
+class RestAppLogs(restful.Resource):
+    def get(self, app):
+        parser = reqparse.RequestParser()
+        parser.add_argument('follow', type=int, location='args', default=0)
+        parser.add_argument('tail', type=int, location='args')
+        parser.add_argument('since', type=int, location='args')
+        parser.add_argument('timestamps', type=int, location='args', default=0)
+        args = parser.parse_args()
+
+        try:
+            captain_conn = get_captain_conn()
+            app_logs = captain_conn.get_app_logs(app, follow=args.follow == 1, tail=args.tail, since=args.since,
+                                                 timestamps=args.timestamps == 1)
+            return Response(("{}\n".format(json.dumps(l)) for l in app_logs), mimetype='application/jsonstream')
+        except exceptions.NoSuchAppException:
+            restful.abort(404)
+
+
 class RestPing(restful.Resource):
     def get(self):
         return ({}, 204)
@@ -124,14 +370,21 @@ class RestInstancesSummary(restful.Resource):
     def get(self):
         logger.debug(dict(message='getting summary of running instances on all nodes'))
         captain_conn = get_captain_conn()
+        version = captain_conn.get_inventory_version()
+        not_modified = not_modified_response(version, inventory_headers(captain_conn))
+        if not_modified is not None:
+            return not_modified
         summary = captain_conn.get_instance_summary()
         logger.debug(dict(message='instance summary {}'.format(summary)))
-        return summary
+        return conditional_response(summary, inventory_headers(captain_conn), version)
 
 
 api.add_resource(RestInstances, '/instances/')
+api.add_resource(RestInstancesBatch, '/instances/batch')
+api.add_resource(RestInstanceChanges, '/instances/changes')
 api.add_resource(RestInstance, '/instances/<string:instance_id>')
 api.add_resource(RestInstanceLogs, '/instances/<string:instance_id>/logs')
+api.add_resource(RestAppLogs, '/apps/<string:app>/logs')
 api.add_resource(RestPing, '/ping/ping')
 api.add_resource(RestInstancesSummary, '/instances_summary/')
 
@@ -141,7 +394,8 @@ class RestNodes(restful.Resource):
         captain_conn = get_captain_conn()
         nodes = captain_conn.get_nodes()
         logger.debug(dict(message='Got all nodes {}'.format(nodes)))
-        return nodes
+        # One entry per node is cheap to hash, so unlike /instances/ the list is tagged rather than streamed
+        return conditional_response(nodes)
 
 
 class RestNode(restful.Resource):
@@ -150,13 +404,23 @@ class RestNode(restful.Resource):
             captain_conn = get_captain_conn()
             node =  captain_conn.get_node(node_id)
             logger.debug(dict(message='Got node details: {}'.format(node)))
-            return node
+            return conditional_response(node)
         except exceptions.NoSuchNodeException:
             restful.abort(404)
 
 api.add_resource(RestNodes, '/nodes/')
 api.add_resource(RestNode, '/nodes/<string:node_id>')
 api.add_resource(RestCache, '/cache')
+api.add_resource(RestInventory, '/inventory')
+api.add_resource(RestGarbageCollector, '/gc')
+api.add_resource(RestExecutor, '/executor')
+api.add_resource(RestConnections, '/connections')
+api.add_resource(RestLogStreams, '/logstreams')
+api.add_resource(RestChangelog, '/changelog')
+
+if app_config.node_warm_up_enabled:
+    with app.app_context():
+        get_captain_conn().warm_up()
 
 if __name__ == '__main__':
     app.run(debug=True, port=1234)